@@ -0,0 +1,250 @@
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+from cache import P2CCache
+from parser import P2CParser
+
+# the warm parser and the cache of a worker process, see init_worker
+_parser = None
+_cache = None
+_opt_level = 0
+
+
+def init_worker(opt_level, cache_dir=None, cache_bytes=None):
+    # the parser tables are loaded once per worker, not once per file
+    global _parser, _cache, _opt_level
+    _parser = P2CParser()
+    _cache = None
+    if cache_dir is not None:
+        # without a size the cache keeps its default one
+        _cache = P2CCache(cache_dir) if cache_bytes is None else P2CCache(cache_dir, cache_bytes)
+        _cache.parser = _parser
+    _opt_level = opt_level
+
+
+def compile_file(job):
+    # never raises, a file that does not compile is reported and the batch goes on
+    source, target = job
+    result = {'source': source, 'target': target, 'ok': False, 'cached': False, 'error': None,
+              'seconds': 0.0, 'bytes': 0, 'lines': 0}
+    start = time.perf_counter()
+    try:
+        with open(source) as _input:
+            code = _input.read()
+        result['bytes'] = len(code.encode())
+        result['lines'] = code.count('\n') + 1
+        if _cache is None:
+            _parser.parse(code)
+            c_code = _parser.generate_three_address_code(opt_level=_opt_level)
+        else:
+            hits = _cache.hits
+            c_code = _cache.compile(code, _opt_level)
+            result['cached'] = _cache.hits > hits
+        # written once the code is generated, a file that fails leaves no half written target
+        with open(target, 'w') as _out:
+            _out.write(c_code)
+        result['ok'] = True
+    except Exception as e:
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def target_name(path):
+    # program.py.txt -> program.c
+    name = os.path.basename(path)
+    for suffix in ('.py.txt', '.txt', '.py'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)] + '.c'
+    return name + '.c'
+
+
+def collect_jobs(inputs, manifests=(), pattern='*.py.txt', out_dir=None):
+    """
+    (source, target) for every program given as a file, a directory searched
+    recursively for pattern, a glob or a line of a manifest file. The C code is
+    written next to the source, or into out_dir keeping the layout of the
+    directories that were searched.
+    """
+    found = []
+    paths = list(inputs)
+    for manifest in manifests:
+        with open(manifest) as _manifest:
+            base = os.path.dirname(manifest)
+            for line in _manifest:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    paths.append(os.path.join(base, line))
+
+    for path in paths:
+        if os.path.isdir(path):
+            for source in sorted(glob.glob(os.path.join(path, '**', pattern), recursive=True)):
+                found.append((source, os.path.relpath(os.path.dirname(source), path)))
+        elif glob.has_magic(path):
+            found.extend((source, '') for source in sorted(glob.glob(path, recursive=True)))
+        else:
+            found.append((path, ''))
+
+    jobs = []
+    seen = set()
+    for source, directory in found:
+        if source in seen:
+            continue
+        seen.add(source)
+        if out_dir is None:
+            target = os.path.join(os.path.dirname(source), target_name(source))
+        else:
+            target = os.path.normpath(os.path.join(out_dir, directory, target_name(source)))
+        jobs.append((source, target))
+    return jobs
+
+
+def compile_batch(jobs, workers=None, opt_level=0, cache_dir=None, cache_bytes=None):
+    # results in the order of the jobs
+    workers = workers or os.cpu_count() or 1
+    for target in set(os.path.dirname(target) for _, target in jobs):
+        if target:
+            os.makedirs(target, exist_ok=True)
+
+    if workers == 1:
+        init_worker(opt_level, cache_dir, cache_bytes)
+        return [compile_file(job) for job in jobs]
+
+    # small programs compile in well under a millisecond, they are sent to the workers in chunks
+    chunk_size = max(1, len(jobs) // (workers * 8))
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker,
+                                                initargs=(opt_level, cache_dir, cache_bytes)) as executor:
+        return list(executor.map(compile_file, jobs, chunksize=chunk_size))
+
+
+def summarize(results, seconds):
+    compiled = [result for result in results if result['ok']]
+    total_bytes = sum(result['bytes'] for result in compiled)
+    total_lines = sum(result['lines'] for result in compiled)
+    return {
+        'files': len(results),
+        'compiled': len(compiled),
+        'failed': len(results) - len(compiled),
+        'cached': sum(1 for result in compiled if result['cached']),
+        'seconds': seconds,
+        'compile_seconds': sum(result['seconds'] for result in results),
+        'files_per_second': len(compiled) / seconds if seconds else 0.0,
+        'lines_per_second': total_lines / seconds if seconds else 0.0,
+        'bytes_per_second': total_bytes / seconds if seconds else 0.0,
+    }
+
+
+def test_batch():
+    import shutil
+    import tempfile
+
+    good = "a = 2\nwhile a < 10: { a = a * 3 }\nprint(\"%f\\n\" a)\n"
+    directory = tempfile.mkdtemp()
+    try:
+        os.makedirs(os.path.join(directory, 'src', 'nested'))
+        sources = {'src/good.py.txt': good, 'src/bad.py.txt': "a = (1 +\n", 'src/nested/other.py.txt': good,
+                   'programs.txt': "# one program per line\nsrc/good.py.txt\n\nsrc/missing.py.txt\n"}
+        for name, code in sources.items():
+            with open(os.path.join(directory, name), 'w') as f:
+                f.write(code)
+        src, out = os.path.join(directory, 'src'), os.path.join(directory, 'out')
+
+        # a directory keeps its layout in out_dir, a glob and a manifest do not, a program is compiled once
+        jobs = collect_jobs([src], out_dir=out)
+        if [(os.path.relpath(source, src), os.path.relpath(target, out)) for source, target in jobs] != \
+                [('bad.py.txt', 'bad.c'), ('good.py.txt', 'good.c'), ('nested/other.py.txt', 'nested/other.c')]:
+            return False
+        jobs = collect_jobs([os.path.join(src, '*.py.txt')], [os.path.join(directory, 'programs.txt')])
+        if [os.path.relpath(source, src) for source, _ in jobs] != ['bad.py.txt', 'good.py.txt', 'missing.py.txt']:
+            return False
+        if jobs[1][1] != os.path.join(src, 'good.c'):
+            return False
+
+        # a program that does not compile or is missing is reported, the others are still compiled
+        init_worker(0)
+        result = compile_file((os.path.join(src, 'bad.py.txt'), os.path.join(out, 'bad.c')))
+        if result['ok'] or not result['error'].startswith('P2CSyntaxError') or os.path.exists(result['target']):
+            return False
+        _parser = P2CParser()
+        _parser.parse(good)
+        expected = _parser.generate_three_address_code()
+        for workers in (1, 2):
+            results = compile_batch(collect_jobs([src], out_dir=out), workers)
+            if [result['ok'] for result in results] != [False, True, True]:
+                return False
+            for target in ('good.c', 'nested/other.c'):
+                with open(os.path.join(out, target)) as f:
+                    if f.read() != expected:
+                        return False
+        # with a cache and no size, nested/other.py.txt is good.py.txt again, the second batch is all cached
+        for cached in ([False, False, True], [False, True, True]):
+            results = compile_batch(collect_jobs([src], out_dir=out), 1, cache_dir=os.path.join(directory, 'cache'))
+            if [result['ok'] for result in results] != [False, True, True] or \
+                    [result['cached'] for result in results] != cached:
+                return False
+        with contextlib.redirect_stdout(io.StringIO()) as _out:
+            status = main(['-q', '-j', '2', '-m', os.path.join(directory, 'programs.txt')])
+        return status == 1 and "2 files, 1 compiled (0 cached), 1 failed" in _out.getvalue()
+    finally:
+        shutil.rmtree(directory)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="compile many programs to C on a pool of processes")
+    arg_parser.add_argument('inputs', nargs='*', help="programs, directories or globs")
+    arg_parser.add_argument('-m', '--manifest', action='append', default=[],
+                            help="a file listing one program per line, relative to the file")
+    arg_parser.add_argument('-p', '--pattern', default='*.py.txt',
+                            help="the programs searched for in directories (default: %(default)s)")
+    arg_parser.add_argument('-o', '--out-dir', help="write the C code here instead of next to the programs")
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: cpu count)")
+    arg_parser.add_argument('-O', dest='opt_level', type=int, choices=[0, 1, 2], default=0,
+                            help="optimization level")
+    arg_parser.add_argument('--cache', metavar='DIR', help="reuse the C code compiled before from this directory")
+    arg_parser.add_argument('--cache-size', type=int, default=64, metavar='MB',
+                            help="the cache directory is kept under this size (default: %(default)s)")
+    arg_parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    arg_parser.add_argument('-q', '--quiet', action='store_true', help="only report failures and the totals")
+    arg_parser.add_argument('--test', action='store_true', help="only run the test of the batch compiler")
+    args = arg_parser.parse_args(argv)
+
+    if args.test:
+        if not test_batch():
+            raise Exception("[BATCH] Batch compilation test failed")
+        return 0
+
+    jobs = collect_jobs(args.inputs, args.manifest, args.pattern, args.out_dir)
+    if not jobs:
+        arg_parser.error("no programs to compile")
+
+    start = time.perf_counter()
+    results = compile_batch(jobs, args.jobs, args.opt_level, args.cache, args.cache_size * 1024 * 1024)
+    summary = summarize(results, time.perf_counter() - start)
+
+    if args.json:
+        json.dump({'files': results, 'summary': summary}, sys.stdout, indent=2)
+        print()
+    else:
+        for result in results:
+            if not result['ok']:
+                print("FAIL %s: %s" % (result['source'], result['error']))
+            elif not args.quiet:
+                rate = result['lines'] / result['seconds'] if result['seconds'] else 0.0
+                print("%-4s %s -> %s  %.3f ms  %.0f lines/s"
+                      % ('hit' if result['cached'] else 'ok', result['source'], result['target'],
+                         result['seconds'] * 1000, rate))
+        print("%d files, %d compiled (%d cached), %d failed in %.3f s: %.1f files/s, %.0f lines/s, %.0f bytes/s"
+              % (summary['files'], summary['compiled'], summary['cached'], summary['failed'], summary['seconds'],
+                 summary['files_per_second'], summary['lines_per_second'], summary['bytes_per_second']))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from cache import compiler_fingerprint
+from fold import inner_bodies
+from lexer import get_lexer
+from parser import P2CParser
+from scanner import P2CTokenArrays
+
+# the sizes of the programs compiled by default
+SIZES = ('1K', '10K', '100K', '1M', '10M', '100M')
+UNITS = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+# a phase that is slower than in the run compared with by more than this is a regression,
+# when it is also slower by more than MIN_SECONDS, the phases of small programs are mostly noise
+THRESHOLD = 0.10
+MIN_SECONDS = 0.005
+# the sizes of the programs run with --runtime, and how often the program runs in one run of the binary
+RUNTIME_SIZES = ('1K', '10K', '100K')
+ITERATIONS = 10000
+
+
+def parse_size(text):
+    # '64K' -> 65536
+    text = text.strip().upper()
+    if text[-1:] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+class P2CProgramGenerator(object):
+    """
+    Programs of the language for the benchmarks: assignments, long arithmetic,
+    prints, if/elif/else chains, while loops and for loops over a range, nested
+    up to max_depth. The same seed gives the same program. Loops terminate, so
+    the C code can be run as well.
+    """
+
+    def __init__(self, seed=0, variables=16, max_depth=3):
+        self.random = random.Random(seed)
+        self.variables = ['v%d' % i for i in range(variables)]
+        self.max_depth = max_depth
+
+    def operand(self):
+        r = self.random.random()
+        if r < 0.6:
+            return self.random.choice(self.variables)
+        if r < 0.9:
+            return str(self.random.randint(0, 99))
+        return '%d.%d' % (self.random.randint(0, 9), self.random.randint(1, 9))
+
+    def expression(self, length):
+        # length operands joined by operators, some of them in parentheses
+        _random = self.random
+        parts = [self.operand()]
+        for _ in range(length - 1):
+            parts.append(_random.choice(('+', '-', '*', '/', '+', '*')))
+            if _random.random() < 0.1:
+                parts.append('(%s %s %s)' % (self.operand(), _random.choice(('+', '-', '*')), self.operand()))
+            else:
+                parts.append(self.operand())
+        if _random.random() < 0.05:
+            parts[0] = '-' + parts[0]
+        return ' '.join(parts)
+
+    def condition(self):
+        _random = self.random
+        condition = '%s %s %s' % (self.expression(_random.randint(1, 3)),
+                                  _random.choice(('<', '<=', '>', '>=', '==', '!=')), self.operand())
+        if _random.random() < 0.2:
+            condition = '(%s) %s (%s %s %s)' % (condition, _random.choice(('&&', '||', 'and', 'or')),
+                                                self.operand(), _random.choice(('<', '>')), self.operand())
+        return condition
+
+    def block(self, depth, indent):
+        lines = []
+        for _ in range(self.random.randint(1, 4)):
+            lines.extend(self.statement(depth, indent))
+        return lines
+
+    def statement(self, depth, indent):
+        # the lines of one statement
+        _random = self.random
+        pad = '    ' * indent
+        r = _random.random() if depth < self.max_depth else _random.random() * 0.55
+        if r < 0.35:
+            line = '%s%s %s %s' % (pad, _random.choice(self.variables), _random.choice(('=', '=', '+=', '-=', '*=')),
+                                   self.expression(_random.randint(1, 6)))
+            if _random.random() < 0.05:
+                line += '  # a comment'
+            return [line]
+        if r < 0.4:
+            # long arithmetic
+            return ['%s%s = %s' % (pad, _random.choice(self.variables), self.expression(_random.randint(20, 80)))]
+        if r < 0.55:
+            if _random.random() < 0.2:
+                return ['%sprint("done\\n")' % pad]
+            return ['%sprint("%%f\\n" %s)' % (pad, self.expression(_random.randint(1, 4)))]
+        if r < 0.75:
+            lines = ['%sif %s: {' % (pad, self.condition())] + self.block(depth + 1, indent + 1)
+            for _ in range(_random.randint(0, 2)):
+                lines += ['%s} elif %s: {' % (pad, self.condition())] + self.block(depth + 1, indent + 1)
+            if _random.random() < 0.5:
+                lines += ['%s} else: {' % pad] + self.block(depth + 1, indent + 1)
+            return lines + [pad + '}']
+        if r < 0.87:
+            # a counter per depth, the loops inside do not change it
+            counter = 'w%d' % depth
+            return (['%s%s = %d' % (pad, counter, _random.randint(1, 5)),
+                     '%swhile %s > 0: {' % (pad, counter)] + self.block(depth + 1, indent + 1) +
+                    ['%s    %s -= 1' % (pad, counter), pad + '}'])
+        params = _random.choice(('%d' % _random.randint(1, 5), '%d, %d' % (_random.randint(0, 3), _random.randint(3, 8)),
+                                 '0, %d, 2' % _random.randint(2, 9)))
+        return ['%sfor i%d in range(%s): {' % (pad, depth, params)] + self.block(depth + 1, indent + 1) + [pad + '}']
+
+    def generate(self, size):
+        # whole statements until the program has at least size bytes
+        chunks = ['%s = %d\n' % (name, self.random.randint(0, 9)) for name in self.variables]
+        length = sum(len(chunk) for chunk in chunks)
+        while length < size:
+            chunk = '\n'.join(self.statement(0, 0)) + '\n'
+            chunks.append(chunk)
+            length += len(chunk)
+        return ''.join(chunks)
+
+
+class P2CCountingWriter(object):
+    # stands in for the output file, only the characters written are kept count of
+    def __init__(self):
+        self.count = 0
+
+    def write(self, text):
+        self.count += len(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.count += len(line)
+
+
+def count_statements(tree):
+    # every statement, the ones in bodies too
+    count = 0
+    work = [tree]
+    while work:
+        body = work.pop()
+        count += len(body or [])
+        work.extend(inner_bodies(body))
+    return count
+
+
+def peak_memory():
+    # the peak resident size of this process in bytes, None where it is not known
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(case):
+    # one program at one optimization level, best of the repeats for every phase
+    size, seed, opt_level, repeat = case
+    get_lexer()
+    _parser = P2CParser()
+
+    source = P2CProgramGenerator(seed).generate(size).encode()
+    result = {'size': size, 'seed': seed, 'opt_level': opt_level, 'bytes': len(source),
+              'lines': source.count(b'\n'), 'lex_seconds': None, 'parse_seconds': None, 'codegen_seconds': None}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        arrays = P2CTokenArrays(source)
+        lexed = time.perf_counter()
+        _parser.parse_arrays(arrays)
+        parsed = time.perf_counter()
+        writer = P2CCountingWriter()
+        _parser.generate_three_address_code(writer, opt_level=opt_level)
+        generated = time.perf_counter()
+
+        for phase, seconds in (('lex', lexed - start), ('parse', parsed - lexed), ('codegen', generated - parsed)):
+            key = phase + '_seconds'
+            if result[key] is None or seconds < result[key]:
+                result[key] = seconds
+
+    result['tokens'] = len(arrays)
+    result['statements'] = count_statements(_parser.parse_tree)
+    result['c_bytes'] = writer.count
+    result['seconds'] = result['lex_seconds'] + result['parse_seconds'] + result['codegen_seconds']
+    result['lex_tokens_per_second'] = rate(result['tokens'], result['lex_seconds'])
+    result['parse_tokens_per_second'] = rate(result['tokens'], result['parse_seconds'])
+    result['parse_statements_per_second'] = rate(result['statements'], result['parse_seconds'])
+    result['codegen_statements_per_second'] = rate(result['statements'], result['codegen_seconds'])
+    result['statements_per_second'] = rate(result['statements'], result['seconds'])
+    result['bytes_per_second'] = rate(result['bytes'], result['seconds'])
+    result['pass_seconds'] = _parser.timings
+    result['peak_memory'] = peak_memory()
+    return result
+
+
+def rate(count, seconds):
+    return count / seconds if seconds else 0.0
+
+
+def run_runtime(size, opt_level=0, seed=0, repeat=1, iterations=ITERATIONS, cc=None, cflags=('-O2',)):
+    """
+    Times the binaries of a generated program, compiled by cc (by default
+    $CC or cc) from the C code with gotos and from the one with structured
+    loops and branches. The program runs iterations times in a loop, its
+    output goes to /dev/null. The binaries are run once more to check that
+    they print the same.
+    """
+    cc = cc or os.environ.get('CC', 'cc')
+    _parser = P2CParser()
+    program = P2CProgramGenerator(seed).generate(size)
+    _parser.parse('for r in range(%d): {\n%s}\n' % (iterations, program))
+    result = {'size': size, 'seed': seed, 'opt_level': opt_level, 'iterations': iterations, 'cc': cc,
+              'cflags': ' '.join(cflags)}
+    outputs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for form in ('goto', 'structured'):
+            c_code = _parser.generate_three_address_code(opt_level=opt_level, structured=form == 'structured')
+            c_path = os.path.join(directory, form + '.c')
+            binary = os.path.join(directory, form)
+            with open(c_path, 'w') as _out:
+                _out.write(c_code)
+            start = time.perf_counter()
+            subprocess.run([cc] + list(cflags) + ['-o', binary, c_path], check=True)
+            result[form + '_compile_seconds'] = time.perf_counter() - start
+            result[form + '_seconds'] = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                subprocess.run([binary], stdout=subprocess.DEVNULL, check=True)
+                seconds = time.perf_counter() - start
+                if result[form + '_seconds'] is None or seconds < result[form + '_seconds']:
+                    result[form + '_seconds'] = seconds
+            outputs.append(subprocess.run([binary], stdout=subprocess.PIPE, check=True).stdout)
+            if form == 'structured':
+                # the code falls back to gotos when its control flow has no structured form
+                result['structured'] = 'goto ' not in c_code
+    result['same_output'] = outputs[0] == outputs[1]
+    result['speedup'] = result['goto_seconds'] / result['structured_seconds'] if result['structured_seconds'] else 0.0
+    return result
+
+
+def run_benchmarks(sizes, opt_levels=(0,), seed=0, repeat=1, isolate=True):
+    """
+    Compiles a generated program of every size at every level. Every case runs
+    in a process of its own unless isolate is false, so its peak memory is its
+    own and not the one of the largest case before it.
+    """
+    cases = [(size, seed, opt_level, repeat) for size in sizes for opt_level in opt_levels]
+    if not isolate:
+        return [run_case(case) for case in cases]
+    results = []
+    for case in cases:
+        with concurrent.futures.ProcessPoolExecutor(1) as executor:
+            results.append(executor.submit(run_case, case).result())
+    return results
+
+
+def report(results):
+    return {
+        'version': 1,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'compiler': compiler_fingerprint().hex()[:16],
+        'cases': results,
+    }
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    The phases of the cases in both runs, matched by size, seed and level, as
+    (case, phase, seconds before, seconds now), and the regressions among them.
+    """
+    before = dict(((case['size'], case['seed'], case['opt_level']), case) for case in baseline['cases'])
+    changes = []
+    for case in results:
+        old = before.get((case['size'], case['seed'], case['opt_level']))
+        if old is None:
+            continue
+        for phase in ('lex', 'parse', 'codegen'):
+            changes.append((case, phase, old[phase + '_seconds'], case[phase + '_seconds']))
+    regressions = [change for change in changes
+                   if change[3] > change[2] * (1 + threshold) and change[3] - change[2] > MIN_SECONDS]
+    return changes, regressions
+
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= UNITS[unit] and size % UNITS[unit] == 0:
+            return '%d%s' % (size // UNITS[unit], unit)
+    return str(size)
+
+
+def test_benchmark():
+    # the generator is seeded and its programs compile, the report has every phase
+    program = P2CProgramGenerator(7).generate(20000)
+    if program != P2CProgramGenerator(7).generate(20000) or program == P2CProgramGenerator(8).generate(20000):
+        return False
+    if '\nwhile' not in program or '\nfor' not in program or 'elif' not in program or 'print' not in program:
+        return False
+
+    results = run_benchmarks([4096, 20000], (0, 2), seed=7, isolate=False)
+    for result in results:
+        if result['bytes'] < result['size'] or not result['tokens'] or not result['statements'] \
+                or not result['c_bytes'] or not result['lex_tokens_per_second'] > 0:
+            return False
+    if results[2]['bytes'] != len(program.encode()) or results[2]['statements'] != results[3]['statements']:
+        return False
+
+    changes, regressions = compare(results, json.loads(json.dumps(report(results))))
+    if len(changes) != 12 or regressions:
+        return False
+
+    # the binaries of both forms print the same, where there is a C compiler
+    if shutil.which(os.environ.get('CC', 'cc')) is None:
+        return True
+    for opt_level in (0, 2):
+        result = run_runtime(2000, opt_level, seed=7, iterations=3)
+        if not result['same_output'] or not result['structured'] or not result['goto_seconds'] > 0:
+            return False
+    return True
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="time lexing, parsing and code generation of generated programs")
+    arg_parser.add_argument('-s', '--sizes',
+                            help="program sizes in bytes, K or M (default: %s, with --runtime %s)"
+                                 % (','.join(SIZES), ','.join(RUNTIME_SIZES)))
+    arg_parser.add_argument('-O', dest='opt_levels', default='0',
+                            help="optimization levels, e.g. 0,2 (default: %(default)s)")
+    arg_parser.add_argument('--seed', type=int, default=0, help="seed of the program generator")
+    arg_parser.add_argument('-r', '--repeat', type=int, default=1, help="the best of this many runs of every case")
+    arg_parser.add_argument('-o', '--output', default='benchmark.json', help="the results as JSON (default: %(default)s)")
+    arg_parser.add_argument('-c', '--compare', metavar='JSON', help="compare with the results of an earlier run")
+    arg_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                            help="a phase this much slower than before is a regression (default: %(default)s)")
+    arg_parser.add_argument('--in-process', action='store_true',
+                            help="run every case in this process, the peak memory is then the one of the largest")
+    arg_parser.add_argument('--runtime', action='store_true',
+                            help="time the binaries of the C code with gotos and with structured loops instead")
+    arg_parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                            help="with --runtime, how often the program runs in a binary (default: %(default)s)")
+    arg_parser.add_argument('--cc', help="with --runtime, the C compiler (default: $CC or cc)")
+    arg_parser.add_argument('--cflags', default='-O2', help="with --runtime, its flags (default: %(default)s)")
+    arg_parser.add_argument('--test', action='store_true', help="only run the test of the benchmark")
+    args = arg_parser.parse_args(argv)
+
+    if args.test:
+        if not test_benchmark():
+            raise Exception("[BENCH] Benchmark test failed")
+        return 0
+
+    default_sizes = RUNTIME_SIZES if args.runtime else SIZES
+    sizes = [parse_size(size) for size in (args.sizes or ','.join(default_sizes)).split(',')]
+    opt_levels = [int(level) for level in args.opt_levels.split(',')]
+    if args.runtime:
+        return main_runtime(args, sizes, opt_levels)
+
+    print("%6s %2s %10s %10s %9s %9s %9s %12s %12s %9s" % ('size', 'O', 'tokens', 'statements', 'lex s', 'parse s',
+                                                         'codegen s', 'tokens/s', 'stmts/s', 'peak MB'))
+    results = []
+    for size in sizes:
+        for opt_level in opt_levels:
+            result = run_benchmarks([size], [opt_level], args.seed, args.repeat, not args.in_process)[0]
+            results.append(result)
+            print("%6s %2d %10d %10d %9.3f %9.3f %9.3f %12.0f %12.0f %9s"
+                  % (format_size(size), opt_level, result['tokens'], result['statements'], result['lex_seconds'],
+                     result['parse_seconds'], result['codegen_seconds'], rate(result['tokens'], result['seconds']),
+                     result['statements_per_second'],
+                     '-' if result['peak_memory'] is None else '%.1f' % (result['peak_memory'] / 1024 / 1024)))
+
+    with open(args.output, 'w') as _out:
+        json.dump(report(results), _out, indent=2)
+        _out.write('\n')
+
+    if args.compare:
+        with open(args.compare) as _baseline:
+            changes, regressions = compare(results, json.load(_baseline), args.threshold)
+        for case, phase, before, now in changes:
+            print("%6s O%d %-8s %9.3f -> %9.3f s  %+6.1f%%%s"
+                  % (format_size(case['size']), case['opt_level'], phase, before, now,
+                     (now / before - 1) * 100 if before else 0.0,
+                     '  REGRESSION' if (case, phase, before, now) in regressions else ''))
+        return 1 if regressions else 0
+    return 0
+
+
+def main_runtime(args, sizes, opt_levels):
+    cc = args.cc or os.environ.get('CC', 'cc')
+    if shutil.which(cc) is None:
+        print("No C compiler %s, set --cc or CC" % cc, file=sys.stderr)
+        return 2
+    print("%6s %2s %10s %12s %9s %11s %8s" % ('size', 'O', 'goto s', 'structured s', 'speedup', 'structured', 'same'))
+    results = []
+    for size in sizes:
+        for opt_level in opt_levels:
+            result = run_runtime(size, opt_level, args.seed, args.repeat, args.iterations, cc, args.cflags.split())
+            results.append(result)
+            print("%6s %2d %10.3f %12.3f %8.2fx %11s %8s"
+                  % (format_size(size), opt_level, result['goto_seconds'], result['structured_seconds'],
+                     result['speedup'], 'yes' if result['structured'] else 'no',
+                     'yes' if result['same_output'] else 'NO'))
+
+    with open(args.output, 'w') as _out:
+        json.dump(report(results), _out, indent=2)
+        _out.write('\n')
+    return 0 if all(result['same_output'] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import collections
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+from parser import P2CParser
+
+# the grammar and the code of the compiler, computed once, see compiler_fingerprint
+_fingerprint = None
+
+
+def compiler_fingerprint():
+    # C code in the cache is only valid for the grammar and the compiler that produced it
+    global _fingerprint
+    if _fingerprint is None:
+        _hash = hashlib.sha256(P2CParser.grammar_signature().encode())
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+            with open(path, 'rb') as _file:
+                _hash.update(_file.read())
+        _fingerprint = _hash.digest()
+    return _fingerprint
+
+
+class P2CStatementMemo(object):
+    """
+    Lowered top level statements by their parse tree, for
+    P2CParser.generate_three_address_code. Past max_entries the least
+    recently used statements are dropped.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class P2CCache(object):
+    """
+    Compiled C code on disk, by a hash of the source, the grammar and the
+    compiler, and the options. A hit returns the C code without parsing, a
+    miss compiles with a memo of the lowered statements, so a program where one
+    statement changed only lowers that statement again.
+
+    The directory is kept under max_bytes by removing the least recently used
+    programs, a hit refreshes the modification time of its file.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, memo=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memo = memo if memo is not None else P2CStatementMemo()
+        self.parser = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # bytes of the files in the directory, counted on the first write
+        self.size = None
+
+    def key(self, source, opt_level=0):
+        _hash = hashlib.sha256(compiler_fingerprint())
+        _hash.update(json.dumps({'opt_level': opt_level}, sort_keys=True).encode())
+        _hash.update(source.encode())
+        return _hash.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.c')
+
+    def compile(self, source, opt_level=0):
+        path = self.path(self.key(source, opt_level))
+        try:
+            with open(path) as _file:
+                code = _file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        else:
+            self.hits += 1
+            return code
+
+        self.misses += 1
+        if self.parser is None:
+            self.parser = P2CParser()
+        self.parser.parse(source)
+        code = self.parser.generate_three_address_code(opt_level=opt_level, memo=self.memo)
+        self.store(path, code)
+        return code
+
+    def store(self, path, code):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written next to its place and renamed, a reader never sees half a file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as _file:
+            _file.write(code)
+        os.replace(temp_path, path)
+
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self.files())
+        else:
+            self.size += len(code.encode())
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def files(self):
+        for path in glob.glob(os.path.join(self.directory, '*', '*.c')):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process sharing the directory
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        # down to three quarters of the limit, so the directory is not scanned on every write
+        files = sorted(self.files())
+        self.size = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if self.size <= self.max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def statistics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'memo_hits': self.memo.hits,
+            'memo_misses': self.memo.misses,
+        }
+
+
+def test_cache():
+    import shutil
+
+    program = """
+        a = 2
+        while a < 10: { a = a * 3 }
+        if a > 5: { print("big %f" a) } else: { print("small") }
+        b = a + 1
+        """
+    edited = program.replace("b = a + 1", "b = a + 2")
+
+    directory = tempfile.mkdtemp()
+    try:
+        _cache = P2CCache(directory)
+        _parser = P2CParser()
+        _parser.parse(program)
+        expected = _parser.generate_three_address_code(opt_level=2)
+
+        if _cache.compile(program, 2) != expected or _cache.compile(program, 2) != expected:
+            return False
+        if (_cache.hits, _cache.misses) != (1, 1):
+            return False
+
+        # only the edited statement is lowered again, the others come from the memo
+        _parser.parse(edited)
+        if _cache.compile(edited, 2) != _parser.generate_three_address_code(opt_level=2):
+            return False
+        if (_cache.memo.hits, _cache.memo.misses) != (3, 5):
+            return False
+
+        # other options are another program
+        _cache.compile(program, 0)
+        if _cache.misses != 3:
+            return False
+
+        _cache.max_bytes = len(expected) + 1
+        _cache.compile(program.replace("a = 2", "a = 3"), 2)
+        return _cache.evictions > 0 and sum(size for _, size, _ in _cache.files()) <= _cache.max_bytes
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    if not test_cache():
+        raise Exception("[CACHE] Compilation cache test failed")
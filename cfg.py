@@ -0,0 +1,120 @@
+# control flow analyses over the basic blocks of a P2CProgram
+
+
+def reverse_postorder(blocks):
+    # the blocks reachable from the entry, iterative so deep nesting does not hit the recursion limit
+    if not blocks:
+        return []
+    order = []
+    visited = {blocks[0].index}
+    stack = [(blocks[0], iter(blocks[0].succs))]
+    while stack:
+        block, succs = stack[-1]
+        for succ in succs:
+            if succ.index not in visited:
+                visited.add(succ.index)
+                stack.append((succ, iter(succ.succs)))
+                break
+        else:
+            order.append(block)
+            stack.pop()
+    order.reverse()
+    return order
+
+
+def dominators(blocks):
+    """
+    Immediate dominator of every block, by index, using the iterative algorithm
+    of Cooper, Harvey and Kennedy. The entry is its own immediate dominator,
+    unreachable blocks have None.
+    """
+    idom = [None] * len(blocks)
+    order = reverse_postorder(blocks)
+    if not order:
+        return idom
+
+    position = dict((block.index, i) for i, block in enumerate(order))
+    entry = order[0].index
+    idom[entry] = entry
+
+    def intersect(a, b):
+        while a != b:
+            while position[a] > position[b]:
+                a = idom[a]
+            while position[b] > position[a]:
+                b = idom[b]
+        return a
+
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new_idom = None
+            for pred in block.preds:
+                if idom[pred.index] is None:
+                    continue
+                new_idom = pred.index if new_idom is None else intersect(pred.index, new_idom)
+            if idom[block.index] != new_idom:
+                idom[block.index] = new_idom
+                changed = True
+    return idom
+
+
+def dominator_tree(blocks, idom):
+    children = [[] for _ in blocks]
+    for block in blocks:
+        parent = idom[block.index]
+        if parent is not None and parent != block.index:
+            children[parent].append(block.index)
+    return children
+
+
+def dominance_frontiers(blocks, idom):
+    frontiers = [set() for _ in blocks]
+    for block in blocks:
+        preds = [pred.index for pred in block.preds if idom[pred.index] is not None]
+        if idom[block.index] is None or len(preds) < 2:
+            continue
+        for runner in preds:
+            while runner != idom[block.index]:
+                frontiers[runner].add(block.index)
+                runner = idom[runner]
+    return frontiers
+
+
+def liveness(program, blocks):
+    """
+    Names live on entry to and on exit from every block, by index.
+    """
+    quads = program.quads
+    uses = []
+    defs = []
+    for block in blocks:
+        _uses = set()
+        _defs = set()
+        for quad in quads[block.start:block.end]:
+            _uses.update(name for name in quad.uses() if name not in _defs)
+            if quad.dst is not None:
+                _defs.add(quad.dst)
+        uses.append(_uses)
+        defs.append(_defs)
+
+    live_in = [set() for _ in blocks]
+    live_out = [set() for _ in blocks]
+    # backward problem, converges faster visiting the blocks in postorder
+    order = list(reversed(reverse_postorder(blocks)))
+    reached = set(block.index for block in order)
+    order += [block for block in blocks if block.index not in reached]
+    changed = True
+    while changed:
+        changed = False
+        for block in order:
+            out = set()
+            for succ in block.succs:
+                out |= live_in[succ.index]
+            _in = uses[block.index] | (out - defs[block.index])
+            if out != live_out[block.index] or _in != live_in[block.index]:
+                live_out[block.index] = out
+                live_in[block.index] = _in
+                changed = True
+    return live_in, live_out
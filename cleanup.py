@@ -0,0 +1,227 @@
+from cfg import reverse_postorder
+from fold import binary_ops
+from tac import LABEL, GOTO, IF, IFNOT, IF_RELOPS, CONDITIONAL_JUMPS, JUMPS
+
+
+def is_constant(operand):
+    return type(operand) in (int, float)
+
+
+def simplify_control_flow(program):
+    """
+    Cleans up the jumps and labels of a lowered program until nothing changes:
+    conditional jumps on constants become gotos or are removed, jumps to a goto
+    are threaded to its target, unreachable instructions, jumps to the next
+    instruction and labels no jump refers to are removed, a conditional jump
+    over a goto is inverted, and a block only reached by a goto is moved behind
+    it so the two become one straight-line block. Conditions are never inverted
+    for comparisons, !(a < b) is not a >= b when a or b is nan.
+    """
+    steps = (resolve_constant_jumps, thread_jumps, remove_unreachable_code, remove_jumps_to_next,
+             invert_jumps_over_gotos, remove_dead_labels, merge_blocks)
+    changed = True
+    while changed:
+        changed = False
+        for step in steps:
+            if step(program):
+                changed = True
+    return program
+
+
+def jump_taken(quad):
+    # True or False for a conditional jump on constants, None otherwise
+    if quad.op in (IF, IFNOT):
+        if not is_constant(quad.src1):
+            return None
+        return bool(quad.src1) == (quad.op == IF)
+    if is_constant(quad.src1) and is_constant(quad.src2):
+        return binary_ops[IF_RELOPS[quad.op]](quad.src1, quad.src2)
+    return None
+
+
+def resolve_constant_jumps(program):
+    quads = []
+    for quad in program.quads:
+        if quad.op in CONDITIONAL_JUMPS:
+            taken = jump_taken(quad)
+            if taken is False:
+                continue
+            if taken is True:
+                quad.op, quad.src1, quad.src2 = GOTO, None, None
+        quads.append(quad)
+    changed = len(quads) != len(program.quads)
+    program.quads = quads
+    return changed
+
+
+def label_runs(quads):
+    # label -> first label of the run of consecutive labels it is in, they all name the same place
+    canonical = {}
+    first = None
+    for quad in quads:
+        if quad.op == LABEL:
+            if first is None:
+                first = quad.label
+            canonical[quad.label] = first
+        else:
+            first = None
+    return canonical
+
+
+def thread_jumps(program):
+    quads = program.quads
+    canonical = label_runs(quads)
+
+    # a run of labels directly followed by a goto -> the label of the goto
+    goto_after = {}
+    for i, quad in enumerate(quads):
+        if quad.op == GOTO and i > 0 and quads[i - 1].op == LABEL:
+            goto_after[canonical[quads[i - 1].label]] = quad.label
+
+    # label -> the end of its chain of gotos, so a long chain is followed once
+    targets = {}
+
+    def target(label):
+        label = canonical[label]
+        chain = [label]
+        seen = {label}
+        while label in goto_after and label not in targets:
+            _label = canonical[goto_after[label]]
+            if _label in seen:
+                # a loop of gotos, it is left as it is
+                return label
+            seen.add(_label)
+            chain.append(_label)
+            label = _label
+        label = targets.get(label, label)
+        for _label in chain:
+            targets[_label] = label
+        return label
+
+    changed = False
+    for quad in quads:
+        if quad.op in JUMPS:
+            label = target(quad.label)
+            if label != quad.label:
+                quad.label = label
+                changed = True
+    return changed
+
+
+def remove_unreachable_code(program):
+    blocks = program.basic_blocks()
+    reachable = set(block.index for block in reverse_postorder(blocks))
+    if len(reachable) == len(blocks):
+        return False
+    program.quads = [quad for block in blocks if block.index in reachable
+                     for quad in program.quads[block.start:block.end]]
+    return True
+
+
+def remove_jumps_to_next(program):
+    quads = program.quads
+    kept = []
+    for i, quad in enumerate(quads):
+        if quad.op in JUMPS:
+            # only labels between the jump and its target, conditions have no side effects
+            j = i + 1
+            while j < len(quads) and quads[j].op == LABEL and quads[j].label != quad.label:
+                j += 1
+            if j < len(quads) and quads[j].op == LABEL:
+                continue
+        kept.append(quad)
+    changed = len(kept) != len(quads)
+    program.quads = kept
+    return changed
+
+
+def invert_jumps_over_gotos(program):
+    # if (!c) goto l1; goto l2; l1: -> if (c) goto l2; l1:
+    quads = program.quads
+    canonical = label_runs(quads)
+    kept = []
+    changed = False
+    i = 0
+    while i < len(quads):
+        quad = quads[i]
+        if quad.op in (IF, IFNOT) and i + 2 < len(quads) and quads[i + 1].op == GOTO \
+                and quads[i + 2].op == LABEL and canonical[quads[i + 2].label] == canonical[quad.label]:
+            quad.op = IF if quad.op == IFNOT else IFNOT
+            quad.label = quads[i + 1].label
+            kept.append(quad)
+            changed = True
+            i += 2
+            continue
+        kept.append(quad)
+        i += 1
+    program.quads = kept
+    return changed
+
+
+def remove_dead_labels(program):
+    used = set(quad.label for quad in program.quads if quad.op in JUMPS)
+    quads = [quad for quad in program.quads if quad.op != LABEL or quad.label in used]
+    changed = len(quads) != len(program.quads)
+    program.quads = quads
+    return changed
+
+
+def merge_blocks(program):
+    # moves the blocks a goto jumps to behind it when nothing else reaches them, one move at a time
+    quads = program.quads
+    blocks = program.basic_blocks()
+    labels = program.label_table()
+    block_of = dict((block.start, block) for block in blocks)
+    for block in blocks:
+        last = quads[block.end - 1]
+        if last.op != GOTO:
+            continue
+        target = block_of[labels[last.label]]
+        if target.index == 0 or target.preds != [block]:
+            continue
+
+        # the target and the blocks it falls through to travel together, up to a goto
+        end = target.index
+        while end < len(blocks) and quads[blocks[end].end - 1].op != GOTO:
+            end += 1
+        if end == len(blocks) or target.index <= block.index <= end:
+            continue
+
+        start, stop = target.start, blocks[end].end
+        moved = quads[start:stop]
+        if start > block.end:
+            program.quads = quads[:block.end - 1] + moved + quads[block.end:start] + quads[stop:]
+        else:
+            program.quads = quads[:start] + quads[stop:block.end - 1] + moved + quads[block.end:]
+        return True
+    return False
+
+
+def test_control_flow_cleanup():
+    from tac import P2CProgram
+
+    code = P2CProgram()
+    code.emit('=', 'x', 1.0)
+    code.emit(IFNOT, src1='c', label='l1')
+    code.emit(GOTO, label='l2')
+    code.emit(LABEL, label='l1')
+    code.emit('+=', 'x', 1.0)
+    code.emit(GOTO, label='l3')
+    code.emit('*=', 'x', 5.0)
+    code.emit(LABEL, label='l2')
+    code.emit(GOTO, label='l4')
+    code.emit(LABEL, label='l3')
+    code.emit(IFNOT, src1=1.0, label='l2')
+    code.emit(LABEL, label='l4')
+    code.emit(LABEL, label='l5')
+    code.emit('print', src1='"%f"', src2='x')
+
+    simplify_control_flow(code)
+    result = [(quad.op, quad.dst, quad.src1, quad.label) for quad in code.quads]
+    return result == [('=', 'x', 1.0, None), ('if', None, 'c', 'l3'), ('+=', 'x', 1.0, None),
+                      ('label', None, None, 'l3'), ('print', None, '"%f"', None)]
+
+
+if __name__ == '__main__':
+    if not test_control_flow_cleanup():
+        raise Exception("[CLEANUP] Control flow cleanup test failed")
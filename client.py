@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import socket
+import sys
+import tempfile
+
+# where server.P2CServer listens and the client connects by default, in a directory only the user can use,
+# the client does not import the compiler so it starts fast
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'p2c-%d' % getattr(os, 'getuid', lambda: 0)(), 'server.sock')
+
+
+class P2CClient(object):
+    """
+    Sends programs to a running server.P2CServer and reads back the C code,
+    over a unix socket given as a path or TCP given as (host, port).
+    """
+
+    def __init__(self, address=None, timeout=None):
+        address = address or DEFAULT_SOCKET
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            try:
+                self.socket.connect(address)
+            except OSError:
+                self.socket.close()
+                raise
+        else:
+            self.socket = socket.create_connection(address, timeout)
+        self.file = self.socket.makefile('rb')
+        self.next_id = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def send(self, source, opt_level=0, timeout=None, **options):
+        # returns the id of the request, its answer is read with receive,
+        # options are the ones of server.OPTIONS, e.g. structured=True
+        self.next_id += 1
+        request = dict(options, id=self.next_id, source=source, opt_level=opt_level)
+        if timeout is not None:
+            request['timeout'] = timeout
+        self.socket.sendall(json.dumps(request).encode() + b'\n')
+        return self.next_id
+
+    def receive(self, fp=None):
+        """
+        The answer to the next request that is done: id, ok, diagnostics, error,
+        timings, statistics, vector_report, profile and seconds. The C code is written to fp as it comes
+        in if given, otherwise it is c_code.
+        """
+        result = {'diagnostics': [], 'error': None}
+        chunks = []
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError("The server closed the connection")
+            message = json.loads(line)
+            kind = message.pop('type')
+            if kind == 'output':
+                if fp is None:
+                    chunks.append(message['data'])
+                else:
+                    fp.write(message['data'])
+            elif kind == 'diagnostic':
+                result['diagnostics'].append(message)
+            else:
+                result.update(message)
+                if fp is None:
+                    result['c_code'] = ''.join(chunks)
+                return result
+
+    def compile(self, source, opt_level=0, timeout=None, fp=None, **options):
+        self.send(source, opt_level, timeout, **options)
+        return self.receive(fp)
+
+
+def compile_locally(source, opt_level, fp, options):
+    # without a server, the same answer as one would give
+    import server
+
+    server.init_worker()
+    result = server.compile_source(source, opt_level, options)
+    if result['ok']:
+        fp.write(result['c_code'])
+    return result
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="compile a program on a running compile server, see server.py")
+    arg_parser.add_argument('input', nargs='?', default='program.py.txt', help="(default: %(default)s)")
+    arg_parser.add_argument('-o', '--output', default='program.c', help="(default: %(default)s)")
+    arg_parser.add_argument('-O', dest='opt_level', type=int, choices=[0, 1, 2], default=0,
+                            help="optimization level, 1 folds constants, 2 also optimizes the SSA form")
+    arg_parser.add_argument('--timings', action='store_true',
+                            help="print the time spent in every optimization pass")
+    arg_parser.add_argument('--stats', action='store_true',
+                            help="print what the optimization passes did")
+    arg_parser.add_argument('--profile', metavar='JSON',
+                            help="write the time of every phase, the counters and the reductions per rule here")
+    arg_parser.add_argument('--vectorize', action='store_true',
+                            help="emit the loops without dependences between iterations as countable loops too "
+                                 "and print which")
+    arg_parser.add_argument('--structured', action='store_true',
+                            help="emit the loops and branches as while, for and if statements instead of gotos")
+    arg_parser.add_argument('--infer-types', action='store_true',
+                            help="declare the names that only hold whole numbers as int or _Bool instead of float")
+    arg_parser.add_argument('--unroll-factor', type=int,
+                            help="copies of the body a loop runs from one test to the next at -O2, 1 to only "
+                                 "unroll loops completely (default: the one of the server)")
+    arg_parser.add_argument('--unroll-budget', type=int,
+                            help="instructions the copies of the body of an unrolled loop may add up to, 0 to not "
+                                 "unroll (default: the one of the server)")
+    arg_parser.add_argument('--socket', help="the unix socket of the server (default: %s)" % DEFAULT_SOCKET)
+    arg_parser.add_argument('--host', help="connect over TCP to this host instead")
+    arg_parser.add_argument('--port', type=int, help="connect over TCP to this port instead")
+    arg_parser.add_argument('--timeout', type=float, help="seconds the compile may take on the server")
+    arg_parser.add_argument('--no-fallback', action='store_true',
+                            help="fail when no server is running instead of compiling in this process")
+    args = arg_parser.parse_args(argv)
+
+    address = args.socket
+    if args.host is not None or args.port is not None:
+        address = (args.host or 'localhost', args.port)
+    with open(args.input) as _input:
+        source = _input.read()
+    # the options of parser.py, the ones left out are the defaults of the server
+    options = {'vectorize': args.vectorize, 'structured': args.structured, 'infer_types': args.infer_types,
+               'profile': args.profile is not None}
+    if args.unroll_factor is not None:
+        options['unroll_factor'] = args.unroll_factor
+    if args.unroll_budget is not None:
+        options['unroll_budget'] = args.unroll_budget
+
+    # written next to the output and renamed, a failed compile leaves no half written file
+    temp_path = args.output + '.tmp'
+    try:
+        with open(temp_path, 'w') as _out:
+            try:
+                with P2CClient(address) as client:
+                    result = client.compile(source, args.opt_level, args.timeout, _out, **options)
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                if args.no_fallback:
+                    print("No compile server at %s: %s" % (address or DEFAULT_SOCKET, e), file=sys.stderr)
+                    return 2
+                result = compile_locally(source, args.opt_level, _out, options)
+        if result['ok']:
+            os.replace(temp_path, args.output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    for diagnostic in result['diagnostics']:
+        line = '' if diagnostic['line'] is None else '%d:' % diagnostic['line']
+        print("%s:%s %s: %s" % (args.input, line, diagnostic['severity'], diagnostic['message']), file=sys.stderr)
+    if result.get('error'):
+        print("%s: error: %s" % (args.input, result['error']), file=sys.stderr)
+    for line in result.get('vector_report', []):
+        print(line, file=sys.stderr)
+    if args.timings:
+        for name, seconds in result.get('timings', {}).items():
+            print("%-8s %8.3f ms" % (name, seconds * 1000), file=sys.stderr)
+    if args.stats:
+        for name, value in result.get('statistics', {}).items():
+            print("%-12s %8s" % (name, value), file=sys.stderr)
+    if args.profile and result.get('profile') is not None:
+        with open(args.profile, 'w') as _profile:
+            json.dump(result['profile'], _profile, indent=2)
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import io
+
+from tac import ASSIGN_OPS, NEG, POS, LABEL, GOTO, IF, IFNOT, PRINT, IF_RELOPS, fresh_names
+
+# the operators whose value is 0 or 1 whatever the types of their operands
+COMPARISONS = ('<', '<=', '>', '>=', '==', '!=', '&&', '||')
+
+
+class P2CEmitter(object):
+    """
+    Prints a lowered program as C, one instruction per line.
+
+    Every name is declared where it first appears: the first instruction that
+    writes it gets the type in front of it, a name that is read before it is
+    written is declared on a line of its own. Names missing from types are
+    declared as float, see infer.P2CTypeInference for the others.
+
+    loops are the loops of the program that run as a countable for loop in
+    front of the one they are lowered to, see vector.P2CVectorizer.
+
+    structured prints the loops and branches as C while, for and if
+    statements, see structure.P2CStructurer, when the control flow has their
+    form. Otherwise the program is printed with gotos and unstructured is the
+    reason why.
+    """
+
+    def __init__(self, types=None, loops=(), structured=False):
+        self.types = types or {}
+        self.loops = loops
+        self.structured = structured
+        self.unstructured = None
+        # the names of the start, the iterations and the index of each counted loop
+        self.helpers = []
+
+    def format_quad(self, quad, declared):
+        op = quad.op
+        if op == LABEL:
+            return f"{quad.label}:;"
+        if op == GOTO:
+            return f"goto {quad.label};"
+        if op == IF:
+            return f"if ({quad.src1}) goto {quad.label};"
+        if op == IFNOT:
+            return f"if (!{quad.src1}) goto {quad.label};"
+        if op in IF_RELOPS:
+            return f"if ({quad.src1} {IF_RELOPS[op]} {quad.src2}) goto {quad.label};"
+        if op == PRINT:
+            if quad.src2 is None:
+                return f"printf({quad.src1});"
+            if self.types.get(quad.src2, 'float') != 'float':
+                return f"printf({quad.src1}, (double){quad.src2});"
+            return f"printf({quad.src1}, {quad.src2});"
+
+        dst = quad.dst
+        src1, src2 = quad.src1, quad.src2
+        if self.types.get(dst, 'float') == 'float' and op not in ASSIGN_OPS and op not in COMPARISONS:
+            # what int names compute into a float is computed as float, an int can not be -0 or overflow
+            src1, src2 = self.float_operand(src1), self.float_operand(src2)
+        if dst not in declared:
+            declared.add(dst)
+            dst = f"{self.types.get(dst, 'float')} {dst}"
+
+        if op in ASSIGN_OPS:
+            return f"{dst} {op} {src1};"
+        if op == NEG:
+            return f"{dst} = -{src1};"
+        if op == POS:
+            return f"{dst} = +{src1};"
+        return f"{dst} = {src1} {op} {src2};"
+
+    def float_operand(self, operand):
+        if type(operand) == str and self.types.get(operand, 'float') != 'float':
+            return f"(float){operand}"
+        return operand
+
+    def declare(self, names, declared):
+        for name in names:
+            if name not in declared:
+                declared.add(name)
+                yield f"{self.types.get(name, 'float')} {name};"
+
+    def counted_loop(self, loop, n, declared):
+        """
+        The iterations of loop as a for loop over a long, which the C compiler
+        can vectorize. It is entered when the counter starts at a whole number
+        and the bound is in range, otherwise the loop it is lowered to runs.
+        """
+        # the names of the loop are declared in front of it, the code in braces declares none
+        names = [loop.test.dst] + loop.test.uses()
+        for quad in loop.body:
+            names += quad.uses() if quad.dst is None else quad.uses() + [quad.dst]
+        yield from self.declare(names, declared)
+        before, head, body, after = self.counted_statements(loop, n, declared)
+        yield f"if (!({self.counted_check(loop)})) goto {loop.test_label};"
+        yield "{"
+        yield from before
+        yield head + " {"
+        yield from body
+        yield "}"
+        yield from after
+        yield f"goto v{n};"
+        yield "}"
+
+    def counted_check(self, loop):
+        var, end, exact = loop.var, loop.end, loop.exact
+        check = f"-{exact} <= {var} && {var} <= {exact} && {var} == (long){var}"
+        if type(end) == str:
+            check += f" && -{exact} <= {end} && {end} <= {exact}"
+        return check
+
+    def counted_statements(self, loop, n, declared):
+        # the lines before the for loop over a long, its head, its body and the lines after it
+        var, step, end = loop.var, loop.step, loop.end
+        start, count, k = self.helpers[n - 1]
+        less = '<' if step > 0 else '>'
+        before = [f"float {start} = {var};",
+                  f"long {count} = (long)(({end} - {start}) / {step});",
+                  f"if ({count} < 0) {count} = 0;",
+                  f"while ({count} > 0 && !({start} + ({count} - 1) * {step} {less} {end})) {count}--;",
+                  f"while ({start} + {count} * {step} {less} {end}) {count}++;"]
+        head = f"for (long {k} = 0; {k} < {count}; {k}++)"
+        body = [f"{var} = {start} + {k} * {step};"]
+        body += [self.format_quad(quad, declared) for quad in loop.body]
+        after = [f"{var} = {start} + {count} * {step};", f"{loop.test.dst} = 1;"]
+        return before, head, body, after
+
+    def lines(self, program):
+        if self.loops:
+            # names the program does not use, the C code of a loop could read one of them otherwise
+            names = [fresh_names(program.quads, prefix) for prefix in ('vstart', 'vn', 'vk')]
+            self.helpers = [tuple(next(prefix) for prefix in names) for _ in self.loops]
+        if self.structured:
+            from structure import P2CStructurer, P2CStructureError
+
+            try:
+                yield from P2CStructurer(program, self).lines()
+                return
+            except P2CStructureError as e:
+                self.unstructured = str(e)
+        declared = set()
+        entries = dict((loop.entry, n) for n, loop in enumerate(self.loops, 1))
+        exits = dict((loop.exit, n) for n, loop in enumerate(self.loops, 1))
+        yield "#include <stdio.h>"
+        yield "int main () {"
+        for index, quad in enumerate(program.quads):
+            if index in entries:
+                yield from self.counted_loop(self.loops[entries[index] - 1], entries[index], declared)
+            yield from self.declare(quad.uses(), declared)
+            yield self.format_quad(quad, declared)
+            if index in exits:
+                # where a counted loop goes on after its iterations
+                yield f"v{exits[index]}:;"
+        yield "return 0;"
+        yield "}"
+
+    def write(self, program, fp):
+        fp.writelines(line + '\n' for line in self.lines(program))
+
+    def getvalue(self, program):
+        _out = io.StringIO()
+        self.write(program, _out)
+        return _out.getvalue()
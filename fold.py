@@ -0,0 +1,356 @@
+import math
+import operator
+import struct
+
+from nodes import Node, Assign, Binary, Unary, Print, If, Elif, Else, While, For
+import nodes
+
+
+def to_float(value):
+    # every variable and temporary of the generated C is a float,
+    # folded values are rounded the same way the C code would store them
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+def is_constant(node):
+    return type(node) in (int, float)
+
+
+binary_ops = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '&&': lambda a, b: bool(a) and bool(b),
+    '||': lambda a, b: bool(a) or bool(b),
+}
+
+
+def evaluate(op, a, b):
+    # None when the value is left for the C code to compute
+    if op not in binary_ops or op == '/' and b == 0:
+        return None
+    try:
+        value = to_float(float(binary_ops[op](a, b)))
+    except OverflowError:
+        return None
+    if not math.isfinite(value):
+        return None
+    return value
+
+
+class P2CFolder(object):
+    """
+    Constant folding over parse trees.
+
+    Constant subtrees are evaluated the way the generated C evaluates them and
+    variables that are known to hold a constant are replaced by it, within
+    straight-line code: a variable assigned inside a loop or a branch is unknown
+    after it. Only the identities that hold for IEEE floats are applied
+    (x * 1, x / 1, x - 0, +x, --x), x + 0 and x * 0 are kept because x may be
+    -0.0, inf or nan. Branches with a constant condition are resolved and loops
+    whose condition is false from the start are removed.
+
+    A division that is left to the C code keeps the variables it divides and a
+    factor or divisor of -1 is kept as written, gcc computes both differently
+    when they are literals.
+
+    The statements with a body are folded by generators that yield the
+    generator of the body, see nodes.trampoline, and the expressions with a
+    stack, so the nesting is not limited by the recursion limit.
+    """
+
+    def __init__(self):
+        # variable -> constant value it is known to hold
+        self.constants = {}
+        # id of a body -> names assigned in it, see assigned_names
+        self.assigned = {}
+
+    def fold(self, program):
+        self.constants = {}
+        self.assigned = {}
+        return nodes.trampoline(self.fold_statements(program))
+
+    def fold_statements(self, statements):
+        if not statements:
+            return statements
+
+        result = []
+        for line in statements:
+            kind = line.kind if isinstance(line, Node) else None
+            if kind == nodes.IF:
+                result.extend((yield self.fold_if(line)))
+            elif kind == nodes.WHILE:
+                result.extend((yield self.fold_while(line)))
+            elif kind == nodes.FOR:
+                result.append((yield self.fold_for(line)))
+            elif kind == nodes.PRINT:
+                result.append(self.fold_print(line))
+            elif kind == nodes.ASSIGN:
+                result.append(self.fold_assign(line))
+            else:
+                result.append(self.fold_expr(line))
+        return result
+
+    def fold_assign(self, line):
+        op, lhs = line.op, line.target
+        rhs = self.fold_expr(line.value)
+
+        value = None
+        if op == '=' and is_constant(rhs):
+            value = to_float(rhs)
+        elif is_constant(rhs) and lhs in self.constants:
+            value = evaluate(op[0], self.constants[lhs], rhs)
+
+        if value is None:
+            self.constants.pop(lhs, None)
+        else:
+            self.constants[lhs] = value
+        return Assign(op, lhs, rhs, line.lineno)
+
+    def fold_print(self, line):
+        if line.arg is None:
+            return line
+        return Print(line.format, self.fold_expr(line.arg), line.lineno)
+
+    def fold_for(self, line):
+        for_var = line.var
+        assigned = assigned_names(line.body, self.assigned) | {for_var}
+
+        # the bounds are read again on every iteration
+        params = tuple(param if param in assigned else self.constants.get(param, param) for param in line.params)
+
+        self.forget(assigned)
+        statements = yield self.fold_statements(line.body)
+        self.forget(assigned)
+        return For(for_var, params, statements, line.lineno)
+
+    def fold_while(self, line):
+        condition = self.fold_expr(line.condition)
+        if is_constant(condition) and not condition:
+            return []
+
+        # the condition is evaluated again after the body, nothing assigned in the body is known
+        assigned = assigned_names(line.body, self.assigned)
+        self.forget(assigned)
+        condition = self.fold_expr(line.condition)
+        statements = yield self.fold_statements(line.body)
+        self.forget(assigned)
+        return [While(condition, statements, line.lineno)]
+
+    def fold_if(self, line):
+        branches = []
+        _else = None
+        _line = line
+        while _line is not None:
+            if _line.kind == nodes.ELSE:
+                _else = _line
+                break
+            condition = self.fold_expr(_line.condition)
+            if is_constant(condition):
+                if condition:
+                    # always taken, the branches after it are dead
+                    _else = Else(_line.body, _line.lineno)
+                    break
+            else:
+                branches.append((condition, _line.body))
+            _line = _line.orelse
+
+        before = self.constants
+        assigned = set()
+        folded = []
+        for condition, statements in branches:
+            self.constants = dict(before)
+            folded.append((condition, (yield self.fold_statements(statements))))
+            assigned |= assigned_names(statements, self.assigned)
+
+        if _else is not None:
+            self.constants = dict(before)
+            _else = Else((yield self.fold_statements(_else.body)), _else.lineno)
+            if not branches:
+                # only one way through, the statements are no longer conditional
+                return _else.body or []
+            assigned |= assigned_names(_else.body, self.assigned)
+
+        self.constants = before
+        self.forget(assigned)
+
+        if not branches:
+            return []
+
+        chain = _else
+        for condition, statements in reversed(folded[1:]):
+            chain = Elif(condition, statements, chain, line.lineno)
+        condition, statements = folded[0]
+        return [If(condition, statements, chain, line.lineno)]
+
+    def fold_expr(self, expr):
+        # a postorder walk with a stack, an operator is pushed again as (operator,) to be
+        # folded once its operands are
+        values = []
+        work = [expr]
+        while work:
+            node = work.pop()
+            if type(node) == tuple:
+                node = node[0]
+                if node.kind == nodes.UNARY:
+                    values.append(self.fold_unary(node, values.pop()))
+                else:
+                    b = values.pop()
+                    values.append(self.fold_binary(node, values.pop(), b))
+            elif isinstance(node, Node):
+                work.append((node,))
+                if node.kind == nodes.UNARY:
+                    work.append(node.operand)
+                else:
+                    work.append(node.right)
+                    work.append(node.left)
+            elif type(node) == str:
+                values.append(self.constants.get(node, node))
+            else:
+                values.append(node)
+        return values[0]
+
+    def fold_unary(self, expr, a):
+        op = expr.op
+        if is_constant(a) and op == '+':
+            return to_float(a)
+        if op == '+':
+            return a
+        if is_constant(a):
+            return to_float(-a)
+        if isinstance(a, Unary) and a.op == '-':
+            return a.operand
+        return Unary(op, a, expr.lineno)
+
+    def fold_binary(self, expr, a, b):
+        op = expr.op
+        if is_constant(a) and is_constant(b):
+            value = evaluate(op, a, b)
+            if value is not None:
+                return value
+            if op == '/':
+                # left to the C code, which divides variables at run time but two literals at compile time,
+                # where 0.0 / 0.0 is a nan of another sign
+                a = expr.left if type(expr.left) == str else a
+                b = expr.right if type(expr.right) == str else b
+        elif op in ('*', '/') and is_constant(b) and b == -1:
+            # gcc makes x * -1 and x / -1 a negation, which flips the sign of a nan, so the -1 is left as written
+            b = expr.right
+        elif op == '*' and is_constant(a) and a == -1:
+            a = expr.left
+
+        # identities that hold for every float
+        if op == '*' and is_constant(b) and b == 1:
+            return a
+        if op == '*' and is_constant(a) and a == 1:
+            return b
+        if op == '/' and is_constant(b) and b == 1:
+            return a
+        if op == '-' and is_constant(b) and b == 0 and math.copysign(1, b) > 0:
+            return a
+        if op == '||' and (is_constant(a) and a or is_constant(b) and b):
+            return 1.0
+        if op == '&&' and (is_constant(a) and not a or is_constant(b) and not b):
+            return 0.0
+        return Binary(op, a, b, expr.lineno)
+
+    def forget(self, names):
+        for name in names:
+            self.constants.pop(name, None)
+
+
+def assigned_names(statements, cache=None):
+    # the cache, by id of a body, keeps the names of the bodies inside, so a folder that asks
+    # for every body of a nest walks it once and not once per level
+    if cache is None:
+        cache = {}
+    # (body, True) once the bodies inside it are done
+    work = [(statements, False)]
+    while work:
+        body, done = work.pop()
+        if id(body) in cache:
+            continue
+        if not done:
+            work.append((body, True))
+            work.extend((inner, False) for inner in inner_bodies(body))
+            continue
+        names = set()
+        for line in body or []:
+            if isinstance(line, Node) and line.kind == nodes.ASSIGN:
+                names.add(line.target)
+            elif isinstance(line, Node) and line.kind == nodes.FOR:
+                names.add(line.var)
+        for inner in inner_bodies(body):
+            names |= cache[id(inner)]
+        cache[id(body)] = names
+    return cache[id(statements)]
+
+
+def inner_bodies(statements):
+    for line in statements or []:
+        if not isinstance(line, Node):
+            continue
+        if line.kind == nodes.IF:
+            _line = line
+            while _line is not None:
+                yield _line.body
+                if _line.kind == nodes.ELSE:
+                    break
+                _line = _line.orelse
+        elif line.kind == nodes.WHILE or line.kind == nodes.FOR:
+            yield line.body
+
+
+def test_constant_folding():
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    from parser import P2CParser
+
+    test_input = """
+        a = 10
+        b = 30
+        c = a * b / (2*a+4*b)
+        if c < 2: { print("less") } elif c > 2: { d = c * 1 - 0 } else: { d = 0 }
+        while d < 0: { d += 1 }
+        e = d + 2 * 3
+        """
+    test_output = [('=', 'a', 10.0), ('=', 'b', 30.0), ('=', 'c', 2.142857074737549),
+                   ('=', 'd', 2.142857074737549), ('=', 'e', 8.14285659790039)]
+
+    _parser = P2CParser()
+    if P2CFolder().fold(_parser.parse(test_input)) != test_output:
+        return False
+
+    # the folded programs print what the unfolded ones print, 0.0 / 0.0 and x * -1.0 are different nans in gcc
+    cc = shutil.which(os.environ.get('CC', 'cc'))
+    if cc is None:
+        return True
+    programs = ["c = 0\ne = 0\nd = c / e * (6 - 7)\nprint(\"%f\\n\" d)\n",
+                "x = 0\nx = x / x\nk = 2\ny = x * -1\nz = x / (k - 3)\nprint(\"%f \" y)\nprint(\"%f\\n\" z)\n"]
+    with tempfile.TemporaryDirectory() as directory:
+        for program in programs:
+            _parser.parse(program)
+            outputs = []
+            for opt_level in (0, 1):
+                source, binary = os.path.join(directory, '%d.c' % opt_level), os.path.join(directory, '%d' % opt_level)
+                with open(source, 'w') as f:
+                    f.write(_parser.generate_three_address_code(opt_level=opt_level))
+                subprocess.run([cc, '-w', '-o', binary, source], check=True)
+                outputs.append(subprocess.run([binary], stdout=subprocess.PIPE).stdout)
+            if outputs[0] != outputs[1]:
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    if not test_constant_folding():
+        raise Exception("[FOLD] Constant folding test failed")
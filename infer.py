@@ -0,0 +1,301 @@
+import math
+
+from cfg import reverse_postorder
+from tac import ASSIGN_OPS, NEG, POS, IF, IFNOT, PRINT, IF_RELOPS, CONDITIONAL_JUMPS
+from vm import c_int
+
+# a float holds every whole number up to this exactly, and adds, subtracts and multiplies them like an int does
+EXACT = 2 ** 24
+# any value a float can have, a whole number range (lo, hi) is a value that is never -0, nan or inf
+FLOAT = 'float'
+RELOPS = ('<', '<=', '>', '>=', '==', '!=')
+NEGATED = {'<': '>=', '<=': '>', '>': '<=', '>=': '<', '==': '!=', '!=': '=='}
+SWAPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+# the loop headers are widened after this many visits
+WIDEN = 3
+
+
+def whole(lo, hi):
+    # the whole numbers from lo to hi, FLOAT when a float does not hold all of them exactly
+    if -EXACT <= lo and hi <= EXACT:
+        return lo, hi
+    return FLOAT
+
+
+def constant(literal):
+    if type(literal) == bool:
+        literal = int(literal)
+    if not math.isfinite(literal) or literal != int(literal) or math.copysign(1.0, literal) < 0 and literal == 0:
+        return FLOAT
+    return whole(int(literal), int(literal))
+
+
+def join(a, b):
+    if a is None:
+        return b
+    if b is None or a == b:
+        return a
+    if a == FLOAT or b == FLOAT:
+        return FLOAT
+    return min(a[0], b[0]), max(a[1], b[1])
+
+
+def widen(old, new):
+    # the bounds that still grow jump to the largest ones a float counts exactly
+    if old is None or old == FLOAT or new == FLOAT:
+        return new
+    return (old[0] if new[0] >= old[0] else -EXACT), (old[1] if new[1] <= old[1] else EXACT)
+
+
+def binary(op, a, b):
+    # the value of a op b, a and b are values of the float semantics of the language
+    if op in RELOPS or op in ('&&', '||'):
+        return 0, 1
+    if a is None or b is None or a == FLOAT or b == FLOAT or op not in ('+', '-', '*'):
+        return FLOAT
+    if op == '+':
+        return whole(a[0] + b[0], a[1] + b[1])
+    if op == '-':
+        return whole(a[0] - b[1], a[1] - b[0])
+    # 0 times a negative number is -0
+    if a[0] <= 0 <= a[1] and b[0] < 0 or b[0] <= 0 <= b[1] and a[0] < 0:
+        return FLOAT
+    products = [x * y for x in a for y in b]
+    return whole(min(products), max(products))
+
+
+class P2CTypeInference(object):
+    """
+    The C types a lowered program can declare its names with instead of
+    float, without changing what it prints.
+
+    The values every name can have at every point are ranges of whole
+    numbers, found by running the instructions over the control flow until
+    nothing changes. The comparisons a jump depends on narrow the ranges on
+    each way it goes, so the counter of a loop stays below its bound. A name
+    is int when every value written to it is a whole number a float holds
+    exactly, and never -0, and _Bool when these are only 0 and 1. Everything
+    else stays float, in particular whatever a division makes.
+
+    The emitter computes an instruction writing a float from int names as a
+    float, and prints int names as doubles, see emitter.P2CEmitter.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.quads = program.quads
+        self.blocks = program.basic_blocks()
+        # the join of the values written to every name
+        self.written = {}
+        self.states = None
+        # the block every label starts
+        self.targets = None
+
+    def value(self, operand, state):
+        if type(operand) == str:
+            value = state.get(operand)
+            # a name read before it is written has any value
+            return FLOAT if value is None else value
+        return constant(operand)
+
+    def evaluate(self, quad, state):
+        op, src1, src2 = quad.op, quad.src1, quad.src2
+        if op == '=':
+            return self.value(src1, state)
+        if op in ASSIGN_OPS:
+            op, src1, src2 = op[0], quad.dst, src1
+        if op in (NEG, POS):
+            value = self.value(src1, state)
+            if type(src1) == int:
+                # C negates an int literal as an int, -0 is 0
+                return whole(-src1, -src1) if op == NEG else value
+            if value == FLOAT or op == POS:
+                return value
+            return FLOAT if value[0] <= 0 <= value[1] else (-value[1], -value[0])
+        if type(src1) == int and type(src2) == int:
+            # C computes with two int literals as ints
+            value = c_int(op, src1, src2)
+            return FLOAT if value is None else whole(value, value)
+        return binary(op, self.value(src1, state), self.value(src2, state))
+
+    def condition(self, block, quad):
+        """
+        (operand, relop, operand) the jump at the end of block depends on,
+        the relop holds when it jumps. None when it is not a comparison of
+        names that are not written after it.
+        """
+        if quad.op in IF_RELOPS:
+            return quad.src1, IF_RELOPS[quad.op], quad.src2
+        if type(quad.src1) != str:
+            return None
+        code = self.quads[block.start:block.end - 1]
+        for i in range(len(code) - 1, -1, -1):
+            if code[i].dst == quad.src1:
+                compared = code[i]
+                # t = t > b compares what t held before
+                operands = compared.src1, compared.src2
+                if compared.op not in RELOPS or compared.dst in operands or \
+                        any(later.dst in operands for later in code[i + 1:]):
+                    return None
+                relop = compared.op if quad.op == IF else NEGATED[compared.op]
+                return compared.src1, relop, compared.src2
+        return None
+
+    def narrow(self, state, a, relop, b):
+        # the state on the way where a relop b holds, None when it never does
+        for left, op, right in ((a, relop, b), (b, SWAPPED[relop], a)):
+            if type(left) != str:
+                continue
+            value, bound = self.value(left, state), self.value(right, state)
+            if value == FLOAT or bound == FLOAT:
+                if type(right) == str or not (type(right) == float and math.isfinite(right)) or value == FLOAT:
+                    continue
+                # a literal that is not a whole number
+                bound = (right, right)
+            lo, hi = value
+            if op == '<':
+                hi = min(hi, math.ceil(bound[1]) - 1)
+            elif op == '<=':
+                hi = min(hi, math.floor(bound[1]))
+            elif op == '>':
+                lo = max(lo, math.floor(bound[0]) + 1)
+            elif op == '>=':
+                lo = max(lo, math.ceil(bound[0]))
+            elif op == '==':
+                lo, hi = max(lo, math.ceil(bound[0])), min(hi, math.floor(bound[1]))
+            elif bound[0] == bound[1]:
+                lo, hi = lo + (lo == bound[0]), hi - (hi == bound[0])
+            if lo > hi:
+                return None
+            state = dict(state)
+            state[left] = (lo, hi)
+        return state
+
+    def exits(self, block, state):
+        # (successor, state) for the ways out of block
+        last = self.quads[block.end - 1]
+        taken = self.targets.get(last.label)
+        # the last block falls off the end of the program, the jump may also go where it falls through to
+        if last.op not in CONDITIONAL_JUMPS or taken == block.index + 1:
+            return [(succ, state) for succ in block.succs]
+        succs = dict((succ.index, None) for succ in block.succs)
+        condition = self.condition(block, last)
+        for succ in block.succs:
+            jumps = succ.index == taken
+            if last.op in (IF, IFNOT) and type(last.src1) != str:
+                # a literal condition only goes one way
+                if (last.src1 != 0) == (last.op == IF) and jumps or (last.src1 != 0) != (last.op == IF) and not jumps:
+                    succs[succ.index] = state
+            elif condition is None:
+                succs[succ.index] = state
+            else:
+                a, relop, b = condition
+                succs[succ.index] = self.narrow(state, a, relop if jumps else NEGATED[relop], b)
+        return [(self.blocks[index], _state) for index, _state in succs.items() if _state is not None]
+
+    def run(self):
+        labels = self.program.label_table()
+        starts = dict((block.start, block.index) for block in self.blocks)
+        self.targets = dict((label, starts[start]) for label, start in labels.items())
+        order = reverse_postorder(self.blocks)
+        position = dict((block.index, i) for i, block in enumerate(order))
+        states = self.states = {}
+        if not order:
+            return
+        states[order[0].index] = {}
+        visits = {}
+        work = {order[0].index}
+        while work:
+            index = min(work, key=position.get)
+            work.discard(index)
+            block = self.blocks[index]
+            state = dict(states[index])
+            for quad in self.quads[block.start:block.end]:
+                if quad.dst is not None and quad.op != PRINT:
+                    value = state[quad.dst] = self.evaluate(quad, state)
+                    self.written[quad.dst] = join(self.written.get(quad.dst), value)
+            for succ, out in self.exits(block, state):
+                old = states.get(succ.index)
+                new = join_states(old, out)
+                if old is not None and position[succ.index] <= position[index]:
+                    # a loop header, its ranges stop growing after a few rounds
+                    visits[succ.index] = visits.get(succ.index, 0) + 1
+                    if visits[succ.index] > WIDEN:
+                        new = dict((name, widen(old.get(name), value)) for name, value in new.items())
+                if new != old:
+                    states[succ.index] = new
+                    work.add(succ.index)
+
+    def types(self):
+        # the C type of every name that is not a float, by name
+        if self.states is None:
+            self.run()
+        types = {}
+        for name, value in self.written.items():
+            if value is not None and value != FLOAT:
+                types[name] = '_Bool' if 0 <= value[0] and value[1] <= 1 else 'int'
+        return types
+
+
+def join_states(a, b):
+    # a name only written on one of the ways has any value where they meet
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return dict((name, join(a.get(name, FLOAT), b.get(name, FLOAT))) for name in set(a) | set(b))
+
+
+def test_type_inference():
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    from parser import P2CParser
+
+    program = ("a = 3\nb = 4\nc = a / b\nm = 10\nwhile m > 0: {\n    m -= 1\n}\nfor i in range(10): {\n"
+               "    a += i * b\n}\nprint(\"%f\\n\" a)\nprint(\"%f\\n\" c)\nprint(\"%f\\n\" m)\nprint(\"%f\\n\" i)\n")
+    _parser = P2CParser()
+    _parser.parse(program)
+    floats = _parser.generate_three_address_code()
+    typed = _parser.generate_three_address_code(infer_types=True)
+    if 'int b' not in typed or 'float m' in typed or 'float i' in typed or 'float c' not in typed:
+        return False
+    if _parser.symbol_table.get('c') != 'float' or _parser.symbol_table.get('i') != 'int':
+        return False
+    # -0 and values past 2 ** 24 are no ints
+    _parser = P2CParser()
+    _parser.parse("x = 0\nx *= -1\ny = 1\nfor i in range(30): {\n    y *= 2\n}\nprint(\"%f\\n\" x)\nprint(\"%f\\n\" y)\n")
+    code = _parser.generate_three_address_code(infer_types=True)
+    if 'float x' not in code or 'float y' not in code:
+        return False
+
+    # the programs print the same with either declarations, with and without the optimizer, the generated one
+    # reuses temporaries as in t2 = t2 > v5
+    from bench import P2CProgramGenerator
+    _parser = P2CParser()
+    _parser.parse(P2CProgramGenerator(20, variables=6, max_depth=3).generate(600))
+    pairs = [(floats, typed)]
+    for opt_level in (0, 2):
+        pairs.append((_parser.generate_three_address_code(opt_level=opt_level),
+                      _parser.generate_three_address_code(opt_level=opt_level, infer_types=True)))
+    cc = shutil.which(os.environ.get('CC', 'cc'))
+    if cc is None:
+        return True
+    with tempfile.TemporaryDirectory() as directory:
+        for pair in pairs:
+            outputs = []
+            for i, code in enumerate(pair):
+                source, binary = os.path.join(directory, '%d.c' % i), os.path.join(directory, '%d' % i)
+                with open(source, 'w') as f:
+                    f.write(code)
+                subprocess.run([cc, '-w', '-o', binary, source], check=True)
+                outputs.append(subprocess.run([binary], stdout=subprocess.PIPE).stdout)
+            if outputs[0] != outputs[1] or outputs[0] == b'':
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    if not test_type_inference():
+        raise Exception("[INFER] Type inference test failed")
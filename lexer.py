@@ -1,10 +1,12 @@
-import ply.lex as lex
+import threading
 
 
 class P2CLexer(object):
     def __init__(self):
+        # imported here, import lexer and import parser do not load ply
+        import ply.lex as lex
+
         self.lexer = lex.lex(module=self)
-        print("Lexer build successfully")
 
     # keyword constants
     IF = 'IF'
@@ -89,8 +91,8 @@ class P2CLexer(object):
               PLUS, MINUS, TIMES, DIV, MOD, STRING_LITERAL,
               LPRAN, RPRAN, LBRACE, RBRACE, SEP, COLON, 'COMMENTS']
     tokens += list(reserved.values())
-    # remove duplicate values
-    tokens = list(set(tokens))
+    # remove duplicate values, sorted so the grammar signature does not depend on the hash seed
+    tokens = sorted(set(tokens))
 
     # simple tokens regex definition
     # arithmetic
@@ -262,12 +264,24 @@ class P2CLexer(object):
             print("[LEXER] Test passed")
 
 
-if __name__ == '__main__':
-    lexer = P2CLexer()
+_lexer = None
+_lexer_lock = threading.Lock()
 
-    # test 1
-    lexer.test("""
-    print("Hello world \n")
+
+def get_lexer():
+    # the lexer is built on first use and then shared, a compile that lexes with it takes a clone,
+    # see P2CContext.lexer in parser.py
+    global _lexer
+    with _lexer_lock:
+        if _lexer is None:
+            _lexer = P2CLexer()
+    return _lexer
+
+
+def lexer_test_case():
+    # an input of the lexer test and the tokens it must produce
+    return """
+    print("Hello world \\n")
     
     # number and assignment tests
         ifTrue = -3
@@ -322,55 +336,62 @@ if __name__ == '__main__':
         m /= n
 
     """, [
-        (lexer.PRINT, 'print'), (lexer.LPRAN, '('), (lexer.STRING_LITERAL, '"Hello world \n"'), (lexer.RPRAN, ')'),
-        (lexer.ID, 'ifTrue'), (lexer.EQ, '='), (lexer.MINUS, '-'), (lexer.NUMBER, 3),
-        (lexer.ID, 'b'), (lexer.EQ, '='), (lexer.PLUS, '+'), (lexer.NUMBER, 45),
-        (lexer.AND, '&&'), (lexer.EQ, '='), (lexer.NUMBER, 1.2),
-        (lexer.ID, 'andor'), (lexer.EQ, '='), (lexer.NUMBER, 1.2),
-        (lexer.ID, 'd'), (lexer.EQ, '='), (lexer.NUMBER, 166.897),
-        (lexer.ID, 'm'), (lexer.EQ, '='), (lexer.ID, 'a'),
-        (lexer.ID, 'v3'), (lexer.EQ, '='), (lexer.ID, 'variable_Longer'),
-        (lexer.ID, 'a'), (lexer.LT, '<'), (lexer.ID, 'b'),
-        (lexer.ID, 'other'), (lexer.LTE, '<='), (lexer.NUMBER, 3.3),
-        (lexer.ID, 'var'), (lexer.NEQU, '!='), (lexer.ID, 'other'),
-        (lexer.NUMBER, 5), (lexer.GT, '>'), (lexer.NUMBER, 6),
-        (lexer.NUMBER, 89), (lexer.GTE, '>='), (lexer.NUMBER, 99),
-        (lexer.ID, 'a'), (lexer.EQU, '=='), (lexer.ID, 'b'),
-        (lexer.ID, 'l1'), (lexer.AND, '&&'), (lexer.ID, 'l2'),
-        (lexer.ID, 'l1'), (lexer.AND, '&&'), (lexer.ID, 'l2'),
-        (lexer.ID, 'wer'), (lexer.OR, '||'), (lexer.ID, 'rew'),
-        (lexer.ID, 'wer'), (lexer.OR, '||'), (lexer.ID, 'rew'),
-        (lexer.NOT, '!'), (lexer.ID, 'var'),
-        (lexer.NOT, '!'), (lexer.ID, 'var'),
-        (lexer.IF, 'if'), (lexer.ID, 'ab'), (lexer.GTE, '>='), (lexer.NUMBER, 454), (lexer.COLON, ':'),
-        (lexer.ID, 'a'), (lexer.PLUS, '+'), (lexer.ID, 'b'),
-
-        (lexer.FOR, 'for'), (lexer.ID, 'i'), (lexer.IN, 'in'), (lexer.RANGE, 'range'),
-        (lexer.LPRAN, '('),
-        (lexer.ID, 'start'),
-        (lexer.SEP, ','),
-        (lexer.ID, 'stop'),
-        (lexer.SEP, ','),
-        (lexer.ID, 'step'),
-        (lexer.RPRAN, ')'),
-        (lexer.COLON, ':'),
-        (lexer.ID, 'a'), (lexer.MOD, '%'), (lexer.ID, 'b'),
-
-        (lexer.WHILE, 'while'), (lexer.ID, 'condition'), (lexer.NEQU, '!='), (lexer.NUMBER, 0), (lexer.COLON, ':'),
-        (lexer.ELSE, 'else'), (lexer.FALSE, 0), (lexer.COLON, ':'),
-        (lexer.LBRACE, '{'),
-        (lexer.ID, 'm'), (lexer.EQ, '='), (lexer.NUMBER, 34),
-        (lexer.RBRACE, '}'),
-
-        (lexer.ID, 'a'), (lexer.PLUS, '+'), (lexer.ID, 'b'),
-        (lexer.ID, 'a'), (lexer.MINUS, '-'), (lexer.ID, 'b'),
-        (lexer.ID, 'a'), (lexer.TIMES, '*'), (lexer.ID, 'b'),
-        (lexer.ID, 'a'), (lexer.DIV, '/'), (lexer.ID, 'b'),
-        (lexer.ID, 'a'), (lexer.DIV, '/'), (lexer.ID, 'b'),
-        (lexer.ID, 'a'), (lexer.MOD, '%'), (lexer.ID, 'b'),
-
-        (lexer.ID, 'm'), (lexer.PLUS_EQUAL, '+='), (lexer.ID, 'n'),
-        (lexer.ID, 'm'), (lexer.MINUS_EQUAL, '-='), (lexer.ID, 'n'),
-        (lexer.ID, 'm'), (lexer.TIMES_EQUAL, '*='), (lexer.ID, 'n'),
-        (lexer.ID, 'm'), (lexer.DIV_EQUAL, '/='), (lexer.ID, 'n'),
-    ])
+        (P2CLexer.PRINT, 'print'), (P2CLexer.LPRAN, '('), (P2CLexer.STRING_LITERAL, '"Hello world \\n"'), (P2CLexer.RPRAN, ')'),
+        (P2CLexer.ID, 'ifTrue'), (P2CLexer.EQ, '='), (P2CLexer.MINUS, '-'), (P2CLexer.NUMBER, 3),
+        (P2CLexer.ID, 'b'), (P2CLexer.EQ, '='), (P2CLexer.PLUS, '+'), (P2CLexer.NUMBER, 45),
+        (P2CLexer.AND, '&&'), (P2CLexer.EQ, '='), (P2CLexer.NUMBER, 1.2),
+        (P2CLexer.ID, 'andor'), (P2CLexer.EQ, '='), (P2CLexer.NUMBER, 1.2),
+        (P2CLexer.ID, 'd'), (P2CLexer.EQ, '='), (P2CLexer.NUMBER, 166.897),
+        (P2CLexer.ID, 'm'), (P2CLexer.EQ, '='), (P2CLexer.ID, 'a'),
+        (P2CLexer.ID, 'v3'), (P2CLexer.EQ, '='), (P2CLexer.ID, 'variable_Longer'),
+        (P2CLexer.ID, 'a'), (P2CLexer.LT, '<'), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'other'), (P2CLexer.LTE, '<='), (P2CLexer.NUMBER, 3.3),
+        (P2CLexer.ID, 'var'), (P2CLexer.NEQU, '!='), (P2CLexer.ID, 'other'),
+        (P2CLexer.NUMBER, 5), (P2CLexer.GT, '>'), (P2CLexer.NUMBER, 6),
+        (P2CLexer.NUMBER, 89), (P2CLexer.GTE, '>='), (P2CLexer.NUMBER, 99),
+        (P2CLexer.ID, 'a'), (P2CLexer.EQU, '=='), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'l1'), (P2CLexer.AND, '&&'), (P2CLexer.ID, 'l2'),
+        (P2CLexer.ID, 'l1'), (P2CLexer.AND, '&&'), (P2CLexer.ID, 'l2'),
+        (P2CLexer.ID, 'wer'), (P2CLexer.OR, '||'), (P2CLexer.ID, 'rew'),
+        (P2CLexer.ID, 'wer'), (P2CLexer.OR, '||'), (P2CLexer.ID, 'rew'),
+        (P2CLexer.NOT, '!'), (P2CLexer.ID, 'var'),
+        (P2CLexer.NOT, '!'), (P2CLexer.ID, 'var'),
+        (P2CLexer.IF, 'if'), (P2CLexer.ID, 'ab'), (P2CLexer.GTE, '>='), (P2CLexer.NUMBER, 454), (P2CLexer.COLON, ':'),
+        (P2CLexer.ID, 'a'), (P2CLexer.PLUS, '+'), (P2CLexer.ID, 'b'),
+
+        (P2CLexer.FOR, 'for'), (P2CLexer.ID, 'i'), (P2CLexer.IN, 'in'), (P2CLexer.RANGE, 'range'),
+        (P2CLexer.LPRAN, '('),
+        (P2CLexer.ID, 'start'),
+        (P2CLexer.SEP, ','),
+        (P2CLexer.ID, 'stop'),
+        (P2CLexer.SEP, ','),
+        (P2CLexer.ID, 'step'),
+        (P2CLexer.RPRAN, ')'),
+        (P2CLexer.COLON, ':'),
+        (P2CLexer.ID, 'a'), (P2CLexer.MOD, '%'), (P2CLexer.ID, 'b'),
+
+        (P2CLexer.WHILE, 'while'), (P2CLexer.ID, 'condition'), (P2CLexer.NEQU, '!='), (P2CLexer.NUMBER, 0), (P2CLexer.COLON, ':'),
+        (P2CLexer.ELSE, 'else'), (P2CLexer.FALSE, 0), (P2CLexer.COLON, ':'),
+        (P2CLexer.LBRACE, '{'),
+        (P2CLexer.ID, 'm'), (P2CLexer.EQ, '='), (P2CLexer.NUMBER, 34),
+        (P2CLexer.RBRACE, '}'),
+
+        (P2CLexer.ID, 'a'), (P2CLexer.PLUS, '+'), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'a'), (P2CLexer.MINUS, '-'), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'a'), (P2CLexer.TIMES, '*'), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'a'), (P2CLexer.DIV, '/'), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'a'), (P2CLexer.DIV, '/'), (P2CLexer.ID, 'b'),
+        (P2CLexer.ID, 'a'), (P2CLexer.MOD, '%'), (P2CLexer.ID, 'b'),
+
+        (P2CLexer.ID, 'm'), (P2CLexer.PLUS_EQUAL, '+='), (P2CLexer.ID, 'n'),
+        (P2CLexer.ID, 'm'), (P2CLexer.MINUS_EQUAL, '-='), (P2CLexer.ID, 'n'),
+        (P2CLexer.ID, 'm'), (P2CLexer.TIMES_EQUAL, '*='), (P2CLexer.ID, 'n'),
+        (P2CLexer.ID, 'm'), (P2CLexer.DIV_EQUAL, '/='), (P2CLexer.ID, 'n'),
+    ]
+
+
+if __name__ == '__main__':
+    lexer = P2CLexer()
+
+    # test 1
+    lexer.test(*lexer_test_case())
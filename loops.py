@@ -0,0 +1,190 @@
+from cfg import dominators, liveness
+from tac import ASSIGN_OPS, LABEL, PRINT, JUMPS, GOTO
+
+
+def natural_loops(blocks, idom):
+    """
+    Blocks of the natural loop of every back edge, by index of the header.
+    Back edges to the same header make one loop.
+    """
+    loops = {}
+    for block in blocks:
+        if idom[block.index] is None:
+            continue
+        for succ in block.succs:
+            if not dominates(idom, succ.index, block.index):
+                continue
+            body = loops.setdefault(succ.index, {succ.index})
+            work = [block]
+            while work:
+                _block = work.pop()
+                if _block.index not in body and idom[_block.index] is not None:
+                    body.add(_block.index)
+                    work.extend(_block.preds)
+    return loops
+
+
+def dominates(idom, a, b):
+    while b != a:
+        if idom[b] is None or idom[b] == b:
+            return False
+        b = idom[b]
+    return True
+
+
+def is_pure(quad):
+    # computes dst from its operands and nothing else
+    if quad.op in JUMPS or quad.op in (LABEL, PRINT):
+        return False
+    return quad.op == '=' or quad.op not in ASSIGN_OPS
+
+
+def hoist_loop_invariants(program):
+    """
+    Moves the computations of a loop whose operands do not change in the loop
+    in front of it, innermost loops first so what they hoist can leave the
+    enclosing loops as well. Returns the number of instructions moved.
+    """
+    hoisted = 0
+    while True:
+        count = hoist_from_loops(program)
+        if not count:
+            return hoisted
+        hoisted += count
+
+
+def preheader(program, blocks, labels, header, body):
+    # the block and the position where code runs once before the loop is entered, None when there is none
+    outside = [pred for pred in blocks[header].preds if pred.index not in body]
+    if len(outside) != 1:
+        return None
+    pred = outside[0]
+    last = program.quads[pred.end - 1]
+    if last.op == GOTO:
+        return pred, pred.end - 1
+    if last.op in JUMPS and labels[last.label] == blocks[header].start:
+        return None
+    # the loop is entered by falling through to the header
+    return pred, pred.end
+
+
+def loop_invariants(quads, blocks, idom, live_in, header, body):
+    # the instructions of the loop that can run once before it, in an order that computes operands first
+    inside = [(b, i) for b in sorted(body) for i in range(blocks[b].start, blocks[b].end)]
+    defs = {}
+    for _, i in inside:
+        if quads[i].dst is not None:
+            defs[quads[i].dst] = defs.get(quads[i].dst, 0) + 1
+    exits = [b for b in body if any(succ.index not in body for succ in blocks[b].succs)]
+    live_after = set()
+    for b in exits:
+        for succ in blocks[b].succs:
+            if succ.index not in body:
+                live_after |= live_in[succ.index]
+
+    invariant = []
+    # names whose only definition in the loop is moved out of it
+    known = set()
+    found = True
+    while found:
+        found = False
+        for b, i in inside:
+            quad = quads[i]
+            if quad.dst in known or not is_pure(quad) or defs[quad.dst] != 1 or quad.dst in live_in[header]:
+                continue
+            if any(name in defs and name not in known for name in quad.uses()):
+                continue
+            # a value that is used after the loop must be the one of the last iteration
+            if quad.dst in live_after and not all(dominates(idom, b, e) for e in exits):
+                continue
+            invariant.append(i)
+            known.add(quad.dst)
+            found = True
+    return invariant
+
+
+def hoist_from_loops(program):
+    # one round over the loops, a loop is skipped when a loop it contains or the code in
+    # front of it changed in this round, its analysis would be out of date
+    quads = program.quads
+    blocks = program.basic_blocks()
+    idom = dominators(blocks)
+    loops = natural_loops(blocks, idom)
+    if not loops:
+        return 0
+    live_in, _ = liveness(program, blocks)
+    labels = program.label_table()
+
+    changed = set()
+    moved = set()
+    inserted = {}
+    for header, body in sorted(loops.items(), key=lambda loop: len(loop[1])):
+        place = preheader(program, blocks, labels, header, body)
+        if place is None or body & changed or place[0].index in changed:
+            continue
+        invariant = loop_invariants(quads, blocks, idom, live_in, header, body)
+        if invariant:
+            moved.update(invariant)
+            inserted[place[1]] = [quads[i] for i in invariant]
+            changed |= body
+            changed.add(place[0].index)
+
+    if not moved:
+        return 0
+    _quads = []
+    for i in range(len(quads) + 1):
+        _quads.extend(inserted.get(i, ()))
+        if i < len(quads) and i not in moved:
+            _quads.append(quads[i])
+    program.quads = _quads
+    return len(moved)
+
+
+def test_loop_invariant_code_motion():
+    from parser import P2CParser
+
+    test_input = """
+        i = 0
+        while i < n: {
+            a = x * y
+            for j in range(0, 3, 1): { print("%f" a + x * y) }
+            i += a
+        }
+        """
+    test_output = """
+        #include <stdio.h>
+        int main () {
+        float i = 0.0;
+        float x;
+        float y;
+        float t1 = x * y;
+        float t2 = t1 + t1;
+        goto l2;
+        l1:;
+        float j = 0.0;
+        goto l4;
+        l3:;
+        printf("%f", t2);
+        j += 1.0;
+        l4:;
+        float t3 = j >= 3.0;
+        if (!t3) goto l3;
+        i += t1;
+        l2:;
+        float n;
+        t3 = i < n;
+        if (t3) goto l1;
+        return 0;
+        }
+        """
+
+    _parser = P2CParser()
+    _parser.parse(test_input)
+    # without unrolling the loop over j
+    result = _parser.generate_three_address_code(opt_level=2, unroll=(1, 0))
+    return result.split() == test_output.split()
+
+
+if __name__ == '__main__':
+    if not test_loop_invariant_code_motion():
+        raise Exception("[LOOPS] Loop invariant code motion test failed")
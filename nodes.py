@@ -0,0 +1,223 @@
+# node kinds of the parse tree, the leaves are plain values: names are str, numbers float,
+# True and False are 1 and 0, and break and continue are the strings 'break' and 'continue'
+ASSIGN = 0
+BINARY = 1
+UNARY = 2
+PRINT = 3
+IF = 4
+ELIF = 5
+ELSE = 6
+WHILE = 7
+FOR = 8
+
+
+class Node(object):
+    """
+    A node of the parse tree. The kind and the fields are per class, an
+    instance only holds its children and the line it starts at.
+
+    A node also reads as the tuple the parser used to build for it, e.g.
+    ('+', 'a', 1.0) or ('while', condition, statements): it compares equal to
+    that tuple, prints like it and can be indexed and unpacked like it.
+    """
+    __slots__ = ('lineno',)
+    kind = None
+    fields = ()
+
+    def tag(self):
+        return self.op
+
+    def astuple(self):
+        return (self.tag(),) + tuple(getattr(self, field) for field in self.fields)
+
+    def __getitem__(self, i):
+        return self.astuple()[i]
+
+    def __len__(self):
+        return len(self.fields) + 1
+
+    def __iter__(self):
+        return iter(self.astuple())
+
+    def __eq__(self, other):
+        if isinstance(other, Node):
+            other = other.astuple()
+        elif type(other) != tuple:
+            return NotImplemented
+        return self.astuple() == other
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __repr__(self):
+        return dump(self)
+
+
+class Assign(Node):
+    __slots__ = ('op', 'target', 'value')
+    kind = ASSIGN
+    fields = ('target', 'value')
+
+    def __init__(self, op, target, value, lineno=0):
+        self.op = op
+        self.target = target
+        self.value = value
+        self.lineno = lineno
+
+
+class Binary(Node):
+    __slots__ = ('op', 'left', 'right')
+    kind = BINARY
+    fields = ('left', 'right')
+
+    def __init__(self, op, left, right, lineno=0):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.lineno = lineno
+
+
+class Unary(Node):
+    __slots__ = ('op', 'operand')
+    kind = UNARY
+    fields = ('operand',)
+
+    def __init__(self, op, operand, lineno=0):
+        self.op = op
+        self.operand = operand
+        self.lineno = lineno
+
+
+class Print(Node):
+    __slots__ = ('format', 'arg')
+    kind = PRINT
+    fields = ('format', 'arg')
+
+    def __init__(self, format, arg, lineno=0):
+        self.format = format
+        self.arg = arg
+        self.lineno = lineno
+
+    def tag(self):
+        return 'print'
+
+
+class If(Node):
+    # orelse is an Elif, an Else or None
+    __slots__ = ('condition', 'body', 'orelse')
+    kind = IF
+    fields = ('condition', 'body', 'orelse')
+
+    def __init__(self, condition, body, orelse, lineno=0):
+        self.condition = condition
+        self.body = body
+        self.orelse = orelse
+        self.lineno = lineno
+
+    def tag(self):
+        return 'if'
+
+
+class Elif(If):
+    __slots__ = ()
+    kind = ELIF
+
+    def tag(self):
+        return 'elif'
+
+
+class Else(Node):
+    __slots__ = ('body',)
+    kind = ELSE
+    fields = ('body',)
+
+    def __init__(self, body, lineno=0):
+        self.body = body
+        self.lineno = lineno
+
+    def tag(self):
+        return 'else'
+
+
+class While(Node):
+    __slots__ = ('condition', 'body')
+    kind = WHILE
+    fields = ('condition', 'body')
+
+    def __init__(self, condition, body, lineno=0):
+        self.condition = condition
+        self.body = body
+        self.lineno = lineno
+
+    def tag(self):
+        return 'while'
+
+
+class For(Node):
+    # params is the tuple (start, end, step) of names and numbers
+    __slots__ = ('var', 'params', 'body')
+    kind = FOR
+    fields = ('var', 'params', 'body')
+
+    def __init__(self, var, params, body, lineno=0):
+        self.var = var
+        self.params = params
+        self.body = body
+        self.lineno = lineno
+
+    def tag(self):
+        return 'for'
+
+
+def dump(tree):
+    # the text repr gives for the tuples and lists of a tree, with a stack instead of recursion
+    # so it works for trees deeper than the recursion limit
+    parts = []
+    # (True, text to add) or (False, value to write)
+    work = [(False, tree)]
+    while work:
+        is_text, item = work.pop()
+        if is_text:
+            parts.append(item)
+            continue
+        if isinstance(item, Node):
+            item = item.astuple()
+        if type(item) == tuple:
+            parts.append('(')
+            work.append((True, ',)' if len(item) == 1 else ')'))
+        elif type(item) == list:
+            parts.append('[')
+            work.append((True, ']'))
+        else:
+            parts.append(repr(item))
+            continue
+        for i in range(len(item) - 1, -1, -1):
+            work.append((False, item[i]))
+            if i:
+                work.append((True, ', '))
+    return ''.join(parts)
+
+
+def trampoline(generator):
+    """
+    Runs a walk over a tree written as generators without recursion: a
+    generator yields the generator of a subtree and is sent back what that one
+    returns. Returns what the outermost generator returns.
+    """
+    stack = [generator]
+    value = None
+    while True:
+        try:
+            child = stack[-1].send(value)
+        except StopIteration as e:
+            stack.pop()
+            if not stack:
+                return e.value
+            value = e.value
+            continue
+        stack.append(child)
+        value = None
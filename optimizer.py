@@ -0,0 +1,108 @@
+import time
+
+
+class P2COptimizer(object):
+    """
+    Runs the optimization passes of an optimization level and times every pass.
+
+    Level 1 folds constants in the parse tree, cleans up the jumps and labels
+    and lets temporaries whose values are not live at the same time share a
+    name. Level 2 also builds the SSA form
+    of the three address code and runs sparse conditional constant propagation,
+    global value numbering and dead code elimination over it, moves loop
+    invariant computations out of the loops, reduces the multiplications of
+    their counters to additions (see strength.reduce_strength) and unrolls
+    the loops that take a known number of iterations (see unroll.unroll_loops).
+    """
+
+    def __init__(self, opt_level=0, stats=None, vectorize=False, unroll=None):
+        self.opt_level = opt_level
+        # the loops the vectorizer can run at once keep their shape
+        self.vectorize = vectorize
+        # (factor, budget) of the loop unrolling, see unroll.unroll_loops for the defaults
+        self.unroll = unroll
+        # the passes are also timed as opt.<pass> into a stats.P2CStats if given
+        self.stats = stats
+        # pass name -> seconds spent in it
+        self.timings = {}
+        # what the passes did, e.g. the number of temporaries before and after reusing them
+        self.statistics = {}
+
+    def run(self, name, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        self.timings[name] = self.timings.get(name, 0) + seconds
+        if self.stats is not None:
+            self.stats.add_time('opt.' + name, seconds)
+        return result
+
+    def optimize_tree(self, tree):
+        if self.opt_level >= 1:
+            from fold import P2CFolder
+
+            tree = self.run('fold', P2CFolder().fold, tree)
+        return tree
+
+    def optimize_program(self, program, variables=()):
+        # variables are the names the program assigns, the other names are temporaries,
+        # every pass is imported where it runs, the lower levels do not import the passes of the higher ones
+        # and import parser stays fast
+        if self.opt_level >= 2:
+            from ssa import P2CSSA
+
+            ssa = self.run('ssa', P2CSSA, program)
+            self.run('sccp', ssa.propagate_constants)
+            self.run('gvn', ssa.number_values)
+            program = self.run('rewrite', ssa.rewrite)
+            program = self.run('dce', eliminate_dead_code, program)
+        if self.opt_level >= 1:
+            from cleanup import simplify_control_flow
+
+            program = self.run('cleanup', simplify_control_flow, program)
+        if self.opt_level >= 2:
+            from loops import hoist_loop_invariants
+            from strength import reduce_strength
+            from unroll import UNROLL_BUDGET, UNROLL_FACTOR, unroll_loops
+
+            # the conditions of the jumps the cleanup removed are dead now
+            program = self.run('dce', eliminate_dead_code, program)
+            self.statistics['hoisted'] = self.run('licm', hoist_loop_invariants, program)
+            self.statistics['reduced'] = self.run('strength', reduce_strength, program, self.vectorize)
+            factor, budget = self.unroll or (UNROLL_FACTOR, UNROLL_BUDGET)
+            self.statistics['unrolled'] = self.run('unroll', unroll_loops, program, factor, budget, self.vectorize)
+            # and so are the counters the strength reduction replaced and the tests of unrolled loops
+            program = self.run('dce', eliminate_dead_code, program)
+        if self.opt_level >= 1:
+            from temps import reuse_temporaries
+
+            before, after = self.run('temps', reuse_temporaries, program, variables)
+            self.statistics['temps_before'] = before
+            self.statistics['temps_after'] = after
+        return program
+
+
+def eliminate_dead_code(program):
+    # removes the assignments whose value is never read, until there are none left
+    from cfg import liveness
+
+    removed = True
+    while removed:
+        removed = False
+        blocks = program.basic_blocks()
+        _, live_out = liveness(program, blocks)
+        quads = []
+        for block in blocks:
+            live = set(live_out[block.index])
+            kept = []
+            for quad in reversed(program.quads[block.start:block.end]):
+                if quad.dst is not None:
+                    if quad.dst not in live or quad.op == '=' and quad.src1 == quad.dst:
+                        removed = True
+                        continue
+                    live.discard(quad.dst)
+                live.update(quad.uses())
+                kept.append(quad)
+            quads.extend(reversed(kept))
+        program.quads = quads
+    return program
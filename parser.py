@@ -1,14 +1,90 @@
-import json
+import os
+import sys
+import threading
+import time
 
-from lexer import P2CLexer as __
-import ply.yacc as yacc
-import re
+from lexer import P2CLexer as __, get_lexer
+from tac import P2CProgram
+import nodes
+import tac
+
+
+class P2CGrammarError(Exception):
+    pass
+
+
+class P2CSyntaxError(Exception):
+    def __init__(self, message, lineno=None):
+        super().__init__(message)
+        # the line of the unexpected token, None at the end of the input
+        self.lineno = lineno
+
+
+# `import parser` may take this share of the time `import ply.yacc` takes, nothing is built at import time
+IMPORT_TIME_BUDGET = 0.5
+# the modules `import parser` does not import, they are imported by the methods that use them
+LAZY_MODULES = ('argparse', 'subprocess', 'inspect', 'ply.lex', 'ply.yacc', 'emitter', 'optimizer', 'scanner',
+                'stats', 'cfg', 'cleanup', 'fold', 'loops', 'ssa', 'temps', 'strength', 'unroll', 'infer',
+                'structure', 'vector', 'vm', 'numpy')
+
+
+class P2CContext(object):
+    """
+    The state of one compile: the parse tree, the names the program assigns,
+    the numbering of temporaries and labels, the lowered program and what the
+    optimization passes did. P2CParser starts a new one for every program, so
+    a context that was handed out is not changed by the compiles after it.
+    """
+
+    def __init__(self):
+        self.parse_tree = None
+        self.three_address_code = None
+        # seconds spent in every optimization pass and what they did
+        self.timings = {}
+        self.statistics = {}
+
+        self.symbol_table = {}
+        # body label -> (line, variable) of every for statement, see vector.P2CVectorizer
+        self.loops = {}
+        # [continue label, break label] of the loops being lowered, innermost last, see tac_jump
+        self.loop_labels = []
+        # what the vectorizer did, when the code was generated with vectorize
+        self.vector_report = []
+
+        self.t_number = 0
+        self.l_number = 0
+        self._lexer = None
+
+    @property
+    def lexer(self):
+        # a ply lexer of this compile only, cloned from the shared one when first asked for
+        if self._lexer is None:
+            self._lexer = get_lexer().lexer.clone()
+        return self._lexer
+
+    def start_lowering(self):
+        # the names and the numbering start over every time the program is lowered
+        self.symbol_table = {}
+        self.loops = {}
+        self.loop_labels = []
+        self.t_number = 0
+        self.l_number = 0
+
+
+def context_attribute(name):
+    # an attribute of P2CParser that is the one of its current context
+    return property(lambda self: getattr(self.context, name), lambda self, value: setattr(self.context, name, value))
 
 
 class P2CParser(object):
     tokens = __.tokens
-    _ = __()
-    lexer = _.lexer
+
+    # prebuilt LALR tables, regenerated only by `python parser.py --build-tables`
+    tab_module = 'parsetab'
+    # the tables are loaded once and shared by every instance, see load_tables
+    _tables = None
+    _tables_lock = threading.Lock()
+
     precedence = (
         ('nonassoc', 'GTE', 'GT', 'LTE', 'LT', 'EQU', 'NEQU', 'AND', 'OR'),  # Nonassociative operators
         ('left', 'PLUS', 'MINUS'),
@@ -18,28 +94,119 @@ class P2CParser(object):
     )
 
     def __init__(self):
-        self.parser = yacc.yacc(module=self)
-        self.parse_tree = None
-        self.three_address_code = None
+        self.parser = self.bind_parser()
+        self.reset()
 
-        self.assign_symbols = ['=', '+=', '-=', '*=']
+        # see instrument, a parser that also counts the reductions is bound when it is used
+        self.stats = None
+        self.counting_parser = None
+
+        self.assign_symbols = ['=', '+=', '-=', '*=', '/=']
         self.operation_symbols = ['+', '-', '*', '/', '&&', '||',
                                   '==',
                                   '>', '>=', '<', '<=', '!=', '%']
-        self.keywords = self._.reserved.keys()
-
-        self.symbol_table = {}
-
-        self.t_number = 0
-        self.l_number = 0
+        self.keywords = __.reserved.keys()
+
+    def reset(self):
+        # an instance compiles one program after the other, each in a context of its own
+        self.context = P2CContext()
+
+    @classmethod
+    def grammar(cls):
+        import ply.yacc as yacc
+
+        pdict = dict((k, getattr(cls, k)) for k in dir(cls))
+        pdict['__file__'] = sys.modules[cls.__module__].__file__
+
+        pinfo = yacc.ParserReflect(pdict)
+        pinfo.get_all()
+        if pinfo.error:
+            raise yacc.YaccError('Unable to build parser')
+        return pinfo
+
+    @classmethod
+    def build_tables(cls):
+        # the only place where the tables and the parser.out debug file are written,
+        # yacc regenerates them when their signature does not match the grammar
+        import ply.yacc as yacc
+
+        yacc.yacc(module=cls, tabmodule=cls.tab_module, debug=True, write_tables=True)
+
+    @classmethod
+    def load_tables(cls):
+        # read the prebuilt tables without regenerating or writing anything,
+        # a grammar that does not match them is an error instead of a silent rebuild
+        import ply.yacc as yacc
+
+        with P2CParser._tables_lock:
+            if P2CParser._tables is None:
+                pinfo = cls.grammar()
+                lr = yacc.LRTable()
+                try:
+                    signature = lr.read_table(cls.tab_module)
+                except (ImportError, yacc.VersionError) as e:
+                    raise P2CGrammarError("Cannot load the parser tables from '%s' (%s), "
+                                          "run `python parser.py --build-tables`" % (cls.tab_module, e))
+
+                if signature != pinfo.signature():
+                    raise P2CGrammarError("The grammar has changed since '%s' was built, "
+                                          "run `python parser.py --build-tables`" % cls.tab_module)
+                P2CParser._tables = lr, pinfo.error_func, signature
+        return P2CParser._tables
+
+    @classmethod
+    def grammar_signature(cls):
+        return cls.load_tables()[2]
+
+    def bind_parser(self, stats=None):
+        # with stats every reduction is counted in stats.reductions by its production
+        import ply.yacc as yacc
+
+        lr, error_func, _ = self.load_tables()
+
+        # the action and goto tables are shared, only the productions are bound to this instance
+        bound = yacc.LRTable()
+        bound.lr_method = lr.lr_method
+        bound.lr_action = lr.lr_action
+        bound.lr_goto = lr.lr_goto
+        bound.lr_productions = [yacc.MiniProduction(p.str, p.name, p.len, p.func, p.file, p.line)
+                                for p in lr.lr_productions]
+        bound.bind_callables(dict((p.func, getattr(self, p.func)) for p in bound.lr_productions if p.func))
+        if stats is not None:
+            for production in bound.lr_productions:
+                if production.callable is not None:
+                    production.callable = counted(production.callable, production.str, stats)
+        return yacc.LRParser(bound, error_func)
+
+    def instrument(self, stats):
+        # compiles from now on are timed and counted into stats (see stats.P2CStats), None turns it off
+        self.stats = stats
+        self.counting_parser = None if stats is None else self.bind_parser(stats)
+        return stats
+
+    # the state of the compile, see P2CContext
+    parse_tree = context_attribute('parse_tree')
+    three_address_code = context_attribute('three_address_code')
+    timings = context_attribute('timings')
+    statistics = context_attribute('statistics')
+    symbol_table = context_attribute('symbol_table')
+    vector_report = context_attribute('vector_report')
+    t_number = context_attribute('t_number')
+    l_number = context_attribute('l_number')
+
+    @property
+    def lexer(self):
+        return self.context.lexer
 
     def get_temp(self):
-        self.t_number += 1
-        return "t%d" % self.t_number
+        context = self.context
+        context.t_number += 1
+        return "t%d" % context.t_number
 
     def get_label(self):
-        self.l_number += 1
-        return "l%d" % self.l_number
+        context = self.context
+        context.l_number += 1
+        return "l%d" % context.l_number
 
     # grammar rules start *********************
 
@@ -49,10 +216,11 @@ class P2CParser(object):
         | empty
         """
         if len(p) == 3:
-            if not p[1]:
-                p[1] = []
-            p[0] = p[1] + [p[2]]
-            self.parse_tree = p[0]
+            # the list of the statements before is extended in place, it belongs to no other node
+            statements = p[1] if p[1] is not None else []
+            statements.append(p[2])
+            p[0] = statements
+            self.context.parse_tree = statements
 
     def p_statement(self, p):
         """
@@ -71,7 +239,7 @@ class P2CParser(object):
         """
         print : PRINT LPRAN STRING_LITERAL print_args RPRAN
         """
-        p[0] = tuple((p[1], p[3], p[4]))
+        p[0] = nodes.Print(p[3], p[4], p.lineno(1))
 
     def p_print_args(self, p):
         """
@@ -84,7 +252,7 @@ class P2CParser(object):
         """
         for : FOR ID IN RANGE LPRAN params RPRAN COLON LBRACE statements RBRACE
         """
-        p[0] = tuple((p[1], p[2], p[6], p[10]))
+        p[0] = nodes.For(p[2], p[6], p[10], p.lineno(1))
 
     def p_params(self, p):
         """
@@ -103,13 +271,13 @@ class P2CParser(object):
         """
         while : WHILE expr COLON LBRACE statements RBRACE
         """
-        p[0] = tuple((p[1], p[2], p[5]))
+        p[0] = nodes.While(p[2], p[5], p.lineno(1))
 
     def p_if(self, p):
         """
         if : IF expr COLON LBRACE statements RBRACE elif
         """
-        p[0] = tuple((p[1], p[2], p[5], p[7]))
+        p[0] = nodes.If(p[2], p[5], p[7], p.lineno(1))
 
     def p_elif(self, p):
         """
@@ -117,7 +285,7 @@ class P2CParser(object):
         | else
         """
         if len(p) != 2:
-            p[0] = tuple((p[1], p[2], p[5], p[7]))
+            p[0] = nodes.Elif(p[2], p[5], p[7], p.lineno(1))
         else:
             p[0] = p[1]
 
@@ -127,7 +295,7 @@ class P2CParser(object):
         | empty
         """
         if len(p) != 2:
-            p[0] = tuple((p[1], p[4]))
+            p[0] = nodes.Else(p[4], p.lineno(1))
 
     def p_assignment(self, p):
         """
@@ -137,19 +305,19 @@ class P2CParser(object):
                    | ID TIMES_EQUAL expr
                    | ID DIV_EQUAL expr
         """
-        p[0] = tuple((p[2], p[1], p[3]))
+        p[0] = nodes.Assign(p[2], p[1], p[3], p.lineno(1))
 
     def p_exr_unary_minus(self, p):
         """
          expr : MINUS expr %prec UMINUS
         """
-        p[0] = tuple((p[1], p[2]))
+        p[0] = nodes.Unary(p[1], p[2], p.lineno(1))
 
     def p_exr_unary_plus(self, p):
         """
          expr : PLUS expr %prec UPLUS
         """
-        p[0] = tuple((p[1], p[2]))
+        p[0] = nodes.Unary(p[1], p[2], p.lineno(1))
 
     def p_expr_operator_relop(self, p):
         """
@@ -174,7 +342,7 @@ class P2CParser(object):
         if len(p) == 2:
             p[0] = p[1]
         elif len(p) == 4:
-            p[0] = tuple([p[2], p[1], p[3]])
+            p[0] = nodes.Binary(p[2], p[1], p[3], p.lineno(2))
 
     def p_expr_pran(self, p):
         """
@@ -194,198 +362,373 @@ class P2CParser(object):
         'empty :'
         p[0] = None
 
+    @staticmethod
+    def p_error(p):
+        if p is None:
+            raise P2CSyntaxError("Syntax error at the end of the input")
+        raise P2CSyntaxError("Syntax error at line %d, unexpected %r" % (p.lineno, p.value), p.lineno)
+
     # grammar rules end $$$$$$$$$$$$$$$$$$$$
 
     def parse(self, input_data):
-        self.parser.parse(input_data, lexer=self.lexer)
-        return self.parse_tree
-
-    def get_tac(self, line):
-        if type(line) != tuple:
-            return "", line
-
-        if line[0] in self.assign_symbols:
-            return self.tac_assign(line)
-
-        elif line[0] in self.operation_symbols and len(line) == 3:
-            return self.tac_operator(line)
-        elif line[0] in self.operation_symbols and len(line) == 2:
-            return self.tac_operator_unary(line)
-        elif line[0] == 'if':
-            return self.tac_if_elif_else(line)
-        elif line[0] == 'while':
-            return self.tac_while(line)
-        elif line[0] == 'for':
-            return self.tac_for(line)
-        elif line[0] == 'print':
-            return self.tac_print(line)
-        else:
-            raise Exception("Invalid line: %s" % str(line))
-
-    def tac_print(self, line):
-        _str_format = line[1]
-        _arg = line[2]
-
-        if not _arg:
-            return f"printf({_str_format});\n", None
-        _code, root = self.get_tac(_arg)
-        return f"{_code}\nprintf({_str_format}, {root});\n", None
-
-    def tac_for(self, line):
-        for_var = line[1]
-        start, end, step = line[2]
-        statements = self.tac_program(line[3])
-
-        start_label = self.get_label()
-        end_label = self.get_label()
-
-        structure = ""
+        # the tokens are made in one pass into arrays, see scanner.P2CTokenArrays
+        from scanner import P2CTokenArrays
+
+        if self.stats is None:
+            return self.parse_arrays(P2CTokenArrays(input_data.encode()))
+        with self.stats.timer('lex'):
+            arrays = P2CTokenArrays(input_data.encode())
+        return self.parse_arrays(arrays)
+
+    def parse_arrays(self, arrays):
+        from scanner import P2CArrayAdapter
+
+        self.reset()
+        self.run_parser(P2CArrayAdapter(arrays))
+        return self.context.parse_tree
+
+    def parse_buffer(self, buffer):
+        # bytes, bytearray or mmap, lexed in place instead of as one str
+        from scanner import P2CScanner, P2CTokenAdapter
+
+        self.reset()
+        self.run_parser(P2CTokenAdapter(P2CScanner(buffer)))
+        return self.context.parse_tree
+
+    def parse_file(self, path):
+        from scanner import P2CScanner, P2CTokenAdapter
+
+        scanner = P2CScanner.from_file(path)
+        try:
+            self.reset()
+            self.run_parser(P2CTokenAdapter(scanner))
+        finally:
+            scanner.close()
+        return self.context.parse_tree
+
+    def run_parser(self, lexer):
+        if self.stats is None:
+            self.parser.parse(lexer=lexer)
+            return
+        from stats import P2CTimedLexer
+
+        # the time spent getting the tokens is lexing, not parsing
+        lexer = P2CTimedLexer(lexer)
+        start = time.perf_counter()
+        try:
+            self.counting_parser.parse(lexer=lexer)
+        finally:
+            self.stats.add_time('lex', lexer.seconds)
+            self.stats.add_time('parse', time.perf_counter() - start - lexer.seconds)
+            self.stats.count('tokens', lexer.tokens)
+        self.stats.count('statements', len(self.context.parse_tree or []))
+
+    # the statements with a body are lowered by generators that yield the generator of the body, see
+    # nodes.trampoline, and the expressions with a stack, so the nesting is not limited by the recursion limit
+
+    def get_tac(self, line, code):
+        # the name holding the value of an expression, None for a statement
+        if not isinstance(line, nodes.Node):
+            return line
+        if line.kind in (nodes.BINARY, nodes.UNARY):
+            return self.tac_expression(line, code)
+        self.tac_program([line], code)
+        return None
+
+    def tac_block(self, program, code):
+        for line in program or []:
+            if not isinstance(line, nodes.Node):
+                self.tac_jump(line, code)
+                continue
 
-        # define for variable if not defined before
-        if for_var not in self.symbol_table:
-            structure += f"float {for_var};\n"
-            self.symbol_table[for_var] = 'float'
+            kind = line.kind
+            if kind == nodes.ASSIGN:
+                self.tac_assign(line, code)
+            elif kind == nodes.BINARY or kind == nodes.UNARY:
+                self.tac_expression(line, code)
+            elif kind == nodes.IF:
+                yield self.tac_if_elif_else(line, code)
+            elif kind == nodes.WHILE:
+                yield self.tac_while(line, code)
+            elif kind == nodes.FOR:
+                yield self.tac_for(line, code)
+            elif kind == nodes.PRINT:
+                self.tac_print(line, code)
+            else:
+                raise Exception("Invalid line: %s" % str(line))
+
+    def tac_jump(self, line, code):
+        # break and continue, the labels are only made when a loop has them, outside a loop they do nothing
+        loop_labels = self.context.loop_labels
+        if not loop_labels:
+            return
+        i = 0 if line == 'continue' else 1
+        if loop_labels[-1][i] is None:
+            loop_labels[-1][i] = self.get_label()
+        code.emit(tac.GOTO, label=loop_labels[-1][i])
+
+    def tac_loop_body(self, statements, code, continue_label=None):
+        # lowers the body of a loop, returns the labels that continue and break jump to if they are used
+        loop_labels = self.context.loop_labels
+        loop_labels.append([continue_label, None])
+        yield self.tac_block(statements, code)
+        return loop_labels.pop()
+
+    def tac_print(self, line, code):
+        _str_format = line.format
+        _arg = line.arg
+
+        if _arg is None:
+            code.emit(tac.PRINT, src1=_str_format)
+            return
+        root = self.tac_expression(_arg, code)
+        code.emit(tac.PRINT, src1=_str_format, src2=root)
+
+    def tac_for(self, line, code):
+        for_var = line.var
+        start, end, step = line.params
+
+        body_label = self.get_label()
+        test_label = self.get_label()
+
+        self.context.symbol_table[for_var] = 'float'
+        self.context.loops[body_label] = (line.lineno, for_var)
 
         # initialize the for variable
-        structure += f"{for_var} = {start};\n"
+        code.emit('=', for_var, start)
         op = '>=' if step > 0 else '<='
 
-        structure += f"{start_label}:\n" \
-                     f"if ({for_var} {op} {end}) goto {end_label};\n" \
-                     f"{statements}\n" \
-                     f"{for_var} += {step};\n" \
-                     f"goto {start_label};\n" \
-                     f"{end_label}:;\n"
-        return structure, None
-
-    def tac_while(self, line):
-        condition = line[1]
-        statements = line[2]
-
-        condition_tac_str, condition_root = self.get_tac(condition)
-        statements_tac_str = self.tac_program(statements)
-
-        start_label = self.get_label()
-        end_label = self.get_label()
-
-        # the second time that we need to evaluate the condition
-        # no variable definitions will be needed
-        condition_tac_str_repeat = condition_tac_str.replace('float ', '')
-
-        structure = f"{start_label}: \n" \
-                    f"if (!{condition_root}) goto {end_label};\n" \
-                    f"{statements_tac_str}\n" \
-                    f"{condition_tac_str_repeat}\n" \
-                    f"goto {start_label};\n" \
-                    f"{end_label}:;\n"
-
-        return condition_tac_str + structure, None
-
-    def tac_if_elif_else(self, line):
-        data = []
+        # the test is at the bottom, the loop goes on while it is not done, which is not the
+        # inverted comparison when a bound is nan
+        code.emit(tac.GOTO, label=test_label)
+        code.emit(tac.LABEL, label=body_label)
+        continue_label, break_label = yield self.tac_loop_body(line.body, code)
+        if continue_label is not None:
+            code.emit(tac.LABEL, label=continue_label)
+        code.emit('+=', for_var, step)
+        code.emit(tac.LABEL, label=test_label)
+        done = self.get_temp()
+        code.emit(op, done, for_var, end)
+        code.emit(tac.IFNOT, src1=done, label=body_label)
+        if break_label is not None:
+            code.emit(tac.LABEL, label=break_label)
+
+    def tac_while(self, line, code):
+        condition = line.condition
+        statements = line.body
+
+        body_label = self.get_label()
+        test_label = self.get_label()
+
+        # the condition is only emitted once, at the bottom
+        code.emit(tac.GOTO, label=test_label)
+        code.emit(tac.LABEL, label=body_label)
+        _, break_label = yield self.tac_loop_body(statements, code, test_label)
+        code.emit(tac.LABEL, label=test_label)
+        condition_root = self.tac_expression(condition, code)
+        code.emit(tac.IF, src1=condition_root, label=body_label)
+        if break_label is not None:
+            code.emit(tac.LABEL, label=break_label)
+
+    def tac_if_elif_else(self, line, code):
+        branches = []
+        _else = None
         _line = line
-        while _line:
-            keyword = _line[0]
-
-            if keyword == 'else':
-                data.append({
-                    'keyword': 'else',
-                    'statements': self.tac_program(_line[1])
-                })
+        while _line is not None:
+            if _line.kind == nodes.ELSE:
+                _else = _line.body
                 break
-
-            if keyword == 'elif':
-                keyword = 'else if'
-            data.append({
-                'keyword': keyword,
-                'condition': self.get_tac(_line[1]),
-                'statements': self.tac_program(_line[2])
-            })
-
-            _line = _line[3]
+            branches.append((_line.condition, _line.body))
+            _line = _line.orelse
 
         # all the conditions first
-        conditions = ""
-        structure = ""
-        if_done_label = self.get_label()
-
-        for part in data:
-            keyword = part.get('keyword')
-            if keyword == 'else':
-                structure += f"{part.get('statements')}\n"
-                continue
-            _condition, condition_root = part.get('condition')
-            conditions += f"{_condition}\n"
+        roots = [self.tac_expression(condition, code) for condition, _ in branches]
 
+        if_done_label = self.get_label()
+        for root, (_, statements) in zip(roots, branches):
             statements_end = self.get_label()
 
-            structure += f"if (!{condition_root}) goto {statements_end};\n" \
-                         f"{part.get('statements')}\n" \
-                         f"goto {if_done_label};\n" \
-                         f"{statements_end}:;\n"
-
-        structure += f"{if_done_label}:;\n"
-        return conditions + structure, None
-
-    def tac_operator_unary(self, line):
-        a = line[1]
-        op = line[0]
-        a_tac_str, a_root = self.get_tac(a)
-        temp = self.get_temp()
-        return a_tac_str + f"float {temp} = {op}{a_root};\n", temp
-
-    def tac_operator(self, line):
-        a = line[1]
-        b = line[2]
-        op = line[0]
-
-        a_tac_str, a_root = self.get_tac(a)
-        b_tac_str, b_root = self.get_tac(b)
-
-        temp = self.get_temp()
-
-        _str = a_tac_str + b_tac_str
-        _str += f"float {temp} = {a_root} {op} {b_root};\n"
-
-        return _str, temp
-
-    def tac_assign(self, line):
-        lhs = line[1]
-        rhs = line[2]
-        op = line[0]
-
-        if lhs in self.symbol_table.keys():
-            # symbol defined before, no need to add type
-            _type = ''
+            code.emit(tac.IFNOT, src1=root, label=statements_end)
+            yield self.tac_block(statements, code)
+            code.emit(tac.GOTO, label=if_done_label)
+            code.emit(tac.LABEL, label=statements_end)
+
+        yield self.tac_block(_else, code)
+        code.emit(tac.LABEL, label=if_done_label)
+
+    def tac_expression(self, expr, code):
+        # the operands of an operator are lowered left to right before it, in the order of a
+        # postorder walk, an operator is pushed again as (operator,) to be emitted once they are
+        if not isinstance(expr, nodes.Node):
+            return expr
+        roots = []
+        work = [expr]
+        while work:
+            node = work.pop()
+            if type(node) == tuple:
+                node = node[0]
+                temp = self.get_temp()
+                if node.kind == nodes.UNARY:
+                    code.emit(tac.NEG if node.op == '-' else tac.POS, temp, roots.pop())
+                else:
+                    b_root = roots.pop()
+                    code.emit(node.op, temp, roots.pop(), b_root)
+                roots.append(temp)
+            elif isinstance(node, nodes.Node):
+                work.append((node,))
+                if node.kind == nodes.UNARY:
+                    work.append(node.operand)
+                else:
+                    work.append(node.right)
+                    work.append(node.left)
+            else:
+                roots.append(node)
+        return roots[0]
+
+    def tac_assign(self, line, code):
+        lhs = line.target
+        rhs = line.value
+        op = line.op
+
+        self.context.symbol_table[lhs] = 'float'
+
+        rhs_root = self.tac_expression(rhs, code)
+        code.emit(op, lhs, rhs_root)
+
+    def tac_program(self, program, code):
+        nodes.trampoline(self.tac_block(program, code))
+
+    def tac_statements(self, program, code, memo=None):
+        # the top level statements, with a memo a statement lowered before is copied instead
+        if memo is None:
+            return self.tac_program(program, code)
+        for line in program or []:
+            key = repr(line)
+            entry = memo.get(key)
+            if entry is None:
+                entry = self.tac_statement_entry(line, code)
+                memo.put(key, entry)
+            else:
+                self.tac_replay(entry, code, line)
+
+    def tac_statement_entry(self, line, code):
+        context = self.context
+        t_number, l_number = context.t_number, context.l_number
+        start = len(code.quads)
+        symbol_table, loops = context.symbol_table, context.loops
+        context.symbol_table, context.loops = {}, {}
+        self.get_tac(line, code)
+        names, context.symbol_table = context.symbol_table, symbol_table
+        context.symbol_table.update(names)
+        statement_loops, context.loops = context.loops, loops
+        context.loops.update(statement_loops)
+        # the lines of the loops are kept from the start of the statement, it may be replayed at another line
+        statement_loops = dict((label, (lineno - line.lineno, var)) for label, (lineno, var) in statement_loops.items())
+        return (t_number, context.t_number - t_number, l_number, context.l_number - l_number,
+                [quad.copy() for quad in code.quads[start:]], names, statement_loops)
+
+    def tac_replay(self, entry, code, line):
+        context = self.context
+        t_number, t_count, l_number, l_count, quads, names, loops = entry
+        loops = dict((label, (line.lineno + lineno, var)) for label, (lineno, var) in loops.items())
+        if t_number == context.t_number and l_number == context.l_number:
+            code.quads.extend(quad.copy() for quad in quads)
+            context.loops.update(loops)
+        else:
+            # the temporaries and labels of the statement are numbered from where this program is
+            rename = dict(("t%d" % (t_number + i), "t%d" % (context.t_number + i)) for i in range(1, t_count + 1))
+            rename.update(("l%d" % (l_number + i), "l%d" % (context.l_number + i)) for i in range(1, l_count + 1))
+            for quad in quads:
+                code.quads.append(tac.Quad(quad.op, rename.get(quad.dst, quad.dst), rename.get(quad.src1, quad.src1),
+                                           rename.get(quad.src2, quad.src2), rename.get(quad.label, quad.label)))
+            context.loops.update((rename[label], loop) for label, loop in loops.items())
+        context.t_number += t_count
+        context.l_number += l_count
+        context.symbol_table.update(names)
+
+    def generate_three_address_code(self, fp=None, opt_level=0, memo=None, vectorize=False, structured=False,
+                                    infer_types=False, unroll=None):
+        # the C code is emitted straight into fp if given, otherwise returned as a string,
+        # a memo (see cache.P2CStatementMemo) keeps the lowered top level statements between calls,
+        # with vectorize the loops without dependences between iterations are emitted as countable
+        # loops too, see vector.P2CVectorizer and vector_report,
+        # with structured the loops and branches are C statements instead of gotos, see P2CEmitter,
+        # with infer_types the names that only hold whole numbers are int or _Bool, see P2CTypeInference,
+        # unroll is the (factor, budget) of the loop unrolling at level 2, see unroll.unroll_loops
+        from emitter import P2CEmitter
+
+        program = self.lower(opt_level, memo, vectorize, unroll)
+        types = None
+        if infer_types:
+            from infer import P2CTypeInference
+
+            types = P2CTypeInference(program).types()
+            symbol_table = self.context.symbol_table
+            symbol_table.update((name, types[name]) for name in symbol_table if name in types)
+        emitter = P2CEmitter(types, structured=structured)
+        if vectorize:
+            from vector import P2CVectorizer
+
+            vectorizer = P2CVectorizer(program, self.context.loops)
+            self.context.vector_report = vectorizer.report()
+            emitter = P2CEmitter(types, vectorizer.vectorized(), structured)
+        if self.stats is not None:
+            return self.emit_counted(emitter, fp)
+        if fp is None:
+            return emitter.getvalue(self.context.three_address_code)
+        emitter.write(self.context.three_address_code, fp)
+
+    def lower(self, opt_level=0, memo=None, vectorize=False, unroll=None):
+        # the optimized three address code of the parse tree, without printing it as C,
+        # with vectorize the optimizer keeps the loops the vectorizer can run at once as they are
+        from optimizer import P2COptimizer
+
+        context = self.context
+        context.start_lowering()
+        optimizer = P2COptimizer(opt_level, self.stats, vectorize, unroll)
+        code = P2CProgram()
+        tree = optimizer.optimize_tree(context.parse_tree)
+        if self.stats is None:
+            self.tac_statements(tree, code, memo)
         else:
-            _type = 'float '
-            self.symbol_table[lhs] = 'float'
-
-        rhs_str, rhs_root = self.get_tac(rhs)
-        tac_str = f"{_type}{lhs} {op} {rhs_root};\n"
-        return rhs_str + tac_str, lhs
-
-    def tac_program(self, program):
-        if not program:
-            return "\n"
-        result = ""
-        for line in program:
-            _line, root = self.get_tac(line)
-            result += _line
-
-        return result
-
-    def generate_three_address_code(self):
-        body = self.tac_program(self.parse_tree)
-        c_tac_code = "#include <stdio.h>\nint main () {\n%s\nreturn 0;\n}" % body
-        c_tac_code = re.sub(' +', ' ', c_tac_code)
-        c_tac_code = re.sub('\n+', '\n', c_tac_code)
-        return c_tac_code
+            with self.stats.timer('lower'):
+                self.tac_statements(tree, code, memo)
+            self.stats.count('temps', context.t_number)
+            self.stats.count('labels', context.l_number)
+            self.stats.count('quads', len(code.quads))
+        context.three_address_code = optimizer.optimize_program(code, set(context.symbol_table))
+        context.timings = optimizer.timings
+        context.statistics = optimizer.statistics
+        return context.three_address_code
+
+    def emit_counted(self, emitter, fp):
+        from stats import P2CCountingLines
+
+        self.stats.count('quads_emitted', len(self.context.three_address_code.quads))
+        lines = P2CCountingLines(emitter.lines(self.context.three_address_code))
+        with self.stats.timer('emit'):
+            if fp is None:
+                c_code = ''.join(lines)
+            else:
+                fp.writelines(lines)
+                c_code = None
+        self.stats.count('bytes', lines.count)
+        return c_code
 
     def test(self, input_data):
         print(self.parse(input_data))
 
 
+def counted(function, production, stats):
+    # the action of a production, counting its reductions
+    reductions = stats.reductions
+
+    def reduce(p):
+        reductions[production] = reductions.get(production, 0) + 1
+        return function(p)
+    return reduce
+
+
 def test_parse_tree_generation():
     test_input = """
         a = 10
@@ -443,18 +786,147 @@ def test_parse_tree_generation():
 
     # clean result
     result = str(result).replace(' ', '').replace('\n', '')
-    return test_output == result
+
+    # the nodes read as the tuples above and know the line they start at
+    _while = _parser.parse_tree[2]
+    return test_output == result and _while.kind == nodes.WHILE and _while.lineno == 5
+
+
+def test_deep_nesting():
+    # nested far deeper than the recursion limit
+    depth = 100000
+    _parser = P2CParser()
+
+    # a + a + ... nests to the left
+    _parser.parse("x = " + " + ".join(["a"] * (depth + 1)))
+    expected = ["float a;", "float t1 = a + a;"]
+    expected += ["float t%d = t%d + a;" % (i, i - 1) for i in range(2, depth + 1)]
+    expected.append("float x = t%d;" % depth)
+    if _parser.generate_three_address_code().split('\n')[2:-3] != expected:
+        return False
+    if repr(_parser.parse_tree).count('+') != depth:
+        return False
+
+    # (a - (a - ...)) nests to the right
+    _parser.parse("x = " + "(a - " * depth + "a" + ")" * depth)
+    expected = ["float a;", "float t1 = a - a;"]
+    expected += ["float t%d = a - t%d;" % (i, i - 1) for i in range(2, depth + 1)]
+    expected.append("float x = t%d;" % depth)
+    if _parser.generate_three_address_code().split('\n')[2:-3] != expected:
+        return False
+
+    # folded to a constant and to a variable
+    _parser.parse("x = " + " + ".join(["1"] * (depth + 1)) + "\ny = " + "-" * depth + "b")
+    if _parser.generate_three_address_code(opt_level=1).split('\n')[2:-3] != \
+            ["float x = %.1f;" % (depth + 1), "float b;", "float y = b;"]:
+        return False
+
+    # blocks, the temporaries of the conditions are numbered from the innermost loop out
+    depth //= 10
+    _parser.parse("while a < 3: {\n" * depth + "a += 1\n" + "}\n" * depth)
+    expected = []
+    for i in range(1, depth + 1):
+        expected += ["goto l%d;" % (2 * i), "l%d:;" % (2 * i - 1)]
+    expected += ["float a;", "a += 1.0;"]
+    for i in range(depth, 0, -1):
+        expected += ["l%d:;" % (2 * i), "float t%d = a < 3.0;" % (depth - i + 1),
+                     "if (t%d) goto l%d;" % (depth - i + 1, 2 * i - 1)]
+    return _parser.generate_three_address_code().split('\n')[2:-3] == expected
+
+
+def test_import_time():
+    # import in fresh interpreters, the lexer and the parser tables must not be built, the passes not imported
+    # and the import must stay well under the one of ply.yacc, which the parser only needs once it compiles
+    import subprocess
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    # with the bytecode cached, as every import after the first one
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    _code = "import sys\n" \
+            "import lexer, parser\n" \
+            "print(lexer._lexer is None and parser.P2CParser._tables is None)\n" \
+            "print(' '.join(name for name in parser.LAZY_MODULES if name in sys.modules))\n"
+    _out = subprocess.check_output([sys.executable, '-c', _code], cwd=directory, env=env, text=True)
+    if _out.split('\n') != ['True', '', '']:
+        return False
+
+    def seconds(module):
+        # the fastest of a few imports, the others were slowed down by something else
+        _code = "import time\nstart = time.perf_counter()\nimport %s\nprint(time.perf_counter() - start)\n" % module
+        return min(float(subprocess.check_output([sys.executable, '-c', _code], cwd=directory, env=env,
+                                                 text=True)) for _ in range(5))
+
+    return seconds('parser') < IMPORT_TIME_BUDGET * seconds('ply.yacc')
 
 
 if __name__ == '__main__':
+    import argparse
+
+    from stats import P2CStats
+    from unroll import UNROLL_BUDGET, UNROLL_FACTOR
+
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument('--build-tables', action='store_true',
+                            help="rebuild %s.py and parser.out if the grammar has changed" % P2CParser.tab_module)
+    arg_parser.add_argument('-O', dest='opt_level', type=int, choices=[0, 1, 2], default=0,
+                            help="optimization level, 1 folds constants, 2 also optimizes the SSA form")
+    arg_parser.add_argument('--timings', action='store_true',
+                            help="print the time spent in every optimization pass")
+    arg_parser.add_argument('--stats', action='store_true',
+                            help="print what the optimization passes did")
+    arg_parser.add_argument('--profile', metavar='JSON',
+                            help="write the time of every phase, the counters and the reductions per rule here")
+    arg_parser.add_argument('--vectorize', action='store_true',
+                            help="emit the loops without dependences between iterations as countable loops too "
+                                 "and print which")
+    arg_parser.add_argument('--structured', action='store_true',
+                            help="emit the loops and branches as while, for and if statements instead of gotos")
+    arg_parser.add_argument('--infer-types', action='store_true',
+                            help="declare the names that only hold whole numbers as int or _Bool instead of float")
+    arg_parser.add_argument('--unroll-factor', type=int, default=UNROLL_FACTOR,
+                            help="copies of the body a loop runs from one test to the next at -O2, 1 to only "
+                                 "unroll loops completely")
+    arg_parser.add_argument('--unroll-budget', type=int, default=UNROLL_BUDGET,
+                            help="instructions the copies of the body of an unrolled loop may add up to, 0 to not "
+                                 "unroll")
+    arg_parser.add_argument('--test', action='store_true',
+                            help="only run the tests of the parser, with the ones of deep nesting and import time")
+    args = arg_parser.parse_args()
+
+    if args.build_tables:
+        P2CParser.build_tables()
+        sys.exit()
+
     if not test_parse_tree_generation():
         raise Exception("[PARSER] Parse tree test filed")
+    if args.test:
+        if not test_deep_nesting():
+            raise Exception("[PARSER] Deep nesting test failed")
+        if not test_import_time():
+            raise Exception("[PARSER] Import time test failed")
+        sys.exit()
 
     parser = P2CParser()
+    if args.profile:
+        parser.instrument(P2CStats())
     _input = open('program.py.txt')
     test_input = _input.read()
     parser.parse(test_input)
     _out = open('program.c', 'w')
-    _out.write(parser.generate_three_address_code())
+    parser.generate_three_address_code(_out, opt_level=args.opt_level, vectorize=args.vectorize,
+                                       structured=args.structured, infer_types=args.infer_types,
+                                       unroll=(args.unroll_factor, args.unroll_budget))
+    for line in parser.vector_report:
+        print(line, file=sys.stderr)
+    if args.timings:
+        for name, seconds in parser.timings.items():
+            print("%-8s %8.3f ms" % (name, seconds * 1000), file=sys.stderr)
+    if args.stats:
+        for name, value in parser.statistics.items():
+            print("%-12s %8s" % (name, value), file=sys.stderr)
+    if args.profile:
+        with open(args.profile, 'w') as _profile:
+            parser.stats.to_json(_profile)
     _input.close()
     _out.close()
@@ -0,0 +1,112 @@
+import contextlib
+import os
+import queue
+import threading
+
+from parser import P2CParser
+
+
+class P2CParserPool(object):
+    """
+    Parsers ready to compile, shared by the threads of a process. A parser
+    compiles one program at a time, a thread takes one from the pool and gives
+    it back when it is done. At most size parsers are made, when they are all
+    in use a thread waits for one, up to timeout seconds.
+    """
+
+    def __init__(self, size=None, timeout=None):
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        # the last parser given back is the next one taken, it is the warmest
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def warm(self):
+        # makes the parsers now instead of on first use
+        with self.lock:
+            missing = self.size - self.created
+            self.created = self.size
+        for _ in range(missing):
+            self.idle.put(P2CParser())
+
+    def acquire(self, timeout=None):
+        # raises queue.Empty when no parser was given back within timeout
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            create = self.created < self.size
+            if create:
+                self.created += 1
+        if create:
+            try:
+                return P2CParser()
+            except Exception:
+                with self.lock:
+                    self.created -= 1
+                raise
+        return self.idle.get(timeout=self.timeout if timeout is None else timeout)
+
+    def release(self, _parser):
+        _parser.reset()
+        self.idle.put(_parser)
+
+    @contextlib.contextmanager
+    def parser(self, timeout=None):
+        _parser = self.acquire(timeout)
+        try:
+            yield _parser
+        finally:
+            self.release(_parser)
+
+    def compile(self, source, opt_level=0, timeout=None):
+        # the C code of source
+        with self.parser(timeout) as _parser:
+            _parser.parse(source)
+            return _parser.generate_three_address_code(opt_level=opt_level)
+
+
+def test_parser_pool():
+    import concurrent.futures
+
+    programs = ["a = %d\nwhile a < 10: { a += 1 }\nprint(\"%%f\" a * %d)\n" % (i, i) for i in range(40)]
+    _parser = P2CParser()
+    expected = []
+    for program in programs:
+        _parser.parse(program)
+        expected.append(_parser.generate_three_address_code(opt_level=2))
+
+    # a context is not changed by the compiles after it, lowering again gives the same code
+    context = _parser.context
+    _parser.parse(programs[0])
+    if context.parse_tree != _parser.parse(programs[-1]) or context.symbol_table != {'a': 'float'}:
+        return False
+    _parser.parse(programs[0])
+    if _parser.generate_three_address_code(opt_level=2) != expected[0] or \
+            _parser.generate_three_address_code(opt_level=2) != expected[0]:
+        return False
+
+    _pool = P2CParserPool(4)
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda program: _pool.compile(program, 2), programs))
+    if results != expected or not 0 < _pool.created <= 4:
+        return False
+
+    # all the parsers are in use
+    _pool.warm()
+    taken = [_pool.acquire() for _ in range(_pool.size)]
+    try:
+        _pool.acquire(timeout=0.01)
+        return False
+    except queue.Empty:
+        pass
+    for _parser in taken:
+        _pool.release(_parser)
+    return _pool.compile(programs[1], 2) == expected[1]
+
+
+if __name__ == '__main__':
+    if not test_parser_pool():
+        raise Exception("[POOL] Parser pool test failed")
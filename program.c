@@ -10,33 +10,32 @@ float t5 = t1 / t4;
 float c = t5;
 float t6 = c < 2.0;
 float t7 = c > 2.0;
-if (!t6) goto l6;
+if (!t6) goto l2;
 printf("C is less than 2");
+goto l1;
+l2:;
+if (!t7) goto l3;
+float m = 10.0;
 goto l5;
+l4:;
+float t8 = 10.0 - m;
+printf("Iteration %f\n", t8);
+float i = 0;
+goto l7;
 l6:;
-if (!t7) goto l7;
-float m = 10.0;
-float t8 = m > 0.0;
-l3: 
-if (!t8) goto l4;
-float t9 = 10.0 - m;
-printf("Iteration %f\n", t9);
-float i;
-i = 0;
-l1:
-if (i >= m) goto l2;
 printf("\tI: %f\n", i);
 i += 1;
-goto l1;
-l2:;
-m -= 1.0;
-t8 = m > 0.0;
-goto l3;
-l4:;
-goto l5;
 l7:;
-printf("C is exactly 2");
+float t9 = i >= m;
+if (!t9) goto l6;
+m -= 1.0;
 l5:;
-printf("C:g %f\n", c);
+float t10 = m > 0.0;
+if (t10) goto l4;
+goto l1;
+l3:;
+printf("C is exactly 2");
+l1:;
+printf("C: %f\n", c);
 return 0;
-}
\ No newline at end of file
+}
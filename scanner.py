@@ -0,0 +1,279 @@
+import mmap
+import re
+from array import array
+
+import ply.lex as lex
+
+from lexer import P2CLexer
+
+# the value of every token whose rule matches one text, the other values come from the source
+FIXED_VALUES = {
+    P2CLexer.GTE: '>=', P2CLexer.EQU: '==', P2CLexer.NEQU: '!=', P2CLexer.AND: '&&', P2CLexer.OR: '||',
+    P2CLexer.PLUS_EQUAL: '+=', P2CLexer.DIV_EQUAL: '/=', P2CLexer.MINUS_EQUAL: '-=', P2CLexer.TIMES_EQUAL: '*=',
+    P2CLexer.PLUS: '+', P2CLexer.MINUS: '-', P2CLexer.TIMES: '*', P2CLexer.MOD: '%',
+    P2CLexer.LTE: '<=', P2CLexer.LT: '<', P2CLexer.GT: '>', P2CLexer.NOT: '!',
+    P2CLexer.LPRAN: '(', P2CLexer.RPRAN: ')', P2CLexer.LBRACE: '{', P2CLexer.RBRACE: '}',
+    P2CLexer.SEP: ',', P2CLexer.EQ: '=', P2CLexer.DIV: '/', P2CLexer.COLON: ':',
+}
+# what the keywords stand for, as P2CLexer.t_ID converts them
+KEYWORD_VALUES = {'and': '&&', 'or': '||', 'not': '!', 'True': 1, 'False': 0}
+# rules that do not make a token
+SKIPPED = ('COMMENTS', 'newline', 'end')
+# token kinds by their code in P2CTokenArrays
+KINDS = tuple(P2CLexer.tokens)
+
+_pattern = None
+
+
+def token_pattern():
+    # the rules of P2CLexer, over bytes, built on first use
+    global _pattern
+    if _pattern is None:
+        rules = sorted((getattr(P2CLexer, name) for name in dir(P2CLexer) if name.startswith('t_')
+                        and callable(getattr(P2CLexer, name)) and name != 't_error'),
+                       key=lambda rule: rule.__code__.co_firstlineno)
+        # the most frequent rules are tried first, no other rule matches at a letter, '_' or a newline
+        # so the tokens are the same
+        rules.sort(key=lambda rule: rule.__name__ not in ('t_ID', 't_newline'))
+        groups = [b'(?P<%s>%s)' % (rule.__name__[2:].encode(), rule.__doc__.encode()) for rule in rules]
+        groups.append(b'(?P<end>\\Z)')
+        # the ignored characters in front of a token are part of its match, not a match of their own
+        ignore = b'[%s]*' % re.escape(P2CLexer.t_ignore).encode()
+        _pattern = re.compile(b'%s(?:%s)' % (ignore, b'|'.join(groups)), re.VERBOSE)
+    return _pattern
+
+
+class P2CScanner(object):
+    """
+    The tokens of P2CLexer over a bytes-like buffer, e.g. a memory mapped
+    file, as (type, start, end) offsets into it. Nothing of the source is
+    copied but the identifiers, numbers and strings whose value is asked for.
+    lineno is the line of the last token.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.lineno = 1
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as _file:
+            try:
+                return cls(mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ))
+            except ValueError:
+                # an empty file cannot be mapped
+                return cls(b'')
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def tokens(self):
+        buffer = self.buffer
+        reserved = P2CLexer.reserved
+        position = 0
+        for match in token_pattern().finditer(buffer):
+            if match.start() != position:
+                illegal_character(buffer, position, self.lineno)
+            start, end = match.span(match.lastindex)
+            position = end
+
+            kind = match.lastgroup
+            if kind in SKIPPED:
+                if kind == 'newline':
+                    self.lineno += end - start
+                continue
+            if kind == P2CLexer.ID:
+                kind = reserved.get(buffer[start:end].decode(), kind)
+            yield kind, start, end
+
+        if position != len(buffer):
+            illegal_character(buffer, position, self.lineno)
+
+    def text(self, start, end):
+        return self.buffer[start:end].decode()
+
+    def value(self, kind, start, end):
+        # the value P2CLexer gives the token
+        if kind in FIXED_VALUES:
+            return FIXED_VALUES[kind]
+        if kind == P2CLexer.NUMBER:
+            return float(self.buffer[start:end])
+        text = self.text(start, end)
+        return KEYWORD_VALUES.get(text, text)
+
+
+class P2CTokenAdapter(object):
+    """
+    Feeds the tokens of a P2CScanner to the ply parser, one token at a time.
+    """
+
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self._tokens = scanner.tokens()
+
+    def token(self):
+        for kind, start, end in self._tokens:
+            tok = lex.LexToken()
+            tok.type = kind
+            tok.value = self.scanner.value(kind, start, end)
+            tok.lineno = self.scanner.lineno
+            tok.lexpos = start
+            return tok
+        return None
+
+
+class P2CTokenArrays(object):
+    """
+    All the tokens of a buffer in parallel arrays, made in one pass: the code
+    of the kind (an index into KINDS), the start offset, the line and the id
+    of the value in table. Equal values are stored once, the value of a
+    number is converted the first time it is seen.
+    """
+
+    def __init__(self, buffer):
+        self.kinds = array('B')
+        self.starts = array('Q')
+        self.lines = array('L')
+        self.values = array('L')
+        self.table = []
+        self.tokenize(buffer)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def intern(self, value):
+        self.table.append(value)
+        return len(self.table) - 1
+
+    def tokenize(self, buffer):
+        pattern = token_pattern()
+        codes = dict((kind, code) for code, kind in enumerate(KINDS))
+
+        # by the index of the group of a rule: (kind code, value id) of the rules with a fixed value,
+        # None for the rules whose value is in the source, the rule name for the others
+        rules = [None] * (pattern.groups + 1)
+        for name, index in pattern.groupindex.items():
+            if name in FIXED_VALUES:
+                rules[index] = (codes[name], self.intern(FIXED_VALUES[name]))
+            elif name in SKIPPED:
+                rules[index] = name
+        # source text -> (kind code, value id) of the identifiers, keywords, numbers and strings
+        seen = {}
+
+        kinds, starts, lines, values = self.kinds.append, self.starts.append, self.lines.append, self.values.append
+        number = pattern.groupindex[P2CLexer.NUMBER]
+        lineno = 1
+        position = 0
+        for match in pattern.finditer(buffer):
+            if match.start() != position:
+                illegal_character(buffer, position, lineno)
+            index = match.lastindex
+            start, position = match.span(index)
+            rule = rules[index]
+            if rule is None:
+                text = buffer[start:position]
+                rule = seen.get(text)
+                if rule is None:
+                    if index == number:
+                        rule = codes[P2CLexer.NUMBER], self.intern(float(text))
+                    else:
+                        name = text.decode()
+                        kind = P2CLexer.reserved.get(name, P2CLexer.STRING_LITERAL if name[0] == '"' else P2CLexer.ID)
+                        rule = codes[kind], self.intern(KEYWORD_VALUES.get(name, name))
+                    seen[text] = rule
+            elif type(rule) == str:
+                if rule == 'newline':
+                    lineno += position - start
+                continue
+            kinds(rule[0])
+            starts(start)
+            lines(lineno)
+            values(rule[1])
+
+
+class P2CArrayAdapter(object):
+    """
+    Feeds the tokens of P2CTokenArrays to the ply parser.
+    """
+
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.index = 0
+        self.lineno = 1
+
+    def token(self):
+        i = self.index
+        arrays = self.arrays
+        if i == len(arrays.kinds):
+            return None
+        self.index = i + 1
+        tok = lex.LexToken()
+        tok.type = KINDS[arrays.kinds[i]]
+        tok.value = arrays.table[arrays.values[i]]
+        # the tokens of a line share one int, the nodes of the parse tree keep it
+        if arrays.lines[i] != self.lineno:
+            self.lineno = arrays.lines[i]
+        tok.lineno = self.lineno
+        tok.lexpos = arrays.starts[i]
+        return tok
+
+
+def illegal_character(buffer, position, lineno):
+    # the ignored characters in front of it are not what is illegal
+    while position < len(buffer) and buffer[position:position + 1] in P2CLexer.t_ignore.encode():
+        position += 1
+    character = buffer[position:position + 1].decode(errors='replace')
+    error = lex.LexError("Scanning error. Illegal character '%s' at line %d" % (character, lineno), character)
+    error.lineno = lineno
+    raise error
+
+
+def test_scanner():
+    import os
+    import tempfile
+
+    from lexer import get_lexer, lexer_test_case
+    from parser import P2CParser
+
+    with open('program.py.txt') as _input:
+        program = _input.read()
+    test_input = program + """
+        # comment
+        x = 3.5 // 2 and not y or True
+        s = 'ignored' + z
+        while x >= -1: { x -= 1.25 }
+        print("%f done\\n" x % 2)
+        """
+
+    _lexer = get_lexer().lexer
+    _lexer.input(test_input)
+    expected = [(tok.type, tok.value, tok.lineno) for tok in iter(_lexer.token, None)]
+    _lexer.lineno = 1
+
+    for adapter in (P2CTokenAdapter(P2CScanner(test_input.encode())),
+                    P2CArrayAdapter(P2CTokenArrays(test_input.encode()))):
+        result = [(tok.type, tok.value, tok.lineno) for tok in iter(adapter.token, None)]
+        if result != expected:
+            return False
+
+    # the expectations of the lexer test
+    test_input, answers = lexer_test_case()
+    adapter = P2CArrayAdapter(P2CTokenArrays(test_input.encode()))
+    if [(tok.type, tok.value) for tok in iter(adapter.token, None)] != answers:
+        return False
+
+    fd, path = tempfile.mkstemp(suffix='.py.txt')
+    try:
+        with os.fdopen(fd, 'w') as _file:
+            _file.write(program)
+        _parser = P2CParser()
+        parse_tree = _parser.parse_file(path)
+        return parse_tree == _parser.parse(program)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    if not test_scanner():
+        raise Exception("[SCANNER] Scanner test failed")
@@ -0,0 +1,368 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import tempfile
+import time
+
+from ply.lex import LexError
+
+from client import DEFAULT_SOCKET
+from parser import P2CParser, P2CSyntaxError
+from stats import P2CStats
+from unroll import UNROLL_BUDGET, UNROLL_FACTOR
+
+# the C code is sent back in pieces of this many characters
+CHUNK_SIZE = 64 * 1024
+# the longest request line, the source is part of it
+MAX_REQUEST = 64 * 1024 * 1024
+
+# the options a request may give besides source, opt_level and timeout, and their types, see compile_source
+OPTIONS = {'vectorize': bool, 'structured': bool, 'infer_types': bool, 'unroll_factor': int, 'unroll_budget': int,
+           'profile': bool}
+
+# the warm parser of a worker process, see init_worker
+_parser = None
+
+
+class P2CServerError(Exception):
+    pass
+
+
+def init_worker():
+    # the parser tables are loaded once per worker, not once per request
+    global _parser
+    _parser = P2CParser()
+
+
+def compile_source(source, opt_level=0, options=None):
+    # runs in a worker, never raises, a program that does not compile is a diagnostic,
+    # options are the ones of OPTIONS, the same as the ones of parser.py
+    options = options or {}
+    result = {'ok': False, 'c_code': None, 'diagnostics': [], 'timings': {}, 'statistics': {},
+              'vector_report': [], 'profile': None}
+    stats = _parser.instrument(P2CStats()) if options.get('profile') else None
+    try:
+        _parser.parse(source)
+        unroll = options.get('unroll_factor', UNROLL_FACTOR), options.get('unroll_budget', UNROLL_BUDGET)
+        result['c_code'] = _parser.generate_three_address_code(
+            opt_level=opt_level, vectorize=options.get('vectorize', False),
+            structured=options.get('structured', False), infer_types=options.get('infer_types', False),
+            unroll=unroll)
+        result['timings'] = _parser.timings
+        result['statistics'] = _parser.statistics
+        result['vector_report'] = _parser.vector_report
+        result['ok'] = True
+    except (P2CSyntaxError, LexError) as e:
+        result['diagnostics'].append({'severity': 'error', 'message': str(e), 'line': getattr(e, 'lineno', None)})
+    except Exception as e:
+        result['diagnostics'].append({'severity': 'error', 'message': "%s: %s" % (type(e).__name__, e),
+                                      'line': None})
+    finally:
+        if stats is not None:
+            result['profile'] = stats.as_dict()
+            _parser.instrument(None)
+    return result
+
+
+def prepare_socket(path):
+    """
+    Makes the directory of the default socket, readable by this user only,
+    and removes a socket left behind by a server that is gone. Raises
+    P2CServerError when a server still listens on path, when path is not a
+    socket or when the default directory is not private.
+    """
+    directory = os.path.dirname(path)
+    if path == DEFAULT_SOCKET:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise P2CServerError("%s is not a directory only this user can use" % directory)
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode):
+        raise P2CServerError("%s exists and is not a socket" % path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        # nobody listens anymore
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise P2CServerError("A server is already listening on %s" % path)
+
+
+class P2CServer(object):
+    """
+    Compiles programs for clients over a Unix socket or TCP, on a pool of
+    worker processes that each keep a warm parser.
+
+    A request is one line of JSON: {"id": ..., "source": ..., "opt_level": 0,
+    "timeout": seconds} and any of OPTIONS, a request with another key is
+    invalid. The answer is lines of JSON with the same id: any number of
+    {"type": "diagnostic"}, {"type": "output", "data": ...} with the C code in
+    pieces, and last {"type": "done", "ok": ...}.
+
+    The unix socket is only usable by the user that started the server, a
+    server does not start on the socket of another one that is running.
+
+    At most max_pending requests are compiled or waiting for a worker, a
+    connection is not read from while they are, so a client that sends faster
+    than the workers compile is held back. A request that takes longer than
+    its timeout is answered with an error, the worker still finishes it.
+    """
+
+    def __init__(self, workers=None, max_pending=64, timeout=30.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = None
+        self.server = None
+        self.pending = None
+        self.path = None
+        # answered requests by how they ended
+        self.counts = {'ok': 0, 'failed': 0, 'timeout': 0, 'invalid': 0}
+
+    async def start(self, path=None, host=None, port=None):
+        unix = host is None and port is None
+        if unix:
+            prepare_socket(path or DEFAULT_SOCKET)
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=init_worker)
+        self.pending = asyncio.Semaphore(self.max_pending)
+        loop = asyncio.get_running_loop()
+        # the workers are started and warm before the first request comes in
+        await asyncio.gather(*(loop.run_in_executor(self.executor, time.sleep, 0) for _ in range(self.workers)))
+
+        if not unix:
+            self.server = await asyncio.start_server(self.handle, host or 'localhost', port or 0, limit=MAX_REQUEST)
+        else:
+            self.path = path or DEFAULT_SOCKET
+            self.server = await asyncio.start_unix_server(self.handle, self.path, limit=MAX_REQUEST)
+            os.chmod(self.path, 0o600)
+        return self.server
+
+    def address(self):
+        if self.path is not None:
+            return self.path
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def handle(self, reader, writer):
+        # requests of a connection are compiled concurrently, answers are sent as they are done
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                await self.pending.acquire()
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    # longer than MAX_REQUEST or the client went away
+                    self.pending.release()
+                    break
+                if not line:
+                    self.pending.release()
+                    break
+                task = asyncio.ensure_future(self.answer(line, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def answer(self, line, writer, lock):
+        try:
+            messages = await self.compile(line)
+            # the messages of one request are not mixed with the ones of another
+            async with lock:
+                for message in messages:
+                    writer.write(json.dumps(message).encode() + b'\n')
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.pending.release()
+
+    async def compile(self, line):
+        start = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            source = request['source']
+            opt_level = int(request.get('opt_level', 0))
+            timeout = float(request.get('timeout', self.timeout))
+            if type(source) != str or opt_level not in (0, 1, 2):
+                raise ValueError("source must be a string and opt_level 0, 1 or 2")
+            options = dict((name, value) for name, value in request.items()
+                           if name not in ('id', 'source', 'opt_level', 'timeout'))
+            for name, value in options.items():
+                if name not in OPTIONS:
+                    raise ValueError("unknown option %r" % name)
+                if type(value) != OPTIONS[name]:
+                    raise ValueError("%s must be %s" % (name, OPTIONS[name].__name__))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.counts['invalid'] += 1
+            return [{'id': request_id, 'type': 'done', 'ok': False, 'error': "Invalid request: %s" % e}]
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self.executor, compile_source, source, opt_level,
+                                                                 options), timeout)
+        except asyncio.TimeoutError:
+            self.counts['timeout'] += 1
+            return [{'id': request_id, 'type': 'done', 'ok': False,
+                     'error': "Timed out after %.3f s" % timeout, 'seconds': time.perf_counter() - start}]
+
+        messages = [dict(diagnostic, id=request_id, type='diagnostic') for diagnostic in result['diagnostics']]
+        c_code = result['c_code'] or ''
+        for i in range(0, len(c_code), CHUNK_SIZE):
+            messages.append({'id': request_id, 'type': 'output', 'data': c_code[i:i + CHUNK_SIZE]})
+        messages.append({'id': request_id, 'type': 'done', 'ok': result['ok'], 'timings': result['timings'],
+                         'statistics': result['statistics'], 'vector_report': result['vector_report'],
+                         'profile': result['profile'], 'seconds': time.perf_counter() - start})
+        self.counts['ok' if result['ok'] else 'failed'] += 1
+        return messages
+
+
+async def serve(args):
+    server = P2CServer(args.jobs, args.max_pending, args.timeout)
+    await server.start(args.socket, args.host, args.port)
+    print("listening on %s with %d workers" % (server.address(), server.workers), file=sys.stderr)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(signal_number, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+
+
+def test_server():
+    import threading
+
+    from client import P2CClient
+
+    program = "a = 2\nwhile a < 10: { a = a * 3 }\nprint(\"%f\" a)\n"
+    _parser = P2CParser()
+    _parser.parse(program)
+    expected = _parser.generate_three_address_code(opt_level=2)
+
+    loops = "s = 0\nfor i in range(10): { s += i * 2 }\nprint(\"%f\" s)\n"
+    _parser.parse(loops)
+    structured = _parser.generate_three_address_code(opt_level=2, structured=True, infer_types=True, unroll=(2, 8))
+
+    path = os.path.join(tempfile.mkdtemp(), 'p2c.sock')
+    # a socket nobody listens on anymore is replaced
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+    server = P2CServer(workers=1, max_pending=2)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start(path))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+    try:
+        if stat.S_IMODE(os.stat(path).st_mode) != 0o600:
+            return False
+        # a second server does not take the socket of a running one
+        try:
+            asyncio.run(P2CServer(workers=1).start(path))
+            return False
+        except P2CServerError:
+            pass
+
+        with P2CClient(path) as client:
+            out = io.StringIO()
+            result = client.compile(program, 2, fp=out)
+            if not result['ok'] or out.getvalue() != expected:
+                return False
+
+            # the options of parser.py
+            result = client.compile(loops, 2, structured=True, infer_types=True, unroll_factor=2, unroll_budget=8,
+                                    profile=True)
+            if not result['ok'] or result['c_code'] != structured or 'parse' not in result['profile']['timers']:
+                return False
+            result = client.compile(loops, 0, vectorize=True)
+            if not result['ok'] or not result['vector_report'] or result['profile'] is not None:
+                return False
+            for options in ({'unroll': 4}, {'vectorize': 1}, {'unroll_factor': True}):
+                result = client.compile(loops, 2, **options)
+                if result['ok'] or 'Invalid request' not in result['error']:
+                    return False
+
+            # more requests than max_pending on one connection, answered in any order
+            ids = [client.send("a = %d\nprint(\"%%f\" a + 1)\n" % i, 1) for i in range(5)]
+            answers = dict((result['id'], result) for result in (client.receive() for _ in ids))
+            if sorted(answers) != sorted(ids) or not all(answer['ok'] for answer in answers.values()):
+                return False
+
+            result = client.compile("a = 1\nb = = 2\n", fp=io.StringIO())
+            if result['ok'] or result['diagnostics'][0]['line'] != 2:
+                return False
+            result = client.compile("a = 1 $ 2\n", fp=io.StringIO())
+            if result['ok'] or result['diagnostics'][0]['line'] != 1 or "'$'" not in result['diagnostics'][0]['message']:
+                return False
+            result = client.compile(program, 2, timeout=0.0, fp=io.StringIO())
+            if result['ok'] or 'Timed out' not in result['error']:
+                return False
+            result = client.compile(program, 3, fp=io.StringIO())
+            return not result['ok'] and 'Invalid request' in result['error']
+    finally:
+        asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="compile programs for clients, see client.py")
+    arg_parser.add_argument('--socket', help="listen on this unix socket (default: %s)" % DEFAULT_SOCKET)
+    arg_parser.add_argument('--host', help="listen on TCP at this host instead")
+    arg_parser.add_argument('--port', type=int, help="listen on TCP at this port instead")
+    arg_parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: cpu count)")
+    arg_parser.add_argument('--max-pending', type=int, default=64,
+                            help="requests compiled or waiting at once, the others wait to be read "
+                                 "(default: %(default)s)")
+    arg_parser.add_argument('--timeout', type=float, default=30.0,
+                            help="seconds a request may take unless it asks for another (default: %(default)s)")
+    arg_parser.add_argument('--test', action='store_true', help="only run the test of the server")
+    args = arg_parser.parse_args(argv)
+
+    if args.test:
+        if not test_server():
+            raise Exception("[SERVER] Compile server test failed")
+        return 0
+    try:
+        asyncio.run(serve(args))
+    except P2CServerError as e:
+        print(e, file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,547 @@
+import math
+
+from cfg import dominators, dominator_tree, dominance_frontiers, reverse_postorder
+from fold import evaluate, to_float, binary_ops
+from tac import ASSIGN_OPS, NEG, POS, GOTO, IF, IFNOT, PRINT, IF_RELOPS, CONDITIONAL_JUMPS, JUMPS, P2CProgram, Quad
+
+# lattice of the constant propagation, every other lattice value is a constant
+TOP = 'top'  # no assignment seen yet
+BOTTOM = 'bottom'  # not a constant
+
+# operations where the order of the operands does not change the value
+COMMUTATIVE_OPS = ('+', '*', '==', '!=', '&&', '||')
+
+
+def is_constant(value):
+    return type(value) in (int, float)
+
+
+def same(a, b):
+    # constants are compared including the sign of zero, -0.0 prints differently than 0.0
+    if is_constant(a) and is_constant(b):
+        return a == b and math.copysign(1, a) == math.copysign(1, b)
+    return a == b
+
+
+def store(value):
+    # the value a float variable holds after assigning value to it, None when it is not finite
+    try:
+        value = to_float(value)
+    except OverflowError:
+        return None
+    return value if math.isfinite(value) else None
+
+
+class Value(object):
+    __slots__ = ('id', 'name', 'block', 'index', 'args')
+
+    def __init__(self, id, name, block, index):
+        self.id = id
+        self.name = name
+        self.block = block
+        # the quad that assigns the value, None for a phi and for the value a name has before any assignment
+        self.index = index
+        # phi operands, one per predecessor of the block
+        self.args = None
+
+
+class P2CSSA(object):
+    """
+    SSA form of a lowered program.
+
+    The program itself is not renamed: every assignment, every phi and the
+    initial value of every name become a Value, and the quads are annotated with
+    the values their operands read. The analyses run over the values and
+    rewrite() applies their results to the original names, so no copies have
+    to be inserted to leave SSA form again.
+    """
+
+    def __init__(self, program):
+        self.program = program
+        self.blocks = program.basic_blocks()
+        self.idom = dominators(self.blocks)
+        self.tree = dominator_tree(self.blocks, self.idom)
+
+        self.values = []
+        self.undefined = {}
+        # block index -> phi values
+        self.phis = [[] for _ in self.blocks]
+        # quad index -> value it assigns
+        self.defs = {}
+        # quad index -> values read by src1, src2 and by dst of a compound assignment
+        self.operands = {}
+
+        # results of propagate_constants() and number_values()
+        self.lattice = None
+        self.executable = None
+        self.executable_edges = None
+        self.numbers = None
+
+        self.build()
+
+    def new_value(self, name, block, index):
+        value = Value(len(self.values), name, block, index)
+        self.values.append(value)
+        return value
+
+    def build(self):
+        quads = self.program.quads
+        blocks = self.blocks
+        if not blocks:
+            return
+
+        # blocks that assign every name
+        def_blocks = {}
+        for block in blocks:
+            if self.idom[block.index] is None:
+                continue
+            for quad in quads[block.start:block.end]:
+                if quad.dst is not None:
+                    def_blocks.setdefault(quad.dst, set()).add(block.index)
+
+        # phis are placed at the iterated dominance frontier of the assignments
+        frontiers = dominance_frontiers(blocks, self.idom)
+        for name, assigned in def_blocks.items():
+            placed = set()
+            work = sorted(assigned)
+            while work:
+                for frontier in sorted(frontiers[work.pop()]):
+                    if frontier in placed:
+                        continue
+                    placed.add(frontier)
+                    phi = self.new_value(name, frontier, None)
+                    phi.args = [None] * len(blocks[frontier].preds)
+                    self.phis[frontier].append(phi)
+                    if frontier not in assigned:
+                        work.append(frontier)
+
+        # rename along the dominator tree, stacks hold the current value of every name
+        stacks = {}
+
+        def current(name):
+            if name not in stacks:
+                value = self.new_value(name, None, None)
+                self.undefined[name] = value
+                stacks[name] = [value]
+            return stacks[name][-1]
+
+        work = [(0, None)]
+        while work:
+            b, pushed = work.pop()
+            if pushed is not None:
+                for name in pushed:
+                    stacks[name].pop()
+                continue
+
+            pushed = []
+            block = blocks[b]
+            for phi in self.phis[b]:
+                current(phi.name)
+                stacks[phi.name].append(phi)
+                pushed.append(phi.name)
+
+            for i in range(block.start, block.end):
+                quad = quads[i]
+                self.operands[i] = (
+                    current(quad.src1) if type(quad.src1) == str and quad.op != PRINT else None,
+                    current(quad.src2) if type(quad.src2) == str else None,
+                    current(quad.dst) if quad.op in ASSIGN_OPS and quad.op != '=' else None,
+                )
+                if quad.dst is not None:
+                    current(quad.dst)
+                    value = self.new_value(quad.dst, b, i)
+                    self.defs[i] = value
+                    stacks[quad.dst].append(value)
+                    pushed.append(quad.dst)
+
+            for succ in block.succs:
+                j = succ.preds.index(block)
+                for phi in self.phis[succ.index]:
+                    phi.args[j] = current(phi.name)
+
+            work.append((b, pushed))
+            for child in reversed(self.tree[b]):
+                work.append((child, None))
+
+    def operand_lattice(self, operand, value):
+        if value is None:
+            return operand
+        return self.lattice[value.id]
+
+    def propagate_constants(self):
+        """
+        Sparse conditional constant propagation (Wegman and Zadeck): finds the
+        values that are constant and the blocks that can execute at all.
+        """
+        quads = self.program.quads
+        blocks = self.blocks
+        self.lattice = lattice = [TOP] * len(self.values)
+        self.executable = executable = set()
+        self.executable_edges = edges = set()
+        if not blocks:
+            return
+
+        for value in self.undefined.values():
+            lattice[value.id] = BOTTOM
+
+        block_of = [0] * len(quads)
+        for block in blocks:
+            for i in range(block.start, block.end):
+                block_of[i] = block.index
+        labels = self.program.label_table()
+
+        uses = [[] for _ in self.values]
+        for i, operands in self.operands.items():
+            for value in operands:
+                if value is not None:
+                    uses[value.id].append(i)
+        for phis in self.phis:
+            for phi in phis:
+                for value in phi.args:
+                    if value is not None:
+                        uses[value.id].append(phi)
+
+        flow = [(None, 0)]
+        changed = []
+
+        def update(value, new):
+            if not same(lattice[value.id], new):
+                lattice[value.id] = new
+                changed.append(value)
+
+        def visit_phi(phi):
+            new = BOTTOM if phi.block == 0 and (None, 0) in edges else TOP
+            for pred, value in zip(blocks[phi.block].preds, phi.args):
+                if (pred.index, phi.block) in edges:
+                    new = meet(new, lattice[value.id] if value is not None else BOTTOM)
+            update(phi, new)
+
+        def visit_quad(i):
+            quad = quads[i]
+            b = block_of[i]
+            if quad.op == GOTO:
+                flow.append((b, block_of[labels[quad.label]]))
+            elif quad.op in CONDITIONAL_JUMPS:
+                taken = self.jump_taken(i)
+                if taken is TOP:
+                    return
+                if taken is not False:
+                    flow.append((b, block_of[labels[quad.label]]))
+                if taken is not True and b + 1 < len(blocks):
+                    flow.append((b, b + 1))
+            elif i in self.defs:
+                update(self.defs[i], self.evaluate_quad(i))
+
+        while flow or changed:
+            while flow:
+                edge = flow.pop()
+                if edge in edges:
+                    continue
+                edges.add(edge)
+                b = edge[1]
+                for phi in self.phis[b]:
+                    visit_phi(phi)
+                if b not in executable:
+                    executable.add(b)
+                    for i in range(blocks[b].start, blocks[b].end):
+                        visit_quad(i)
+                    if quads[blocks[b].end - 1].op not in JUMPS and b + 1 < len(blocks):
+                        flow.append((b, b + 1))
+            while changed:
+                for use in uses[changed.pop().id]:
+                    if type(use) == int:
+                        if block_of[use] in executable:
+                            visit_quad(use)
+                    elif use.block in executable:
+                        visit_phi(use)
+
+    def jump_taken(self, i):
+        # True or False for a conditional jump with a constant condition, BOTTOM when both ways are possible
+        quad = self.program.quads[i]
+        src1, src2, _ = self.operands[i]
+        a = self.operand_lattice(quad.src1, src1)
+        if quad.op in (IF, IFNOT):
+            if not is_constant(a):
+                return a
+            return bool(a) == (quad.op == IF)
+
+        b = self.operand_lattice(quad.src2, src2)
+        if a == BOTTOM or b == BOTTOM:
+            return BOTTOM
+        if a == TOP or b == TOP:
+            return TOP
+        return binary_ops[IF_RELOPS[quad.op]](a, b)
+
+    def evaluate_quad(self, i):
+        quad = self.program.quads[i]
+        src1, src2, dst = self.operands[i]
+        op = quad.op
+
+        args = [self.operand_lattice(quad.src1, src1)]
+        if op in ASSIGN_OPS and op != '=':
+            args.append(self.lattice[dst.id])
+        elif op not in ASSIGN_OPS and op not in (NEG, POS):
+            args.append(self.operand_lattice(quad.src2, src2))
+
+        if BOTTOM in args:
+            return BOTTOM
+        if TOP in args:
+            return TOP
+
+        if op == '=' or op == POS:
+            value = store(args[0])
+        elif op == NEG:
+            value = store(-args[0])
+        elif op in ASSIGN_OPS:
+            value = evaluate(op[0], args[1], args[0])
+        else:
+            value = evaluate(op, args[0], args[1])
+        return BOTTOM if value is None else value
+
+    def number_values(self):
+        """
+        Global value numbering: values computed by the same operation from
+        values with the same numbers get the same number, constants are
+        numbered by their value and phis merging the same numbers in one block
+        share a number.
+        """
+        quads = self.program.quads
+        table = {}
+        self.numbers = numbers = [None] * len(self.values)
+
+        def number(key):
+            return table.setdefault(key, len(table))
+
+        def operand_number(operand, value):
+            if value is None:
+                return number(('c', repr(float(operand))))
+            if numbers[value.id] is None:
+                numbers[value.id] = number(('v', value.id))
+            return numbers[value.id]
+
+        for block in reverse_postorder(self.blocks):
+            if block.index not in self.executable:
+                continue
+
+            for phi in self.phis[block.index]:
+                if is_constant(self.lattice[phi.id]):
+                    numbers[phi.id] = number(('c', repr(float(self.lattice[phi.id]))))
+                    continue
+                args = []
+                for pred, value in zip(block.preds, phi.args):
+                    if (pred.index, block.index) in self.executable_edges:
+                        args.append(numbers[value.id] if value is not None else None)
+                if block.index == 0 or not args or None in args:
+                    # the entry merges with the values names have before the program,
+                    # otherwise a value that is only numbered after this block, around a loop
+                    numbers[phi.id] = number(('v', phi.id))
+                elif len(set(args)) == 1:
+                    numbers[phi.id] = args[0]
+                else:
+                    numbers[phi.id] = number(('phi', block.index, tuple(args)))
+
+            for i in range(block.start, block.end):
+                if i not in self.defs:
+                    continue
+                value = self.defs[i]
+                if is_constant(self.lattice[value.id]):
+                    numbers[value.id] = number(('c', repr(float(self.lattice[value.id]))))
+                    continue
+
+                quad = quads[i]
+                src1, src2, dst = self.operands[i]
+                op = quad.op
+                a = operand_number(quad.src1, src1)
+                if op in ('=', POS) and src1 is not None:
+                    numbers[value.id] = a
+                    continue
+                if op in ('=', POS, NEG):
+                    key = (op, a)
+                elif op in ASSIGN_OPS:
+                    key = (op[0], operand_number(quad.dst, dst), a)
+                else:
+                    key = (op, a, operand_number(quad.src2, src2))
+                if key[0] in COMMUTATIVE_OPS:
+                    key = (key[0],) + tuple(sorted(key[1:]))
+                numbers[value.id] = number(key)
+
+    def rewrite(self):
+        """
+        Applies the constant propagation and value numbering results: operands
+        holding a constant are replaced by it, an operand is replaced by the
+        earliest name that still holds the same value and a computation whose
+        value is already held by a name becomes a copy of it. Blocks that never
+        execute are dropped and jumps with a constant condition are resolved.
+        The operands of a division that is not evaluated and factors of -1 keep
+        their names, see replace_operands.
+        """
+        quads = self.program.quads
+        blocks = self.blocks
+        code = [[] for _ in blocks]
+        if not blocks:
+            return P2CProgram()
+
+        stacks = dict((name, [value]) for name, value in self.undefined.items())
+        # value number -> values that hold it, in dominator tree order
+        available = {}
+
+        def holder(value):
+            # a name that holds the value at this point
+            for other in available.get(self.numbers[value.id], ()):
+                if stacks[other.name][-1] is other:
+                    return other.name
+            return None
+
+        def replace(operand, value):
+            if value is None:
+                return operand
+            if is_constant(self.lattice[value.id]):
+                return self.lattice[value.id]
+            return holder(value) or operand
+
+        def keep(operand, value):
+            # the name of the operand even when it holds a constant
+            return operand if value is None else holder(value) or operand
+
+        def replace_operands(quad, src1, src2):
+            # like fold.P2CFolder, the constants gcc computes with differently when they are literals keep
+            # their names: a division it would do at compile time, where 0.0 / 0.0 is a nan of the other sign,
+            # and a factor or divisor of -1, which it makes a negation that flips the sign of a nan
+            a, b = replace(quad.src1, src1), replace(quad.src2, src2)
+            op = quad.op
+            if op == '/' and is_constant(a) and is_constant(b):
+                return keep(quad.src1, src1), keep(quad.src2, src2)
+            if op in ('*', '*=', '/=') and is_constant(a) and a == -1:
+                a = keep(quad.src1, src1)
+            if op in ('*', '/') and is_constant(b) and b == -1:
+                b = keep(quad.src2, src2)
+            return a, b
+
+        def define(value, pushed, numbered):
+            stacks[value.name].append(value)
+            pushed.append(value.name)
+            if self.numbers[value.id] is not None:
+                available.setdefault(self.numbers[value.id], []).append(value)
+                numbered.append(self.numbers[value.id])
+
+        work = [(0, None)]
+        while work:
+            b, pushed = work.pop()
+            if pushed is not None:
+                for name in pushed[0]:
+                    stacks[name].pop()
+                for _number in pushed[1]:
+                    available[_number].pop()
+                continue
+            if b not in self.executable:
+                continue
+
+            pushed = ([], [])
+            for phi in self.phis[b]:
+                define(phi, *pushed)
+
+            for i in range(blocks[b].start, blocks[b].end):
+                quad = quads[i]
+                src1, src2, dst = self.operands[i]
+
+                if quad.op in CONDITIONAL_JUMPS:
+                    taken = self.jump_taken(i)
+                    if taken is True:
+                        code[b].append(Quad(GOTO, label=quad.label))
+                    elif taken is not False:
+                        code[b].append(Quad(quad.op, src1=replace(quad.src1, src1),
+                                            src2=replace(quad.src2, src2), label=quad.label))
+                    continue
+
+                if i not in self.defs:
+                    _quad = quad.copy()
+                    if quad.op == PRINT:
+                        _quad.src2 = replace(quad.src2, src2)
+                    code[b].append(_quad)
+                    continue
+
+                value = self.defs[i]
+                if is_constant(self.lattice[value.id]):
+                    code[b].append(Quad('=', quad.dst, self.lattice[value.id]))
+                else:
+                    name = holder(value)
+                    if name is None:
+                        code[b].append(Quad(quad.op, quad.dst, *replace_operands(quad, src1, src2)))
+                    elif name != quad.dst:
+                        code[b].append(Quad('=', quad.dst, name))
+                define(value, *pushed)
+
+            work.append((b, pushed))
+            for child in reversed(self.tree[b]):
+                work.append((child, None))
+
+        return P2CProgram([quad for b in range(len(blocks)) if b in self.executable for quad in code[b]])
+
+
+def meet(a, b):
+    if a == TOP:
+        return b
+    if b == TOP:
+        return a
+    if a == BOTTOM or b == BOTTOM or not same(a, b):
+        return BOTTOM
+    return a
+
+
+def test_ssa_optimizations():
+    import os
+    import shutil
+    import subprocess
+    import tempfile
+    from parser import P2CParser
+    from vm import P2CVM
+
+    test_input = """
+        a = 2
+        if x > 1: { b = a * 3 } else: { b = 6 }
+        y = x + b
+        if y: { z = x + b } else: { z = x + 6 }
+        print("%f" z)
+        """
+    test_output = """
+        #include <stdio.h>
+        int main () {
+        float x;
+        float t1 = x + 6.0;
+        printf("%f", t1);
+        return 0;
+        }
+        """
+
+    _parser = P2CParser()
+    _parser.parse(test_input)
+    result = _parser.generate_three_address_code(opt_level=2)
+    if result.split() != test_output.split():
+        return False
+
+    # the constants of a division that is not evaluated and a factor of -1 are not put into the C code,
+    # gcc computes with them differently than with variables, and P2CVM runs what gcc compiled
+    cc = shutil.which(os.environ.get('CC', 'cc'))
+    if cc is None:
+        return True
+    programs = ["c = 0\ne = 0\nd = c / e * (6 - 7)\nprint(\"%f\\n\" d)\n",
+                "x = 0\nx = x / x\nk = 2\ny = x * -1\nz = x / (k - 3)\nx *= k - 3\n"
+                "print(\"%f \" y)\nprint(\"%f \" z)\nprint(\"%f\\n\" x)\n"]
+    with tempfile.TemporaryDirectory() as directory:
+        for program in programs:
+            _parser.parse(program)
+            outputs = []
+            for opt_level in (0, 2):
+                source, binary = os.path.join(directory, '%d.c' % opt_level), os.path.join(directory, '%d' % opt_level)
+                with open(source, 'w') as f:
+                    f.write(_parser.generate_three_address_code(opt_level=opt_level))
+                subprocess.run([cc, '-w', '-o', binary, source], check=True)
+                outputs.append(subprocess.run([binary], stdout=subprocess.PIPE).stdout)
+            if outputs[0] != outputs[1] or P2CVM(_parser.context.three_address_code).run().encode() != outputs[1]:
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    if not test_ssa_optimizations():
+        raise Exception("[SSA] SSA optimizations test failed")
@@ -0,0 +1,127 @@
+import contextlib
+import json
+import time
+
+
+class P2CStats(object):
+    """
+    What the compiles of an instrumented P2CParser did, see
+    P2CParser.instrument: seconds per phase, counters and reductions per
+    grammar rule, summed over every compile since it was made or reset.
+
+    The phases are lex, parse (the parser without the time spent getting
+    tokens), lower, one per optimization pass (opt.fold, opt.ssa, ...) and
+    emit. callback, if given, is called with the name and the seconds of every
+    phase as it ends.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        # 'expr -> expr PLUS expr' -> times it was reduced
+        self.reductions = {}
+
+    def add_time(self, phase, seconds):
+        self.timers[phase] = self.timers.get(phase, 0.0) + seconds
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        return {
+            'timers': dict(self.timers),
+            'counters': dict(self.counters),
+            'reductions': dict(sorted(self.reductions.items(), key=lambda item: -item[1])),
+        }
+
+    def to_json(self, fp=None):
+        # into fp if given, otherwise returned as a string
+        if fp is None:
+            return json.dumps(self.as_dict(), indent=2)
+        json.dump(self.as_dict(), fp, indent=2)
+
+
+class P2CTimedLexer(object):
+    """
+    Hands the tokens of a lexer to the parser and keeps the time spent getting
+    them and their count, so they can be told apart from the parser's.
+    """
+
+    def __init__(self, lexer):
+        self.lexer = lexer
+        self.seconds = 0.0
+        self.tokens = 0
+
+    def token(self):
+        start = time.perf_counter()
+        tok = self.lexer.token()
+        self.seconds += time.perf_counter() - start
+        if tok is not None:
+            self.tokens += 1
+        return tok
+
+
+class P2CCountingLines(object):
+    # the lines of the C code with their newlines, the characters that went by are counted
+    def __init__(self, lines):
+        self.lines = lines
+        self.count = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            line += '\n'
+            self.count += len(line)
+            yield line
+
+
+def test_stats():
+    from parser import P2CParser
+
+    test_input = """
+        a = 1 + 2 * b
+        while a < 10: { a += 1 }
+        if a > 5: { print("big %f" a) } else: { print("small") }
+        """
+    phases = []
+    _stats = P2CStats(lambda phase, seconds: phases.append(phase))
+    _parser = P2CParser()
+    _parser.instrument(_stats)
+    _parser.parse(test_input)
+    code = _parser.generate_three_address_code(opt_level=1)
+
+    counters = _stats.counters
+    if counters['tokens'] != 37 or counters['statements'] != 3 or counters['bytes'] != len(code):
+        return False
+    if counters['temps'] != _parser.t_number or counters['labels'] != _parser.l_number:
+        return False
+    if _stats.reductions['expr -> expr TIMES expr'] != 1 or _stats.reductions['expr -> NUMBER'] != 5:
+        return False
+    # the tokens are made into arrays and then handed to the parser, both are lexing
+    if phases[:4] != ['lex', 'lex', 'parse', 'opt.fold'] or 'lower' not in phases or phases[-1] != 'emit':
+        return False
+    if json.loads(_stats.to_json())['counters'] != counters:
+        return False
+
+    # without stats nothing is counted and the code is the same
+    _parser.instrument(None)
+    _parser.parse(test_input)
+    return _parser.generate_three_address_code(opt_level=1) == code and _stats.counters == counters
+
+
+if __name__ == '__main__':
+    if not test_stats():
+        raise Exception("[STATS] Compiler statistics test failed")
@@ -0,0 +1,369 @@
+import math
+from fractions import Fraction
+
+from cfg import dominators, liveness
+from infer import FLOAT, SWAPPED, P2CTypeInference, binary, constant
+from loops import natural_loops, preheader
+from tac import Quad, IF_RELOPS, fresh_names
+
+RELOPS = ('<', '<=', '>', '>=', '==', '!=')
+
+
+def reduce_strength(program, vectorize=False):
+    """
+    Replaces the multiplications of the counters of loops by additions that
+    run along with the counters, and the divisions by a power of two by a
+    multiplication with its reciprocal, which gives the same float. A
+    counter that is only compared after that is dropped, the comparisons use
+    one of the running products instead.
+
+    A counter is a name the loop changes once, by += or -= of a number, as
+    in the loops of for and of most while statements. Its products are only
+    added up when P2CTypeInference finds that all of them are whole numbers
+    a float holds exactly, and never -0, so the sums are the same floats as
+    the products. With vectorize the loops P2CVectorizer can run at once are
+    left as they are. Returns the number of instructions reduced.
+    """
+    reduced = divide_by_multiplying(program)
+    while True:
+        count = reduce_loops(program, vectorize)
+        if not count:
+            return reduced
+        reduced += count
+
+
+def is_number(operand):
+    return type(operand) in (int, float) and math.isfinite(operand)
+
+
+def reciprocal(divisor):
+    # 1 / divisor when it is a float, that is when divisor is a power of two, None otherwise
+    if not is_number(divisor) or divisor == 0 or math.frexp(abs(divisor))[0] != 0.5:
+        return None
+    try:
+        return 1.0 / divisor
+    except OverflowError:
+        return None
+
+
+def divide_by_multiplying(program):
+    reduced = 0
+    for quad in program.quads:
+        if quad.op == '/' and type(quad.src1) == str and reciprocal(quad.src2) is not None:
+            quad.op, quad.src2 = '*', reciprocal(quad.src2)
+        elif quad.op == '/=' and reciprocal(quad.src1) is not None:
+            quad.op, quad.src1 = '*=', reciprocal(quad.src1)
+        else:
+            continue
+        reduced += 1
+    return reduced
+
+
+def reduce_loops(program, vectorize):
+    # one round over the loops, like loops.hoist_from_loops a loop is skipped when a loop it
+    # contains or the code in front of it changed in this round
+    quads = program.quads
+    blocks = program.basic_blocks()
+    idom = dominators(blocks)
+    loops = natural_loops(blocks, idom)
+    if not loops:
+        return 0
+    inference = P2CTypeInference(program)
+    inference.run()
+    live_in, live_out = liveness(program, blocks)
+    labels = program.label_table()
+    kept = set()
+    if vectorize:
+        from vector import P2CVectorizer
+
+        for loop in P2CVectorizer(program).vectorized():
+            kept.update(range(loop.entry, loop.exit + 1))
+
+    variables = InductionVariables(quads, blocks, live_in, live_out, inference.written, fresh_names(quads))
+    changed = set()
+    for header, body in sorted(loops.items(), key=lambda loop: len(loop[1])):
+        place = preheader(program, blocks, labels, header, body)
+        if place is None or body & changed or place[0].index in changed or blocks[header].start in kept:
+            continue
+        if variables.reduce(body, place):
+            changed |= body
+            changed.add(place[0].index)
+
+    if not variables.reduced:
+        return 0
+    _quads = []
+    for i in range(len(quads) + 1):
+        _quads.extend(variables.inserted.get(i, ()))
+        if i < len(quads):
+            quad = variables.replaced.get(i, quads[i])
+            if quad is not None:
+                _quads.append(quad)
+    program.quads = _quads
+    return variables.reduced
+
+
+class InductionVariables(object):
+    """
+    Collects the changes to the loops of a program, quads are only changed
+    in replaced (quad index -> new quad, None to drop it) and inserted (quad
+    index -> the quads to put in front of it).
+
+    written are the values of the names, see P2CTypeInference.written.
+    """
+
+    def __init__(self, quads, blocks, live_in, live_out, written, names):
+        self.quads = quads
+        self.blocks = blocks
+        self.live_in = live_in
+        self.live_out = live_out
+        self.written = written
+        self.names = names
+        self.replaced = {}
+        self.inserted = {}
+        self.reduced = 0
+
+    def whole(self, operand):
+        # the range of a name or a literal, FLOAT when it is not only whole numbers
+        if type(operand) == str:
+            value = self.written.get(operand)
+            return FLOAT if value is None else value
+        return constant(operand)
+
+    def counters(self, inside, defs):
+        # name -> (quad index, step) of the names the loop changes once by a number
+        counters = {}
+        for i in inside:
+            quad = self.quads[i]
+            if quad.op in ('+=', '-=') and defs[quad.dst] == 1 and is_number(quad.src1) and quad.src1 != 0 \
+                    and self.whole(quad.src1) != FLOAT and self.whole(quad.dst) != FLOAT:
+                counters[quad.dst] = i, quad.src1 if quad.op == '+=' else -quad.src1
+        return counters
+
+    def product(self, quad, counters, defs):
+        # (counter, factor) when quad multiplies a counter by a number or a name the loop does not change
+        if quad.op != '*' or defs.get(quad.dst) != 1:
+            return None
+        for counter, factor in ((quad.src1, quad.src2), (quad.src2, quad.src1)):
+            if counter not in counters or counter == quad.dst or factor == counter:
+                continue
+            if type(factor) == str and factor in defs or type(factor) != str and not is_number(factor):
+                continue
+            step = counters[counter][1]
+            if binary('*', self.whole(counter), self.whole(factor)) == FLOAT or \
+                    binary('*', self.whole(step), self.whole(factor)) == FLOAT:
+                continue
+            return counter, factor
+        return None
+
+    def reduce(self, body, place):
+        # reduces the loop of the blocks in body, place is where code runs once before it, see loops.preheader
+        quads = self.quads
+        blocks = self.blocks
+        inside = [i for b in sorted(body) for i in range(blocks[b].start, blocks[b].end)]
+        defs = {}
+        for i in inside:
+            if quads[i].dst is not None:
+                defs[quads[i].dst] = defs.get(quads[i].dst, 0) + 1
+        counters = self.counters(inside, defs)
+        if not counters:
+            return False
+
+        # (counter, factor) -> the name of the running product
+        running = {}
+        before = []
+        for b in sorted(body):
+            for i in range(blocks[b].start, blocks[b].end):
+                quad = quads[i]
+                found = self.product(quad, counters, defs)
+                if found is None:
+                    continue
+                counter, factor = found
+                if found not in running:
+                    name = running[found] = next(self.names)
+                    step = counters[counter][1]
+                    start = self.start(counter, place)
+                    if start is not None and type(factor) != str:
+                        before.append(Quad('=', name, float(start * factor)))
+                    else:
+                        before.append(Quad('*', name, quad.src1, quad.src2))
+                    if type(factor) == str:
+                        increment = next(self.names)
+                        before.append(Quad('*', increment, factor, step))
+                    else:
+                        increment = step * factor
+                    update = Quad('+=', name, increment)
+                    if type(increment) != str and increment < 0:
+                        update = Quad('-=', name, -increment)
+                    self.inserted.setdefault(counters[counter][0], []).append(update)
+                if not self.forward(blocks[b], i, running[found], counters[counter][0]):
+                    self.replaced[i] = Quad('=', quad.dst, running[found])
+                self.reduced += 1
+        if not running:
+            return False
+
+        for counter in counters:
+            self.replace_counter(counter, counters[counter][0], running, inside, body, before)
+        self.inserted.setdefault(place[1], []).extend(before)
+        return True
+
+    def start(self, counter, place):
+        # the number the counter is set to in front of the loop, None when it is not known
+        pred, end = place
+        for quad in reversed(self.quads[pred.start:end]):
+            if quad.dst == counter:
+                return quad.src1 if quad.op == '=' and is_number(quad.src1) else None
+        return None
+
+    def forward(self, block, index, name, increment):
+        """
+        Reads name instead of the product quads[index] writes where the
+        product is read, and drops the product, when it is only read further
+        down its block before the running product changes.
+        """
+        product = self.quads[index].dst
+        reads = []
+        for i in range(index + 1, block.end):
+            quad = self.replaced.get(i, self.quads[i])
+            if quad is None:
+                continue
+            if product in quad.uses():
+                if i >= increment > index or quad.dst == product:
+                    return False
+                reads.append(i)
+            if quad.dst == product:
+                break
+        else:
+            if product in self.live_out[block.index]:
+                return False
+        for i in reads:
+            quad = self.replaced.get(i, self.quads[i]).copy()
+            quad.src1 = name if quad.src1 == product else quad.src1
+            quad.src2 = name if quad.src2 == product else quad.src2
+            self.replaced[i] = quad
+        self.replaced[index] = None
+        return True
+
+    def replace_counter(self, counter, increment, running, inside, body, before):
+        """
+        Drops counter when it is only compared in the loop and not used after
+        it, the comparisons compare one of its products instead, with the
+        bound multiplied by the same number in front of the loop.
+        """
+        quads = self.quads
+        factors = [factor for _counter, factor in running if _counter == counter and type(factor) != str and factor != 0]
+        if not factors:
+            return
+        factor = max(factors, key=abs)
+        name = running[counter, factor]
+        exits = [succ.index for b in body for succ in self.blocks[b].succs if succ.index not in body]
+        if any(counter in self.live_in[b] for b in exits):
+            return
+        compared = {}
+        for i in inside:
+            quad = self.replaced.get(i, quads[i])
+            if i == increment or quad is None or counter not in quad.uses():
+                continue
+            relop = quad.op if quad.op in RELOPS else IF_RELOPS.get(quad.op)
+            bound = quad.src2 if quad.src1 == counter else quad.src1
+            if relop is None or bound == counter:
+                return
+            if type(bound) == str:
+                if binary('*', self.whole(bound), self.whole(factor)) == FLOAT or \
+                        any(quads[j].dst == bound for j in inside):
+                    return
+            elif not is_number(bound) or Fraction(bound) * Fraction(factor) != Fraction(float(bound * factor)):
+                return
+            compared[i] = bound
+
+        # both sides multiplied by a negative number compare the other way around
+        for i, bound in compared.items():
+            quad = self.replaced.get(i, quads[i])
+            if type(bound) == str:
+                scaled = next(self.names)
+                before.append(Quad('*', scaled, bound, factor))
+            else:
+                scaled = float(bound * factor)
+            src1, src2 = (name, scaled) if quad.src1 == counter else (scaled, name)
+            op = quad.op
+            if factor < 0:
+                relop = SWAPPED[op if op in RELOPS else IF_RELOPS[op]]
+                op = relop if op in RELOPS else 'if' + relop
+            self.replaced[i] = Quad(op, quad.dst, src1, src2, quad.label)
+        self.replaced[increment] = None
+        self.reduced += 1
+
+
+def test_strength_reduction():
+    from parser import P2CParser
+
+    test_input = """
+        s = 0
+        for i in range(10): {
+            a = i * 4 + base
+            s += a / 4
+            print("%f" i * 4)
+        }
+        j = 20
+        while j > 0: {
+            print("%f" j * 3)
+            j -= 2
+        }
+        for k in range(8): { print("%f" k * 0.1) }
+        print("%f" s + j)
+        """
+    test_output = """
+        #include <stdio.h>
+        int main () {
+        float s = 0.0;
+        float t1 = 0.0;
+        goto l2;
+        l1:;
+        float base;
+        float t2 = t1 + base;
+        t2 = t2 * 0.25;
+        s += t2;
+        printf("%f", t1);
+        t1 += 4.0;
+        l2:;
+        t2 = t1 >= 40.0;
+        if (!t2) goto l1;
+        float j = 20.0;
+        t1 = 60.0;
+        goto l4;
+        l3:;
+        printf("%f", t1);
+        t1 -= 6.0;
+        j -= 2.0;
+        l4:;
+        t2 = j > 0.0;
+        if (t2) goto l3;
+        float k = 0.0;
+        goto l6;
+        l5:;
+        t1 = k * 0.1;
+        printf("%f", t1);
+        k += 1;
+        l6:;
+        t1 = k >= 8.0;
+        if (!t1) goto l5;
+        t1 = s + j;
+        printf("%f", t1);
+        return 0;
+        }
+        """
+
+    _parser = P2CParser()
+    _parser.parse(test_input)
+    # without unrolling the loops
+    if _parser.generate_three_address_code(opt_level=2, unroll=(1, 0)).split() != test_output.split():
+        return False
+    # the loops the vectorizer runs at once keep their counter
+    _parser = P2CParser()
+    _parser.parse("for k in range(8): { print(\"%f\" k * 2) }")
+    return 'k * 2.0' in _parser.generate_three_address_code(opt_level=2, vectorize=True) and \
+        'k * 2.0' not in _parser.generate_three_address_code(opt_level=2, unroll=(1, 0))
+
+
+if __name__ == '__main__':
+    if not test_strength_reduction():
+        raise Exception("[STRENGTH] Strength reduction test failed")
@@ -0,0 +1,466 @@
+import heapq
+
+from cfg import dominators, reverse_postorder
+from loops import dominates, natural_loops
+from tac import BasicBlock, LABEL, GOTO, IF, IFNOT, IF_RELOPS, CONDITIONAL_JUMPS, JUMPS
+
+
+class P2CStructureError(Exception):
+    pass
+
+
+class Loop(object):
+    __slots__ = ('header', 'body', 'follow', 'parent', 'latch', 'step')
+
+    def __init__(self, header, body):
+        self.header = header
+        self.body = body
+        # the block the loop exits to, None when it does not exit
+        self.follow = None
+        self.parent = None
+        # with a step the loop is a for loop: the block jumping back to the header ends with it
+        self.latch = None
+        self.step = None
+
+
+class P2CStructurer(object):
+    """
+    Rebuilds the loops and branches of a lowered program as C while, for and
+    if statements with break and continue instead of labels and gotos, the C
+    compiler sees the loops as loops.
+
+    The natural loops of the control flow become while loops, or for loops
+    when the block jumping back ends with the step of the counter the header
+    compares. A branch becomes an if whose arms go on to the block where they
+    join, see join, a jump back to the header or out of the loop is a
+    continue or a break. Control flow without this form, a loop entered in
+    the middle or a block that would be printed in two places, raises
+    P2CStructureError.
+    """
+
+    def __init__(self, program, emitter):
+        self.program = program
+        self.emitter = emitter
+        self.quads = quads = program.quads
+        self.labels = labels = program.label_table()
+        self.lowered = blocks = program.basic_blocks()
+        self.blocks_at = dict((block.start, block.index) for block in blocks)
+        # the end of the program, the last block falls through to it
+        self.end = len(blocks)
+
+        # jumps go past the blocks without instructions, the follow of a loop is where its breaks end up
+        self.fall = []
+        self.jump = []
+        self.blocks = []
+        for block in blocks:
+            last = quads[block.end - 1]
+            self.fall.append(None if last.op == GOTO else self.skip(block.index + 1))
+            self.jump.append(self.skip(self.blocks_at[labels[last.label]]) if last.op in JUMPS else None)
+            self.blocks.append(BasicBlock(block.index, block.start, block.end))
+        self.succs = []
+        for block in self.blocks:
+            succs = [succ for succ in (self.jump[block.index], self.fall[block.index]) if succ is not None]
+            self.succs.append(sorted(set(succs), key=succs.index))
+            for succ in self.succs[-1]:
+                if succ != self.end:
+                    block.succs.append(self.blocks[succ])
+                    self.blocks[succ].preds.append(block)
+
+        self.idom = dominators(self.blocks)
+        self.position = dict((block.index, i) for i, block in enumerate(reverse_postorder(self.blocks)))
+        self.position[self.end] = len(blocks)
+        # where the edges leaving the body of a loop go, see post_dominators
+        self.position[self.end + 1] = len(blocks) + 1
+        self.loops = {}
+        self.owner = {}
+        self.find_loops()
+        self.joins = {}
+        # every name is declared at the top, the statements declare none
+        self.declared = set(name for quad in quads for name in quad.uses() + [quad.dst] if name is not None)
+        self.emitted = set()
+        # the counted loops of the emitter by the jump ending their test
+        self.counted = dict((loop.exit, n) for n, loop in enumerate(emitter.loops, 1))
+
+    def skip(self, index):
+        # the first block from index on with instructions, the blocks before it only have labels and gotos
+        seen = set()
+        while index < self.end and index not in seen:
+            seen.add(index)
+            block = self.lowered[index]
+            code = self.quads[block.start:block.end]
+            if any(quad.op not in (LABEL, GOTO) for quad in code):
+                break
+            index = self.blocks_at[self.labels[code[-1].label]] if code[-1].op == GOTO else index + 1
+        return index
+
+    def reachable(self, index):
+        return index == self.end or self.idom[index] is not None
+
+    def find_loops(self):
+        idom = self.idom
+        for header, body in natural_loops(self.blocks, idom).items():
+            self.loops[header] = Loop(header, body)
+        for index, succs in enumerate(self.succs):
+            for succ in succs:
+                if succ != self.end and self.reachable(index) and self.position[succ] <= self.position[index] \
+                        and (succ not in self.loops or index not in self.loops[succ].body):
+                    raise P2CStructureError("block %d jumps back into a loop that is not natural" % index)
+
+        # innermost first, the owner of a block is the innermost loop it is in
+        loops = sorted(self.loops.values(), key=lambda loop: len(loop.body))
+        for loop in loops:
+            exits = self.extend(loop)
+            if len(exits) > 1:
+                raise P2CStructureError("the loop at block %d exits to more than one block" % loop.header)
+            loop.follow = exits.pop() if exits else None
+            self.find_step(loop)
+        loops.sort(key=lambda loop: len(loop.body))
+        for i, loop in enumerate(loops):
+            for outer in loops[i + 1:]:
+                if loop.header in outer.body:
+                    if not loop.body <= outer.body:
+                        raise P2CStructureError("the loops at blocks %d and %d overlap" % (loop.header, outer.header))
+                    loop.parent = outer
+                    break
+            for index in loop.body:
+                self.owner.setdefault(index, loop)
+
+    def extend(self, loop):
+        # the paths ending in a break are not in the natural loop, they are taken in until the loop exits
+        # to one block, returns the blocks it exits to
+        body = loop.body
+        while True:
+            exits = set(succ for index in body for succ in self.succs[index] if succ not in body)
+            if len(exits) < 2:
+                return exits
+            for index in sorted(exits, key=self.position.get):
+                if index != self.end and dominates(self.idom, loop.header, index) and \
+                        all(pred.index in body or dominates(self.idom, index, pred.index)
+                            for pred in self.blocks[index].preds if self.reachable(pred.index)):
+                    body.add(index)
+                    break
+            else:
+                return exits
+
+    def find_step(self, loop):
+        # the loop is a for loop when the header only compares the counter and the one block jumping back
+        # ends with its step
+        quads = self.quads
+        block = self.blocks[loop.header]
+        code = [quad for quad in quads[block.start:block.end] if quad.op != LABEL]
+        latches = [pred.index for pred in block.preds if pred.index in loop.body and self.reachable(pred.index)]
+        if len(code) != 2 or code[1].op not in CONDITIONAL_JUMPS or len(latches) != 1 or latches[0] == loop.header:
+            return
+        latch = self.blocks[latches[0]]
+        code = [quad for quad in quads[latch.start:latch.end] if quad.op not in JUMPS]
+        step = code[-1] if code else None
+        if step is not None and step.op in ('+=', '-=') and step.dst in (quads[block.start:block.end][-2].src1,
+                                                                          quads[block.start:block.end][-2].src2):
+            loop.latch = latch.index
+            loop.step = step
+
+    def represent(self, index, loop):
+        # the block standing for index in the body of loop: itself, or the header of the loop inside loop
+        # it is in, None when it is not in loop
+        inner = self.owner.get(index)
+        if inner is loop:
+            return index
+        while inner is not None and inner.parent is not loop:
+            inner = inner.parent
+        if inner is None:
+            return index if loop is None else None
+        return inner.header
+
+    def join(self, index, exit, loop):
+        """
+        Where the arms of the branch at the end of block index go on, in the
+        body of loop, None when they only join at exit or do not join. When
+        both arms go on to the end of the body that is the block that
+        post-dominates index. Otherwise it is the first block both arms reach,
+        or the arm that goes on when the other one leaves the loop before it
+        reaches exit.
+        """
+        if loop not in self.joins:
+            self.joins[loop] = self.post_dominators(loop)
+        successors, ipdom = self.joins[loop]
+        sink = self.end + 1
+        if all(natural and succ in ipdom for succ, natural in successors[index]) and ipdom[index] != sink:
+            return ipdom[index]
+        arms = [succ for succ, _ in successors[index] if succ != sink]
+        if len(arms) < 2:
+            return arms[0] if arms and arms[0] in ipdom else None
+
+        # the blocks one arm reaches, the one that leaves if one does, then the first of them the other
+        # arm reaches
+        first, second = sorted(arms, key=lambda arm: arm in ipdom)
+        reached = set()
+        work = [first]
+        while work:
+            node = work.pop()
+            if node != sink and node not in reached:
+                reached.add(node)
+                work.extend(succ for succ, _ in successors[node])
+        last = max(self.position[node] for node in reached)
+        seen = {second}
+        work = [(self.position[second], second)]
+        while work:
+            position, node = heapq.heappop(work)
+            if node in reached:
+                return node
+            if position > last:
+                break
+            for succ, _ in successors[node]:
+                if succ != sink and succ not in seen:
+                    seen.add(succ)
+                    heapq.heappush(work, (self.position[succ], succ))
+        return second if second in ipdom and exit not in reached else None
+
+    def post_dominators(self, loop):
+        """
+        The successors of the blocks in the body of loop, with the loops inside
+        it as single blocks, and the immediate post-dominators of the blocks
+        that go on to the end of the body. The end is the sink, the block with
+        only the step of a for loop as well. The edges leaving loop go to it
+        too but do not count as going on.
+        """
+        sink = self.end + 1
+        nodes = set()
+        successors = {}
+        # a jump to the step is a continue unless there is more code in front of it
+        continued = None
+        if loop is not None and loop.latch is not None and len(self.code(loop.latch)) == 1:
+            continued = loop.latch
+        for block in self.blocks:
+            index = block.index
+            if not self.reachable(index) or self.represent(index, loop) != index:
+                continue
+            nodes.add(index)
+            inner = self.loops.get(index)
+            succs = self.succs[index] if inner is None or inner is loop else \
+                ([] if inner.follow is None else [inner.follow])
+            edges = []
+            for succ in succs:
+                if loop is not None and succ in (loop.header, continued) or loop is None and succ == self.end:
+                    edges.append((sink, True))
+                elif loop is not None and succ not in loop.body:
+                    edges.append((sink, False))
+                elif self.represent(succ, loop) is None:
+                    raise P2CStructureError("block %d jumps into a loop in the middle" % index)
+                else:
+                    edges.append((self.represent(succ, loop), True))
+            successors[index] = edges
+
+        # the body is a directed acyclic graph, the successors of a block come after it in reverse postorder
+        ipdom = {sink: sink}
+        for index in sorted(nodes, key=self.position.get, reverse=True):
+            runners = [succ for succ, natural in successors[index] if natural and succ in ipdom]
+            if not runners:
+                continue
+            runner = runners[0]
+            for other in runners[1:]:
+                while runner != other:
+                    if self.position[runner] < self.position[other]:
+                        runner = ipdom[runner]
+                    else:
+                        other = ipdom[other]
+            ipdom[index] = runner
+        return successors, ipdom
+
+    def code(self, index):
+        # the instructions of a block as C statements, without its labels and its jump
+        block = self.blocks[index]
+        return [self.emitter.format_quad(quad, self.declared) for quad in self.quads[block.start:block.end]
+                if quad.op != LABEL and quad.op not in JUMPS]
+
+    def condition(self, quad, taken=True):
+        # the condition under which quad jumps, or does not
+        if quad.op == IF:
+            return f"{quad.src1}" if taken else f"!{quad.src1}"
+        if quad.op == IFNOT:
+            return f"!{quad.src1}" if taken else f"{quad.src1}"
+        condition = f"{quad.src1} {IF_RELOPS[quad.op]} {quad.src2}"
+        return condition if taken else f"!({condition})"
+
+    def sequence(self, index, exit, loop, items, entering=False):
+        # the statements running the blocks from index until exit is reached, in the body of loop
+        while entering or index != exit:
+            if not entering and loop is not None:
+                if index == (loop.header if loop.latch is None else loop.latch):
+                    if loop.latch is not None and len(self.code(loop.latch)) > 1:
+                        raise P2CStructureError("a continue in block %d skips code of the loop" % loop.latch)
+                    items.append("continue;")
+                    return
+                if index == loop.follow:
+                    items.append("break;")
+                    return
+            if index == self.end:
+                items.append("return 0;")
+                return
+            inner = self.loops.get(index)
+            if inner is not None and inner is not loop:
+                self.loop(inner, items)
+                if inner.follow is None:
+                    return
+                index = inner.follow
+                continue
+            entering = False
+
+            if index in self.emitted:
+                raise P2CStructureError("block %d is reached from more than one place" % index)
+            self.emitted.add(index)
+            items.extend(self.code(index))
+            block = self.blocks[index]
+            last = self.quads[block.end - 1]
+            if last.op not in CONDITIONAL_JUMPS:
+                index = self.succs[index][0] if self.succs[index] else self.end
+                continue
+
+            join = self.join(index, exit, loop)
+            arms = []
+            for succ in (self.fall[index], self.jump[index]):
+                arm = []
+                self.sequence(succ, exit if join is None else join, loop, arm)
+                arms.append(arm)
+            self.branch(items, last, *arms)
+            if join is None:
+                return
+            index = join
+
+    def branch(self, items, quad, fall, taken):
+        if not fall and not taken:
+            return
+        if not fall:
+            items.append(('if', self.condition(quad), taken, []))
+        else:
+            items.append(('if', self.condition(quad, False), fall, taken))
+
+    def loop(self, loop, items):
+        quads = self.quads
+        header = self.blocks[loop.header]
+        last = quads[header.end - 1]
+        if last.op in CONDITIONAL_JUMPS and loop.follow in self.succs[loop.header] and \
+                len(set(self.succs[loop.header])) == 2:
+            # the header tests whether the loop goes on
+            self.emitted.add(loop.header)
+            stay = self.jump[loop.header] in loop.body
+            body = self.jump[loop.header] if stay else self.fall[loop.header]
+            test = [line[:-1] for line in self.code(loop.header)] + [self.condition(last, stay)]
+            statements = []
+            if loop.step is not None:
+                self.sequence(body, loop.latch, loop, statements)
+                self.emitted.add(loop.latch)
+                statements.extend(self.code(loop.latch)[:-1])
+                head = f"for (; {', '.join(test)}; {self.emitter.format_quad(loop.step, self.declared)[:-1]})"
+                n = self.counted.get(header.end - 1)
+                if n is not None:
+                    # the counted loop runs instead when it can
+                    counted = self.emitter.loops[n - 1]
+                    before, counted_head, body, after = self.emitter.counted_statements(counted, n, self.declared)
+                    items.append(('if', self.emitter.counted_check(counted),
+                                  before + [('loop', counted_head, body)] + after, [('loop', head, statements)]))
+                    return
+            else:
+                self.sequence(body, loop.header, loop, statements)
+                head = f"while ({', '.join(test)})"
+        else:
+            # the jump back to the header is a continue
+            loop.latch = loop.step = None
+            statements = []
+            self.sequence(loop.header, loop.header, loop, statements, True)
+            head = "while (1)"
+        items.append(('loop', head, statements))
+
+    def statements(self):
+        # the body of main as nested statements: strings, ('if', condition, then, else) and ('loop', head, body)
+        items = []
+        if self.blocks:
+            self.sequence(0, self.end, None, items)
+        return items
+
+    def lines(self):
+        # the C program, every name is declared at the top
+        body = self.statements()
+        lines = ["#include <stdio.h>", "int main () {"]
+        names = []
+        seen = set()
+        for quad in self.quads:
+            for name in quad.uses() + ([] if quad.dst is None else [quad.dst]):
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        lines.extend(f"{self.emitter.types.get(name, 'float')} {name};" for name in names)
+        render(body, 0, lines)
+        lines += ["return 0;", "}"]
+        return lines
+
+
+def render(items, depth, lines):
+    pad = '    ' * depth
+    for item in items:
+        if type(item) == str:
+            lines.append(pad + item)
+        elif item[0] == 'loop':
+            lines.append(pad + item[1] + ' {')
+            render(item[2], depth + 1, lines)
+            lines.append(pad + '}')
+        else:
+            _, condition, then, orelse = item
+            if not orelse and len(then) == 1 and then[0] in ('break;', 'continue;'):
+                lines.append(pad + f"if ({condition}) {then[0]}")
+                continue
+            lines.append(pad + f"if ({condition}) {{")
+            render(then, depth + 1, lines)
+            # an else with only an if in it is an else if
+            while len(orelse) == 1 and type(orelse[0]) == tuple and orelse[0][0] == 'if':
+                _, condition, then, orelse = orelse[0]
+                lines.append(pad + f"}} else if ({condition}) {{")
+                render(then, depth + 1, lines)
+            if orelse:
+                lines.append(pad + "} else {")
+                render(orelse, depth + 1, lines)
+            lines.append(pad + "}")
+
+
+def test_structurer():
+    from emitter import P2CEmitter
+    from parser import P2CParser
+    from tac import P2CProgram
+
+    program = ("s = 0\nfor i in range(10): {\n    if i == 2: {\n        continue\n    } elif i > 7: {\n        break\n"
+               "    } else: {\n        s += i\n    }\n    k = 0\n    while True: {\n        k += 1\n"
+               "        if k >= 3: { break }\n    }\n}\nwhile s > 20: { s -= 4 }\nprint(\"%f\\n\" s)\n")
+    expected = ["s = 0.0;", "i = 0;", "for (; t4 = i >= 10.0, !t4; i += 1) {", "    t1 = i == 2.0;",
+                "    t2 = i > 7.0;", "    if (t1) continue;", "    if (t2) break;", "    s += i;", "    k = 0.0;",
+                "    while (1) {", "        k += 1.0;", "        t3 = k >= 3.0;", "        if (t3) break;", "    }",
+                "}", "for (; t5 = s > 20.0, t5; s -= 4.0) {", "}", "printf(\"%f\\n\", s);", "return 0;", "}"]
+    _parser = P2CParser()
+    _parser.parse(program)
+    if _parser.generate_three_address_code(structured=True).split('\n')[-len(expected) - 1:-1] != expected:
+        return False
+    for opt_level in (1, 2):
+        code = _parser.generate_three_address_code(opt_level=opt_level, structured=True)
+        if 'goto' in code or code.count('break;') != 1 or code.count('continue;') != 1:
+            return False
+
+    # a loop entered in the middle is not a while loop, it is printed with gotos
+    code = P2CProgram()
+    code.emit('=', 'x', 0.0)
+    code.emit('ifnot', src1='x', label='l2')
+    code.emit('label', label='l1')
+    code.emit('+=', 'x', 1.0)
+    code.emit('label', label='l2')
+    code.emit('+=', 'x', 2.0)
+    code.emit('<', 't1', 'x', 10.0)
+    code.emit('if', src1='t1', label='l1')
+    emitter = P2CEmitter(structured=True)
+    try:
+        P2CStructurer(code, emitter).lines()
+        return False
+    except P2CStructureError:
+        pass
+    return 'goto l1;' in emitter.getvalue(code) and emitter.unstructured is not None
+
+
+if __name__ == '__main__':
+    if not test_structurer():
+        raise Exception("[STRUCTURE] Structurer test failed")
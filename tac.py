@@ -0,0 +1,114 @@
+# three address code operations, besides these the binary operators of the
+# language ('+', '<', '&&', ...) are used as operations: dst = src1 op src2
+ASSIGN_OPS = ('=', '+=', '-=', '*=', '/=')  # dst op src1
+NEG = 'neg'  # dst = -src1
+POS = 'pos'  # dst = +src1
+LABEL = 'label'  # label:
+GOTO = 'goto'  # goto label
+IF = 'if'  # if (src1) goto label
+IFNOT = 'ifnot'  # if (!src1) goto label
+PRINT = 'print'  # printf(src1, src2), src2 is None without an argument
+# if (src1 relop src2) goto label
+IF_RELOPS = {'if<': '<', 'if<=': '<=', 'if>': '>', 'if>=': '>=', 'if==': '==', 'if!=': '!='}
+
+CONDITIONAL_JUMPS = (IF, IFNOT) + tuple(IF_RELOPS)
+JUMPS = (GOTO,) + CONDITIONAL_JUMPS
+
+
+class Quad(object):
+    __slots__ = ('op', 'dst', 'src1', 'src2', 'label')
+
+    def __init__(self, op, dst=None, src1=None, src2=None, label=None):
+        self.op = op
+        self.dst = dst
+        self.src1 = src1
+        self.src2 = src2
+        self.label = label
+
+    def copy(self):
+        return Quad(self.op, self.dst, self.src1, self.src2, self.label)
+
+    def uses(self):
+        # the variables and temporaries read by this instruction, compound assignments read dst
+        if self.op == PRINT:
+            _uses = (self.src2,)
+        elif self.op in ASSIGN_OPS and self.op != '=':
+            _uses = (self.dst, self.src1)
+        else:
+            _uses = (self.src1, self.src2)
+        return [name for name in _uses if type(name) == str]
+
+    def __repr__(self):
+        return "Quad(%r, %r, %r, %r, %r)" % (self.op, self.dst, self.src1, self.src2, self.label)
+
+
+class BasicBlock(object):
+    __slots__ = ('index', 'start', 'end', 'succs', 'preds')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        # quads[start:end] of the program
+        self.start = start
+        self.end = end
+        self.succs = []
+        self.preds = []
+
+    def __repr__(self):
+        return "BasicBlock(%d, %d, %d)" % (self.index, self.start, self.end)
+
+
+class P2CProgram(object):
+    """
+    A lowered program: a flat list of quads where control flow is expressed with
+    labels and jumps, the label table and the basic blocks are derived from it.
+    """
+
+    def __init__(self, quads=None):
+        self.quads = quads if quads is not None else []
+
+    def emit(self, op, dst=None, src1=None, src2=None, label=None):
+        self.quads.append(Quad(op, dst, src1, src2, label))
+
+    def label_table(self):
+        return dict((quad.label, i) for i, quad in enumerate(self.quads) if quad.op == LABEL)
+
+    def basic_blocks(self):
+        quads = self.quads
+
+        # a block starts at the first instruction, at every label and after every jump
+        leaders = {0}
+        for i, quad in enumerate(quads):
+            if quad.op == LABEL:
+                leaders.add(i)
+            elif quad.op in JUMPS:
+                leaders.add(i + 1)
+        leaders = sorted(i for i in leaders if i < len(quads))
+
+        blocks = []
+        for i, start in enumerate(leaders):
+            end = leaders[i + 1] if i + 1 < len(leaders) else len(quads)
+            blocks.append(BasicBlock(i, start, end))
+
+        block_of = dict((block.start, block) for block in blocks)
+        labels = self.label_table()
+        for block in blocks:
+            last = quads[block.end - 1]
+            if last.op in JUMPS:
+                block.succs.append(block_of[labels[last.label]])
+            if last.op != GOTO and block.index + 1 < len(blocks) and blocks[block.index + 1] not in block.succs:
+                block.succs.append(blocks[block.index + 1])
+            for succ in block.succs:
+                succ.preds.append(block)
+        return blocks
+
+
+def fresh_names(quads, prefix='t'):
+    # temporaries, or labels with prefix l, or other names of prefix and a number, that are not used by the
+    # program yet
+    size = len(prefix)
+    numbers = [int(name[size:]) for quad in quads for name in (quad.dst, quad.src1, quad.src2, quad.label)
+               if type(name) == str and name[:size] == prefix and name[size:].isdigit()]
+    number = max(numbers, default=0)
+    while True:
+        number += 1
+        yield "%s%d" % (prefix, number)
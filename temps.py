@@ -0,0 +1,112 @@
+import re
+
+from cfg import liveness
+
+# the names P2CParser.get_temp() gives to temporaries
+TEMP = re.compile(r't\d+$')
+
+
+def reuse_temporaries(program, variables=()):
+    """
+    Renames the temporaries of a program so that temporaries that are never live
+    at the same time share a name, the program then needs about as many
+    temporaries as it has temporary values live at once. variables are the
+    names of the program, they are neither renamed nor given to temporaries.
+
+    Returns the number of temporaries before and after.
+    """
+    quads = program.quads
+
+    def is_temp(name):
+        return type(name) == str and TEMP.match(name) is not None and name not in variables
+
+    # temporaries in the order they first appear, which is the order they are renamed in
+    interference = {}
+    for quad in quads:
+        for name in (quad.dst, quad.src1, quad.src2):
+            if is_temp(name) and name not in interference:
+                interference[name] = set()
+
+    def interfere(name, live):
+        for other in live:
+            if other != name:
+                interference[name].add(other)
+                interference[other].add(name)
+
+    blocks = program.basic_blocks()
+    live_in, live_out = liveness(program, blocks)
+    for block in blocks:
+        live = set(name for name in live_out[block.index] if is_temp(name))
+        for quad in reversed(quads[block.start:block.end]):
+            if is_temp(quad.dst):
+                # written while the others hold their values
+                interfere(quad.dst, live)
+                live.discard(quad.dst)
+            live.update(name for name in quad.uses() if is_temp(name))
+    if blocks:
+        entry = [name for name in live_in[0] if is_temp(name)]
+        for name in entry:
+            interfere(name, entry)
+
+    # greedy coloring, a color is a temporary name
+    names = []
+    number = 0
+    renamed = {}
+    for temp, others in interference.items():
+        used = set(renamed[other] for other in others if other in renamed)
+        for name in names:
+            if name not in used:
+                break
+        else:
+            number += 1
+            while "t%d" % number in variables:
+                number += 1
+            name = "t%d" % number
+            names.append(name)
+        renamed[temp] = name
+
+    for quad in quads:
+        if quad.dst in renamed:
+            quad.dst = renamed[quad.dst]
+        if type(quad.src1) == str and quad.src1 in renamed:
+            quad.src1 = renamed[quad.src1]
+        if type(quad.src2) == str and quad.src2 in renamed:
+            quad.src2 = renamed[quad.src2]
+    return len(interference), len(names)
+
+
+def test_reuse_temporaries():
+    from parser import P2CParser
+    from tac import P2CProgram
+    from vm import P2CVM
+
+    # t2 is a variable of the program, t5 and t6 are live at once, t7 is written when they are not live anymore
+    code = P2CProgram()
+    code.emit('=', 't5', 1.0)
+    code.emit('=', 't6', 2.0)
+    code.emit('+', 't7', 't5', 't6')
+    code.emit('*', 't2', 't7', 't7')
+    code.emit('print', src1='"%f"', src2='t2')
+    if reuse_temporaries(code, {'t2'}) != (3, 2):
+        return False
+    result = [(quad.op, quad.dst, quad.src1, quad.src2) for quad in code.quads]
+    if result != [('=', 't1', 1.0, None), ('=', 't3', 2.0, None), ('+', 't1', 't1', 't3'), ('*', 't2', 't1', 't1'),
+                  ('print', None, '"%f"', 't2')]:
+        return False
+
+    program = ("a = 1\nt50 = 0\nwhile a < 4: {\n    b = (a + 2) * (a - 3) + a * a\n    c = (b * a + 2) / (b - 3 * a)\n"
+               "    t50 += c\n    print(\"%f \" b)\n    print(\"%f\\n\" c)\n    a += 1\n}\nprint(\"%f\\n\" t50)\n")
+    _parser = P2CParser()
+    _parser.parse(program)
+    _parser.generate_three_address_code()
+    expected = P2CVM(_parser.context.three_address_code).run()
+    code = _parser.generate_three_address_code(opt_level=1)
+    statistics = _parser.statistics
+    if statistics['temps_before'] <= statistics['temps_after'] or 't50 += ' not in code:
+        return False
+    return P2CVM(_parser.context.three_address_code).run() == expected
+
+
+if __name__ == '__main__':
+    if not test_reuse_temporaries():
+        raise Exception("[TEMPS] Temporary reuse test failed")
@@ -0,0 +1,152 @@
+import math
+from fractions import Fraction
+
+from infer import EXACT
+from tac import Quad, LABEL, JUMPS, fresh_names
+
+# the copies of the body a partially unrolled loop runs from one test to the next
+UNROLL_FACTOR = 4
+# the instructions the copies of the body of an unrolled loop may add up to
+UNROLL_BUDGET = 64
+
+
+def unroll_loops(program, factor=UNROLL_FACTOR, budget=UNROLL_BUDGET, vectorize=False):
+    """
+    Unrolls the loops of for statements whose counter starts at a number,
+    counts to a number and always takes the same number of iterations.
+
+    A loop whose copies of the body for all the iterations fit in budget
+    instructions is replaced by them, without a test or a jump. A longer one
+    runs factor copies from one test to the next, the iterations that are
+    left over run after it as copies again. The copies still count, so the
+    body sees the counter it saw before.
+
+    Only loops whose counter takes whole numbers a float holds exactly, or
+    such numbers times a power of two, are unrolled, so the number of
+    iterations is known. Loops with loops or break in them are not. With
+    vectorize the loops P2CVectorizer can run at once are left as they are.
+    Returns the number of loops unrolled.
+    """
+    from vector import counted_loops
+
+    quads = program.quads
+    labels = fresh_names(quads, 'l')
+    # index of the goto in front of a loop -> (index of its last jump, the quads instead)
+    replaced = {}
+    for loop in counted_loops(program):
+        if vectorize and loop.reason is None or not unrollable(quads, loop):
+            continue
+        iterations = count_iterations(quads, loop)
+        if iterations is None:
+            continue
+        trips, start, step = iterations
+        size = len(loop.body) + 1
+        if trips * size <= budget:
+            replaced[loop.entry] = loop.exit, copies(quads, loop, trips, labels) + [quads[loop.exit - 1]]
+        elif factor >= 2 and trips // factor >= 2 and (factor + trips % factor) * size <= budget:
+            test = quads[loop.exit - 1]
+            unrolled = [quads[loop.entry], quads[loop.entry + 1]] + copies(quads, loop, factor, labels)
+            # the loop ends at the counter of the first iteration that is left over, the counter is exact
+            stop = float(start + trips // factor * factor * step)
+            unrolled += [quads[loop.exit - 2], Quad(test.op, test.dst, test.src1, stop), quads[loop.exit]]
+            unrolled += copies(quads, loop, trips % factor, labels) + [test]
+            replaced[loop.entry] = loop.exit, unrolled
+
+    if not replaced:
+        return 0
+    _quads = []
+    i = 0
+    while i < len(quads):
+        if i in replaced:
+            exit, unrolled = replaced[i]
+            _quads.extend(unrolled)
+            i = exit + 1
+        else:
+            _quads.append(quads[i])
+            i += 1
+    program.quads = _quads
+    return len(replaced)
+
+
+def unrollable(quads, loop):
+    # the body does not write the counter, has no loop and no break, and is only jumped to from the loop itself,
+    # a break would jump out of the middle of the copies, which is no while or if statement
+    defined = dict((quad.label, i) for i, quad in enumerate(loop.body) if quad.op == LABEL)
+    for i, quad in enumerate(loop.body):
+        if quad.dst == loop.var or quad.op in JUMPS and defined.get(quad.label, i) <= i:
+            return False
+    inside = set(defined) | {loop.body_label, loop.test_label}
+    for i, quad in enumerate(quads):
+        if (i < loop.entry or i > loop.exit) and quad.op in JUMPS and quad.label in inside:
+            return False
+    return True
+
+
+def count_iterations(quads, loop):
+    """
+    (iterations, start, step) of a loop, the numbers as fractions. None when
+    the counter does not start at a number, or takes values a float does not
+    hold exactly, or the loop does not end.
+    """
+    start = None
+    for quad in reversed(quads[:loop.entry]):
+        if quad.op in JUMPS or quad.op == LABEL:
+            break
+        if quad.dst == loop.var:
+            start = quad.src1 if quad.op == '=' else None
+            break
+    bound = loop.end
+    if not all(type(value) in (int, float) and math.isfinite(value) for value in (start, loop.step, bound)):
+        return None
+    # compared with a float, an int is converted to a float
+    if type(bound) == int and abs(bound) > EXACT:
+        return None
+    start, step, bound = Fraction(start), Fraction(loop.step), Fraction(bound)
+    before = start >= bound if loop.test.op == '>=' else start <= bound
+    if before:
+        trips = 0
+    elif (step > 0) != (loop.test.op == '>='):
+        return None
+    else:
+        trips = math.ceil((bound - start) / step)
+    stop = start + trips * step
+    denominator = max(start.denominator, step.denominator)
+    if denominator > 2 ** 100 or any(abs(value * denominator) > EXACT for value in (start, step, stop)):
+        return None
+    return trips, start, step
+
+
+def copies(quads, loop, count, labels):
+    # count copies of the body, each with the step of the counter and labels of its own
+    step = quads[loop.exit - 3]
+    unrolled = []
+    for _ in range(count):
+        rename = dict((quad.label, next(labels)) for quad in loop.body if quad.op == LABEL)
+        for quad in loop.body + [step]:
+            quad = quad.copy()
+            quad.label = rename.get(quad.label, quad.label)
+            unrolled.append(quad)
+    return unrolled
+
+
+def test_loop_unrolling():
+    from parser import P2CParser
+    from vm import P2CVM
+
+    program = ("s = 0\nfor i in range(3): { s += i }\nfor j in range(1, 11, 1): {\n    if j == 4: { continue }\n"
+               "    s += j\n}\nfor k in range(0, 1, 0.1): { s += k }\nprint(\"%f\" s)\n")
+    _parser = P2CParser()
+    _parser.parse(program)
+    expected = P2CVM(_parser.lower(2, unroll=(1, 0))).run()
+    code = _parser.generate_three_address_code(opt_level=2, unroll=(4, 30))
+    # the loop over i is gone, the one over j tests every 4 iterations and runs the 2 left over after it,
+    # the one over k does not count exactly
+    if 'i >= 3.0' in code or code.count('s += i;') != 3 or code.count('s += j;') != 6 or \
+            't1 = j >= 9.0;' not in code or 'k += 0.1;' not in code:
+        return False
+    return _parser.statistics['unrolled'] == 2 and P2CVM(_parser.context.three_address_code).run() == expected
+
+
+if __name__ == '__main__':
+    if not test_loop_unrolling():
+        raise Exception("[UNROLL] Loop unrolling test failed")
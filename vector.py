@@ -0,0 +1,360 @@
+import array
+import math
+
+from tac import ASSIGN_OPS, NEG, POS, LABEL, GOTO, IFNOT, PRINT, JUMPS
+from vm import P2CVMError, binary_expression, c_int, compile_statements, divide, fault, printf_format
+
+# the start, the bound and the step of a vectorized loop are whole numbers no bigger than this, so every
+# value of the counter is a whole number up to 2 ** 24, which a float holds exactly
+EXACT = 2 ** 23
+# the iterations run at once by the backends, the columns of the ones in between are not kept
+CHUNKS = {'numpy': 1 << 16, 'python': 1 << 12}
+
+
+def import_numpy():
+    # NumPy when it is installed, None otherwise, only the vectorizer imports it, the optimizer finds the
+    # counted loops without it
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def round32(value):
+    # value stored into a float
+    return array.array('f', (value,))[0]
+
+
+def counted_loops(program):
+    # the loops of program in the shape tac_for gives them, at every optimization level
+    quads = program.quads
+    labels = program.label_table()
+    loops = []
+    for index, quad in enumerate(quads):
+        if quad.op != IFNOT or index < 5:
+            continue
+        step, test_label, test = quads[index - 3:index]
+        if test.op not in ('>=', '<=') or test.dst != quad.src1 or test_label.op != LABEL:
+            continue
+        if step.op != '+=' or step.dst != test.src1:
+            continue
+        body = labels.get(quad.label, 0)
+        if not 0 < body < index - 3 or quads[body - 1].op != GOTO or quads[body - 1].label != test_label.label:
+            continue
+        loops.append(CountedLoop(quads, body - 1, index))
+    return loops
+
+
+class CountedLoop(object):
+    """
+    A loop lowered from `for var in range(start, end, step)` that still has
+    the shape tac_for gives it:
+
+        goto test; body:; ...; var += step; test:; t = var >= end; if (!t) goto body
+
+    with <= when step is negative. quads[entry] is the goto in front of it
+    and quads[exit] the jump back. reason says why its iterations cannot
+    run at once, it is None when they can.
+    """
+
+    exact = EXACT
+
+    def __init__(self, quads, entry, exit):
+        self.entry = entry
+        self.exit = exit
+        self.body_label = quads[entry + 1].label
+        self.test_label = quads[entry].label
+        self.body = quads[entry + 2:exit - 3]
+        self.test = quads[exit - 1]
+        self.var = self.test.src1
+        self.end = self.test.src2
+        self.step = quads[exit - 3].src1
+        self.reason = self.analyze()
+
+    def analyze(self):
+        body = self.body
+        if any(quad.op in JUMPS or quad.op == LABEL for quad in body):
+            return "the body has control flow"
+        step = self.step
+        if type(step) == str:
+            return "the step %s is not a number" % step
+        if not 0 < abs(step) <= EXACT or step != int(step):
+            return "the step is not a whole number a float counts by exactly"
+        if type(self.end) != str and not -EXACT <= self.end <= EXACT:
+            return "the bound is out of the range a float counts in exactly"
+        if self.end == self.var:
+            return "the bound is the counter"
+        written = set(quad.dst for quad in body if quad.op != PRINT)
+        if self.var in written:
+            return "the body assigns %s" % self.var
+        if self.end in written:
+            return "the body assigns the bound %s" % self.end
+
+        written.add(self.test.dst)
+        assigned = set()
+        for quad in body + [self.test]:
+            for name in quad.uses():
+                if name in written and name not in assigned:
+                    return "%s is carried from one iteration to the next" % name
+            if quad.op == PRINT:
+                if quad.src2 is not None and type(quad.src2) != str and type(quad.src2) != float:
+                    return "printf has a %s argument" % type(quad.src2).__name__
+                try:
+                    printf_format(quad.src1)(None if quad.src2 is None else 0.0)
+                except P2CVMError as e:
+                    return str(e)
+            else:
+                assigned.add(quad.dst)
+                a, b = (quad.dst, quad.src1) if quad.op in ASSIGN_OPS[1:] else (quad.src1, quad.src2)
+                if type(a) == int and type(b) == int and quad.op not in (NEG, POS, '=') and \
+                        c_int(quad.op[0] if quad.op in ASSIGN_OPS else quad.op, a, b) is None:
+                    return "the body divides by zero"
+        return None
+
+
+class P2CVectorizer(object):
+    """
+    Finds the loops of a lowered program whose iterations do not depend on
+    each other, so they can run all at once.
+
+    A loop of a for statement qualifies when its body is straight-line code,
+    the step is a whole number, and every name the body writes is written
+    before it is read in an iteration, so nothing is carried from one
+    iteration to the next but the counter. When it runs, the counter must
+    also start at a whole number and the bound be in range, otherwise the
+    loop runs one iteration after the other as before.
+
+    The virtual machine (see vm.P2CVM) runs the iterations of a qualifying
+    loop as array operations: with NumPy when it is installed, otherwise as
+    Python list comprehensions, one column of values per instruction. The
+    emitter (see emitter.P2CEmitter) writes it as a countable for loop in
+    front of the scalar one, which the C compiler can vectorize.
+
+    loops are the for statements of the parse tree, body label -> (line,
+    variable), see P2CContext.loops, report says what became of each.
+    """
+
+    def __init__(self, program, loops=None, backend=None):
+        self.backend = backend or ('numpy' if import_numpy() is not None else 'python')
+        self.loops = counted_loops(program)
+        self.statements = loops or {}
+
+    def vectorized(self):
+        return [loop for loop in self.loops if loop.reason is None]
+
+    def entries(self):
+        # (line, variable, reason) of every loop, reason is None for the ones that are vectorized
+        found = dict((loop.body_label, loop) for loop in self.loops)
+        entries = []
+        for label, (lineno, var) in self.statements.items():
+            loop = found.pop(label, None)
+            entries.append((lineno, var, "the optimizer changed its shape" if loop is None else loop.reason))
+        entries.extend((None, loop.var, loop.reason) for loop in found.values())
+        entries.sort(key=lambda entry: (entry[0] is None, entry[0] or 0))
+        return entries
+
+    def report(self):
+        lines = []
+        for lineno, var, reason in self.entries():
+            where = "line %d" % lineno if lineno is not None else "a loop"
+            if reason is None:
+                lines.append("%s: for %s is vectorized (%s)" % (where, var, self.backend))
+            else:
+                lines.append("%s: for %s is not vectorized, %s" % (where, var, reason))
+        return lines
+
+    def compile(self, loop, vm):
+        """
+        A function of the registers of vm that runs all the iterations of
+        loop and returns True, or False without running any when the counter
+        does not start at a whole number, the bound is out of range or the
+        loop has no iteration.
+        """
+        numpy_backend = self.backend == 'numpy'
+        register = vm.register
+        step = loop.step
+        less = '<' if step > 0 else '>'
+        end = 'r[%d]' % register(loop.end) if type(loop.end) == str else repr(float(loop.end))
+        names = ['math', 'numpy', 'array', 'divide', 'fault', 'round32', 'write']
+        values = [math, import_numpy() if numpy_backend else None, array, divide, fault, round32, vm.write]
+        statements = [
+            "start = r[%d]" % register(loop.var),
+            "end = %s" % end,
+            "if not (-%d <= start <= %d and -%d <= end <= %d and start == int(start)):" % ((EXACT,) * 4),
+            "    return False",
+            # the iterations are the ones where the counter is before end, the comparisons are exact
+            "n = max(0, math.ceil((end - start) / %r))" % step,
+            "while n and not start + (n - 1) * %r %s end:" % (step, less),
+            "    n -= 1",
+            "while start + n * %r %s end:" % (step, less),
+            "    n += 1",
+            "if not n:",
+            "    return False",
+        ]
+        indent = '    '
+        if numpy_backend:
+            statements.append("with numpy.errstate(all='ignore'):")
+            indent = '        '
+        statements.append(indent[4:] + "for first in range(0, n, %d):" % CHUNKS[self.backend])
+        if numpy_backend:
+            statements.append(indent + "c = start + %r * numpy.arange(first, min(first + %d, n))"
+                              % (step, CHUNKS[self.backend]))
+        else:
+            statements.append(indent + "c = [start + k * %r for k in range(first, min(first + %d, n))]"
+                              % (step, CHUNKS[self.backend]))
+        statements.append(indent + "m = len(c)")
+
+        # name -> the Python variable holding it in the iteration, a column of values or one
+        # value that is the same in all of them
+        columns = {loop.var: 'c'}
+        scalars = {}
+        prints = []
+
+        def operand(value, element):
+            # the code reading value, and the column if it is one: the Python backend computes
+            # element by element, NumPy whole columns
+            if type(value) != str:
+                return repr(value), None
+            if value in columns:
+                return (columns[value] if numpy_backend else element), columns[value]
+            if value not in scalars:
+                scalars[value] = 's%d' % register(value)
+                statements.insert(2, "%s = r[%d]" % (scalars[value], register(value)))
+            return scalars[value], None
+
+        for i, quad in enumerate(loop.body):
+            op = quad.op
+            if op == PRINT:
+                values.append(printf_format(quad.src1))
+                names.append('f%d' % i)
+                if quad.src2 is None:
+                    texts = '[f%d(None)] * m' % i
+                else:
+                    code, column = operand(quad.src2, 'p')
+                    if column is None:
+                        texts = '[f%d(%s)] * m' % (i, code)
+                    else:
+                        texts = '[f%d(p) for p in %s]' % (i, column + ('.tolist()' if numpy_backend else ''))
+                statements.append(indent + "p%d = %s" % (i, texts))
+                prints.append('p%d' % i)
+                continue
+
+            if op in ASSIGN_OPS[1:]:
+                op, a, b = op[0], quad.dst, quad.src1
+            else:
+                a, b = quad.src1, quad.src2
+            left, a_column = operand(a, 'p')
+            right, b_column = (left, a_column) if b == a and type(a) == str else operand(b, 'q')
+            if op == '=':
+                expression = left
+            elif op == NEG:
+                expression = '-' + left
+            elif op == POS:
+                expression = '+' + left
+            elif type(a) == int and type(b) == int:
+                expression = repr(c_int(op, a, b))
+            elif numpy_backend and (a_column or b_column):
+                expression = numpy_expression(op, a, b, left, right, quad.dst)
+            else:
+                expression = binary_expression(op, a, b, left, right, quad.dst)
+
+            dst = 'c%d' % register(quad.dst)
+            scalars.pop(quad.dst, None)
+            columns.pop(quad.dst, None)
+            if not a_column and not b_column:
+                scalars[quad.dst] = 's%d' % register(quad.dst)
+                statements.append(indent + "%s = round32(%s)" % (scalars[quad.dst], expression))
+            elif numpy_backend:
+                statements.append(indent + "%s = numpy.asarray(%s, numpy.float32).astype(numpy.float64)"
+                                  % (dst, expression))
+                columns[quad.dst] = dst
+            else:
+                if a_column and b_column and a_column != b_column:
+                    elements = 'p, q in zip(%s, %s)' % (a_column, b_column)
+                else:
+                    elements = '%s in %s' % ('p' if a_column else 'q', a_column or b_column)
+                statements.append(indent + "%s = array.array('f', [%s for %s])" % (dst, expression, elements))
+                columns[quad.dst] = dst
+
+        if len(prints) == 1:
+            statements.append(indent + "write(''.join(%s))" % prints[0])
+        elif prints:
+            statements.append(indent + "write(''.join(map(''.join, zip(%s))))" % ', '.join(prints))
+
+        # the registers after the last iteration, and the test that ended the loop
+        written = set(quad.dst for quad in loop.body if quad.op != PRINT)
+        for name in sorted(written, key=register):
+            if name in columns:
+                statements.append("r[%d] = %s[-1]" % (register(name), columns[name]))
+            else:
+                statements.append("r[%d] = %s" % (register(name), scalars[name]))
+        statements.append("r[%d] = start + n * %r" % (register(loop.var), step))
+        statements.append("r[%d] = 1.0" % register(loop.test.dst))
+        statements.append("return True")
+        return compile_statements(statements, names)(*values)
+
+
+def numpy_expression(op, a, b, left, right, dst=None):
+    # binary_expression for NumPy arrays, left or right is a column of values
+    if (op == '*' and type(a) == str or op == '/') and type(b) != str and b == -1:
+        return '-' + left
+    if op == '*' and type(b) == str and type(a) != str and a == -1:
+        return '-' + right
+    if op in ('+', '*') and type(a) == type(b) == str:
+        first = right if dst == b and dst != a else left
+        return 'numpy.where(%s != %s, %s, %s %s %s)' % (first, first, first, left, op, right)
+    if op == '&&':
+        return '(%s != 0) & (%s != 0)' % (left, right)
+    if op == '||':
+        return '(%s != 0) | (%s != 0)' % (left, right)
+    return '(%s %s %s)' % (left, op, right)
+
+
+def test_vectorizer():
+    from parser import P2CParser
+    from vm import P2CVM
+
+    program = ("a = 3\ns = 0\nfor i in range(0, 10, 2): {\n    x = i * a + 1\n    y = x / (i - 4)\n"
+               "    print(\"%g \" y)\n    print(\"%g\\n\" (y > 1) && (x < 20))\n}\n"
+               "for j in range(5): { s += j }\n"
+               "for k in range(a): { if k > 1: { print(\"%g\\n\" k) } }\n"
+               "for m in range(0.5, a): { z = m * m\n print(\"%g\\n\" z) }\n"
+               "print(\"%g \" i)\nprint(\"%g \" x)\nprint(\"%g \" y)\nprint(\"%g \" s)\nprint(\"%g\\n\" z)\n")
+    report = ["line 3: for i is vectorized (%s)",
+              "line 9: for j is not vectorized, s is carried from one iteration to the next",
+              "line 10: for k is not vectorized, the body has control flow",
+              "line 11: for m is vectorized (%s)"]
+    _parser = P2CParser()
+    for opt_level in (0, 1, 2):
+        _parser.parse(program)
+        scalar_code = _parser.generate_three_address_code(opt_level=opt_level)
+        code = _parser.generate_three_address_code(opt_level=opt_level, vectorize=True)
+        if 'for (long vk1 = 0; vk1 < vn1; vk1++) {' not in code or code.count('goto v') != 2 or \
+                code.replace('\n', '').replace(' ', '') == scalar_code.replace('\n', '').replace(' ', ''):
+            return False
+        lowered = _parser.context.three_address_code
+        scalar = P2CVM(lowered)
+        expected = scalar.run()
+        for backend in ('numpy', 'python') if import_numpy() is not None else ('python',):
+            vectorizer = P2CVectorizer(lowered, _parser.context.loops, backend)
+            vm = P2CVM(lowered, 1000, vectorizer)
+            # the loop over i is one step, the one from 0.5 does not count whole numbers and runs as before,
+            # the ones over j and k are unrolled at level 2
+            scalar_loops = report[1:3] if opt_level < 2 else \
+                [line.split(',')[0] + ", the optimizer changed its shape" for line in report[1:3]]
+            if vectorizer.report() != [report[0] % backend] + scalar_loops + [report[3] % backend] or \
+                    vm.run() != expected or vm.values() != scalar.values():
+                return False
+    # the C code of a loop does not use the names of the program
+    _parser.parse("vn1 = 5\nx = 0\nfor i in range(3): { x = vn1 + i }\nprint(\"%f\\n\" x)\n")
+    code = _parser.generate_three_address_code(vectorize=True)
+    if 'long vn1' in code or 'long vn2 = (long)((3.0 - vstart1) / 1);' not in code:
+        return False
+    return expected.startswith("-0.25 0\n-3.5 0\ninf 1\n9.5 1\n6.25 0\n2\n") and \
+        expected.endswith("10 25 6.25 10 6.25\n")
+
+
+if __name__ == '__main__':
+    if not test_vectorizer():
+        raise Exception("[VECTOR] Vectorizer test failed")
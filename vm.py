@@ -0,0 +1,488 @@
+import argparse
+import array
+import math
+import operator
+import re
+import sys
+
+from tac import ASSIGN_OPS, NEG, POS, LABEL, GOTO, IF, IFNOT, PRINT, IF_RELOPS, JUMPS
+
+# a conversion of a printf format: %[flags][width][.precision][length]conversion
+CONVERSION = re.compile(r'%([-+ #0]*)(\d*)(?:\.(\d*))?(hh|h|ll|l|L|j|z|t)?(.?)', re.S)
+# an escape sequence of a C string literal
+ESCAPE = re.compile(r'\\(x[0-9a-fA-F]+|[0-7]{1,3}|.)', re.S)
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v', 'e': '\x1b'}
+# the conversions of a double, the argument of printf is a float promoted to double
+FLOAT_CONVERSIONS = 'fFeEgG'
+
+INT_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '&&': lambda a, b: a != 0 and b != 0,
+    '||': lambda a, b: a != 0 or b != 0,
+}
+
+
+class P2CVMError(Exception):
+    pass
+
+
+def fault(message):
+    raise P2CVMError(message)
+
+
+def divide(a, b):
+    # a / b where b is zero, what the C code gets instead of an exception
+    if a != a:
+        return a
+    if a == 0:
+        # the default nan of x86, printed as -nan
+        return -math.nan
+    return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def c_int(op, a, b):
+    # an operator on two int literals (True, False) as C computes it, None for a division by zero
+    if op in ('/', '%'):
+        if b == 0:
+            return None
+        quotient = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+        return quotient if op == '/' else a - quotient * b
+    return int(INT_OPS[op](a, b))
+
+
+def binary_expression(op, a, b, left, right, dst=None):
+    # the Python expression of a op b written to dst as the C code computes it, a and b are names or
+    # numbers and left and right the code reading them
+    # gcc makes x * -1 and x / -1 a negation, which flips the sign of a nan too
+    if (op == '*' and type(a) == str or op == '/') and type(b) != str and b == -1:
+        return '-' + left
+    if op == '*' and type(b) == str and type(a) != str and a == -1:
+        return '-' + right
+    if op == '/':
+        if type(b) == str:
+            return '%s / %s if %s else divide(%s, %s)' % (left, right, right, left, right)
+        return '%s / %s' % (left, right) if b else 'divide(%s, %s)' % (left, right)
+    if op in ('+', '*') and type(a) == type(b) == str:
+        # when both are nan Python may give either, x86 gives the first, which gcc makes the one
+        # written to when it is the right one
+        first = right if dst == b and dst != a else left
+        return '%s if (x := %s %s %s) != x and %s != %s else x' % (first, left, op, right, first, first)
+    if op == '&&':
+        return '%s != 0 and %s != 0' % (left, right)
+    if op == '||':
+        return '%s != 0 or %s != 0' % (left, right)
+    return '%s %s %s' % (left, op, right)
+
+
+def c_string(literal):
+    # the characters of a C string literal, with its quotes
+    def escape(match):
+        code = match.group(1)
+        if code[0] == 'x':
+            return chr(int(code[1:], 16) & 0xff)
+        if code[0] in '01234567':
+            return chr(int(code, 8) & 0xff)
+        return ESCAPES.get(code, code)
+    return ESCAPE.sub(escape, literal[1:-1])
+
+
+def non_finite(value, flags, width, upper):
+    # inf and nan as glibc prints them: with the sign of a nan too, padded with spaces even with the 0 flag
+    text = 'nan' if value != value else 'inf'
+    if math.copysign(1.0, value) < 0:
+        sign = '-'
+    elif '+' in flags:
+        sign = '+'
+    elif ' ' in flags:
+        sign = ' '
+    else:
+        sign = ''
+    text = sign + (text.upper() if upper else text)
+    return text.ljust(width) if '-' in flags else text.rjust(width)
+
+
+def printf_format(literal):
+    """
+    What printf(literal, value) prints as a function of value, None when printf
+    has no argument. Only the conversions of a double are known, a format that
+    needs another argument than the one given is undefined in C and raises
+    P2CVMError when it is printed.
+    """
+    text = c_string(literal)
+    before = []
+    after = []
+    spec = None
+    error = None
+    start = 0
+    for match in CONVERSION.finditer(text):
+        (after if spec else before).append(text[start:match.start()])
+        start = match.end()
+        flags, width, precision, length, conversion = match.groups()
+        if match.group() == '%%':
+            (after if spec else before).append('%')
+        elif spec is not None:
+            error = "printf(%s) needs more than one argument" % literal
+        elif conversion not in FLOAT_CONVERSIONS or length not in (None, 'l'):
+            error = "printf(%s) has %r, only the conversions of a float are known" % (literal, match.group())
+            spec = ('', 0, '')
+        else:
+            precision = '' if precision is None else '.' + (precision or '0')
+            spec = (flags, int(width or 0), '%' + flags + width + precision + conversion)
+    (after if spec else before).append(text[start:])
+    before = ''.join(before)
+    after = ''.join(after)
+
+    if error is not None:
+        return lambda value: fault(error)
+    if spec is None:
+        # an argument without a conversion is not printed
+        return lambda value: before
+
+    flags, width, conversion = spec
+    upper = conversion[-1].isupper()
+    python_format = before.replace('%', '%%') + conversion + after.replace('%', '%%')
+
+    def _format(value):
+        if type(value) != float:
+            fault("printf(%s) needs a float argument, it has %r" % (literal, value))
+        if math.isfinite(value):
+            return python_format % value
+        return before + non_finite(value, flags, width, upper) + after
+    return _format
+
+
+# a block that has run this many times is compiled into one function, see P2CVM.fuse
+HOT = 100
+
+# (template, names) -> function of names making a function of the registers, see factory
+FACTORIES = {}
+# the names of the operands in a template
+NAMES = dict((name, name) for name in 'dabtf')
+
+
+def compile_statements(statements, names):
+    # a function of names making a function of the registers r that runs statements
+    namespace = {'divide': divide, 'fault': fault}
+    body = ''.join('        %s\n' % statement for statement in statements)
+    exec('def make(%s):\n    def run(r):\n%s    return run\n' % (', '.join(names), body), namespace)
+    return namespace['make']
+
+
+def factory(template, names):
+    # compile_statements for one instruction, compiled once per shape of instruction and then only
+    # bound to its operands
+    key = (template, names)
+    make = FACTORIES.get(key)
+    if make is None:
+        make = FACTORIES[key] = compile_statements((template.format(**NAMES),), names)
+    return make
+
+
+class P2CVM(object):
+    """
+    Runs a lowered program (tac.P2CProgram) the way its C code runs, without
+    a C compiler.
+
+    Every variable and temporary is a slot of a float32 register array, storing
+    into it rounds like assigning to a float, and the numbers in the code are
+    doubles, as the literals of the C code are. Labels are resolved to the
+    index of their basic block once, a block returns the index of the block
+    to run next. An instruction is run by a function made for its operation
+    and the kind of its operands, bound to its operands when the program is
+    loaded, so loading is cheap. A block that runs often is compiled into one
+    function with all its instructions. printf is formatted as glibc does it.
+
+    max_steps limits the blocks that are run, a program that runs longer raises
+    P2CVMError, and so does one that is undefined in C. Reading a variable before
+    it is written gives 0.0.
+
+    With a vectorizer (see vector.P2CVectorizer) the loops it finds run all their
+    iterations at once, in one step.
+    """
+
+    def __init__(self, program, max_steps=None, vectorizer=None):
+        self.max_steps = max_steps
+        # name -> index in the registers
+        self.names = {}
+        self.registers = None
+        self.output = []
+        self.write = self.output.append
+
+        quads = program.quads
+        blocks = program.basic_blocks()
+        # a block of labels only falls through, a jump to it goes to the first block after it with code
+        skip = list(range(len(blocks) + 1))
+        for block in reversed(blocks):
+            if all(quad.op == LABEL for quad in quads[block.start:block.end]):
+                skip[block.index] = skip[block.index + 1]
+        block_at = dict((block.start, block.index) for block in blocks)
+        labels = dict((label, skip[block_at[start]]) for label, start in program.label_table().items())
+
+        # index of a block -> its instructions and its jump as (template, operands)
+        self.blocks = {}
+        for block in blocks:
+            if skip[block.index] == block.index:
+                self.blocks[block.index] = self.load_block(quads[block.start:block.end], labels,
+                                                           skip[block.index + 1])
+        # the program is done when the index of the block to run is end, the loops that run all
+        # their iterations at once come after it, see vector.P2CVectorizer
+        self.end = len(blocks)
+        self.code = [None] * (self.end + 1)
+        if vectorizer is not None:
+            block_of_jump = dict((block.end - 1, block.index) for block in blocks)
+            for loop in vectorizer.vectorized():
+                exit = loop.exit + 1
+                self.blocks[block_of_jump[loop.entry]][1][1]['t'] = len(self.code)
+                self.code.append(self.loop_function(vectorizer, loop, labels[loop.test_label],
+                                                    skip[block_at[exit]] if exit < len(quads) else self.end))
+        for index in self.blocks:
+            self.code[index] = self.block_function(index)
+        self.entry = skip[0]
+
+    def register(self, name):
+        index = self.names.get(name)
+        if index is None:
+            index = self.names[name] = len(self.names)
+        return index
+
+    def operand(self, value, name, operands):
+        # the code reading value, named name in the template
+        if type(value) == str:
+            operands[name] = self.register(value)
+            return 'r[{%s}]' % name
+        operands[name] = value
+        return '{%s}' % name
+
+    def binary(self, op, a, b, operands, dst=None):
+        # the expression of a op b written to dst, a and b are names or numbers
+        if type(a) == int and type(b) == int:
+            operands['a'] = c_int(op, a, b)
+            if operands['a'] is None:
+                operands['a'] = "integer division by zero"
+                return 'fault({a})'
+            return '{a}'
+        if op == '%':
+            raise P2CVMError("invalid operands to binary %, they are floats")
+        return binary_expression(op, a, b, self.operand(a, 'a', operands), self.operand(b, 'b', operands), dst)
+
+    def instruction(self, quad):
+        # (template, operands): the statement running quad with {d}, {a} and {b} for its operands
+        op = quad.op
+        operands = {}
+        if op == PRINT:
+            operands['d'] = self.write
+            operands['b'] = _format = printf_format(quad.src1)
+            if quad.src2 is None:
+                try:
+                    operands['b'] = _format(None)
+                    return '{d}({b})', operands
+                except P2CVMError:
+                    return '{d}({b}(None))', operands
+            return '{d}({b}(%s))' % self.operand(quad.src2, 'a', operands), operands
+
+        operands['d'] = self.register(quad.dst)
+        if op == '=':
+            expression = self.operand(quad.src1, 'a', operands)
+        elif op in ASSIGN_OPS:
+            expression = self.binary(op[0], quad.dst, quad.src1, operands, quad.dst)
+        elif op == NEG:
+            expression = '-' + self.operand(quad.src1, 'a', operands)
+        elif op == POS:
+            expression = '+' + self.operand(quad.src1, 'a', operands)
+        else:
+            expression = self.binary(op, quad.src1, quad.src2, operands, quad.dst)
+        return 'r[{d}] = ' + expression, operands
+
+    def jump(self, quad, labels, fall_through):
+        # (template, operands): the statement returning the next block, {t} when the jump is taken, {f} if not
+        op = quad.op
+        operands = {'f': fall_through}
+        if op not in JUMPS:
+            return 'return {f}', operands
+        operands['t'] = labels[quad.label]
+        if op == GOTO:
+            return 'return {t}', operands
+        if op == IF:
+            return 'return {t} if %s else {f}' % self.operand(quad.src1, 'a', operands), operands
+        if op == IFNOT:
+            return 'return {f} if %s else {t}' % self.operand(quad.src1, 'a', operands), operands
+        return 'return {t} if %s %s %s else {f}' % (self.operand(quad.src1, 'a', operands), IF_RELOPS[op],
+                                                    self.operand(quad.src2, 'b', operands)), operands
+
+    def load_block(self, quads, labels, fall_through):
+        last = quads[-1]
+        instructions = [self.instruction(quad) for quad in (quads[:-1] if last.op in JUMPS else quads)
+                        if quad.op != LABEL]
+        return instructions, self.jump(last, labels, fall_through)
+
+    def block_function(self, index):
+        # runs the instructions one function each until the block is hot, then it is fused
+        instructions, (template, operands) = self.blocks[index]
+        body = tuple(factory(_template, tuple(_operands))(*_operands.values())
+                     for _template, _operands in instructions)
+        jump = factory(template, tuple(operands))(*operands.values())
+        code = self.code
+        runs = 0
+
+        def run(r):
+            nonlocal runs
+            for instruction in body:
+                instruction(r)
+            runs += 1
+            if runs == HOT:
+                code[index] = self.fuse(index)
+            return jump(r)
+        return run
+
+    def loop_function(self, vectorizer, loop, scalar, exit):
+        # enters a vectorized loop: all its iterations are run at once and it goes on at exit, or
+        # the loop is run one iteration after the other from its test at scalar when they cannot be
+        run = None
+
+        def enter(r):
+            nonlocal run
+            if run is None:
+                run = vectorizer.compile(loop, self)
+            return exit if run(r) else scalar
+        return enter
+
+    def fuse(self, index):
+        # one function running all the instructions of the block, compiled for this block only
+        instructions, jump = self.blocks[index]
+        statements, names, values = [], [], []
+        for i, (template, operands) in enumerate(instructions + [jump]):
+            statements.append(template.format(**dict((name, name + str(i)) for name in NAMES)))
+            names.extend(name + str(i) for name in operands)
+            values.extend(operands.values())
+        return compile_statements(statements, names)(*values)
+
+    def run(self, fp=None):
+        # what the program prints, written to fp if given, otherwise returned as a string
+        registers = self.registers = array.array('f', bytes(4 * len(self.names)))
+        output = self.output
+        del output[:]
+        code = self.code
+        end = self.end
+        pc = self.entry
+        try:
+            if self.max_steps is None:
+                while pc != end:
+                    pc = code[pc](registers)
+            else:
+                steps = self.max_steps
+                while pc != end:
+                    if not steps:
+                        fault("The program did not end within %d steps" % self.max_steps)
+                    steps -= 1
+                    pc = code[pc](registers)
+        except P2CVMError as e:
+            # what was printed before it failed
+            e.output = ''.join(output)
+            raise
+        if fp is None:
+            return ''.join(output)
+        fp.writelines(output)
+
+    def values(self):
+        # the variables and temporaries after the last run
+        return dict((name, self.registers[index]) for name, index in self.names.items())
+
+
+def execute(source, opt_level=0, max_steps=None, fp=None, _parser=None, vectorize=False):
+    # what a program prints when its C code is run, see P2CVM.run
+    if _parser is None:
+        from parser import P2CParser
+        _parser = P2CParser()
+    _parser.parse(source)
+    program = _parser.lower(opt_level, vectorize=vectorize)
+    vectorizer = None
+    if vectorize:
+        from vector import P2CVectorizer
+
+        vectorizer = P2CVectorizer(program, _parser.context.loops)
+        _parser.context.vector_report = vectorizer.report()
+    return P2CVM(program, max_steps, vectorizer).run(fp)
+
+
+def test_vm():
+    from parser import P2CParser
+
+    # the programs and what their C code prints when compiled by gcc, at every optimization level
+    programs = [
+        ("a = 0.1\nb = a * 3\nc = b - 0.3\nd = 16777216\nd += 1\n"
+         "print(\"%.10f \" a)\nprint(\"%.10e \" a * 3)\nprint(\"%.10e\\n\" c)\nprint(\"%f\\n\" d)\n",
+         "0.1000000015 3.0000001192e-01 1.1920929133e-08\n16777216.000000\n"),
+        ("z = 0\na = 1 / z\nb = -1 / z\nc = z / z\nd = a - a\n"
+         "print(\"[%+8.2f|\" a)\nprint(\"%-6e|\" a)\nprint(\"%05g]\\n\" a)\nprint(\"[%F \\\\ \" b)\n"
+         "print(\"%E]\\n\" b)\nprint(\"[%f \\\"\" c)\nprint(\"%G]\\n\" c)\nprint(\"%f\\n\" -c)\n"
+         "print(\"%f%%\\t\\101\\x42\\n\" d)\n",
+         "[    +inf|inf   |  inf]\n[-INF \\ -INF]\n[-nan \"-NAN]\nnan\n-nan%\tAB\n"),
+        ("x = 1\nn = 0\nwhile x > 0: { x = x / 2 n += 1 }\nprint(\"%g \" n)\nprint(\"%g\\n\" 1 / 3)\n"
+         "for i in range(0, 10, 3): { if i == 3: { print(\"three \") } elif (i > 5) && (i < 9): {"
+         " print(\"%.0f \" i) } else: { print(\"%#.3g \" i) } }\nprint(\"%f\\n\" (True < 2) + (True / True))\n",
+         "150 0.333333\n0.00 three 6 9.00 2.000000\n"),
+    ]
+    _parser = P2CParser()
+    for source, expected in programs:
+        for opt_level in (0, 1, 2):
+            if execute(source, opt_level, 10 ** 6, _parser=_parser) != expected:
+                return False
+
+    with open('program.py.txt') as _input:
+        output = execute(_input.read(), 0, _parser=_parser)
+    if output.count('\tI: ') != 55 or not output.endswith("Iteration 9.000000\n\tI: 0.000000\nC: 2.142857\n"):
+        return False
+
+    # undefined in C or not compiled by it
+    for source in ("a = 1\nwhile a > 0: { a += 1 }\n", "a = 1 % 2\n", "print(\"%d\" 1.5)\n", "a = True / False\n"):
+        try:
+            execute(source, 0, 1000, _parser=_parser)
+            return False
+        except P2CVMError:
+            pass
+    return True
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="run a program the way its C code runs, without a C compiler")
+    arg_parser.add_argument('input', nargs='?', default='program.py.txt', help="(default: %(default)s)")
+    arg_parser.add_argument('-O', dest='opt_level', type=int, choices=[0, 1, 2], default=0,
+                            help="optimization level, 1 folds constants, 2 also optimizes the SSA form")
+    arg_parser.add_argument('--max-steps', type=int, default=None,
+                            help="stop a program that runs more basic blocks than this")
+    arg_parser.add_argument('--vectorize', action='store_true',
+                            help="run the loops without dependences between iterations at once and print which")
+    arg_parser.add_argument('--test', action='store_true', help="only run the test of the virtual machine")
+    args = arg_parser.parse_args(argv)
+
+    if args.test:
+        if not test_vm():
+            raise Exception("[VM] Virtual machine test failed")
+        return 0
+    with open(args.input) as _input:
+        source = _input.read()
+    from parser import P2CParser
+
+    _parser = P2CParser()
+    try:
+        execute(source, args.opt_level, args.max_steps, sys.stdout, _parser, args.vectorize)
+    except P2CVMError as e:
+        sys.stdout.write(getattr(e, 'output', ''))
+        print("%s: error: %s" % (args.input, e), file=sys.stderr)
+        return 1
+    finally:
+        for line in _parser.vector_report:
+            print("%s: %s" % (args.input, line), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())